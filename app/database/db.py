@@ -1,9 +1,12 @@
 import os
+from typing import Any, Dict
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, AsyncEngine
 from sqlalchemy.orm import sessionmaker
 import logging
-from sqlalchemy import text
+from sqlalchemy import event, inspect
+from sqlalchemy.engine import make_url
+from app.services.metrics import instrument_engine
 
 logger = logging.getLogger(__name__)
 
@@ -12,14 +15,85 @@ DATABASE_URL = os.environ.get(
     "DATABASE_URL", 
     "sqlite+aiosqlite:///./sqlite_app.db"
 )
-logger.info(f"Используется база данных: {DATABASE_URL}")
+
+# Пул соединений PostgreSQL: размер, сверх пула, ожидание соединения (с),
+# пересоздание соединений (с) и проверка соединения перед выдачей из пула
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 20))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "true").lower() not in ("0", "false", "no")
+# Кэш подготовленных выражений asyncpg на соединение; 0 - выключен (нужно за pgbouncer)
+DB_STATEMENT_CACHE_SIZE = int(os.environ.get("DB_STATEMENT_CACHE_SIZE", 500))
+
+# SQLite: журнал WAL (читатели не блокируют писателя), synchronous, ожидание
+# снятия блокировки записи (мс) и размер отображения файла в память (байт)
+SQLITE_JOURNAL_MODE = os.environ.get("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", 5000))
+SQLITE_MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))
+
+logger.info("Используется база данных: %s", DATABASE_URL)
+
+
+def engine_options(url: str) -> Dict[str, Any]:
+    """Параметры create_async_engine для диалекта базы из url."""
+    # SQL-запросы логируются только при LOG_LEVEL=DEBUG
+    options: Dict[str, Any] = {"echo": False, "future": True}
+    if make_url(url).get_backend_name() == "postgresql":
+        options.update(
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+            pool_pre_ping=DB_POOL_PRE_PING,
+            connect_args={
+                # Кэш SQLAlchemy и собственный кэш asyncpg
+                "prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+                "statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+            },
+        )
+    return options
+
+
+def sqlite_pragmas() -> Dict[str, Any]:
+    """PRAGMA, выполняемые на каждом новом соединении SQLite."""
+    return {
+        "journal_mode": SQLITE_JOURNAL_MODE,
+        "synchronous": SQLITE_SYNCHRONOUS,
+        "busy_timeout": SQLITE_BUSY_TIMEOUT_MS,
+        "mmap_size": SQLITE_MMAP_SIZE,
+    }
+
+
+def make_engine(url: str) -> AsyncEngine:
+    """
+    Создает движок с настройками диалекта.
+    
+    Для SQLite на каждом новом соединении выполняются PRAGMA из
+    sqlite_pragmas(); для PostgreSQL настраиваются пул и кэш выражений.
+    """
+    db_engine = create_async_engine(url, **engine_options(url))
+    
+    if db_engine.dialect.name == "sqlite":
+        pragmas = sqlite_pragmas()
+        
+        @event.listens_for(db_engine.sync_engine, "connect")
+        def _set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            try:
+                for name, value in pragmas.items():
+                    cursor.execute(f"PRAGMA {name}={value}")
+            finally:
+                cursor.close()
+    
+    # Число и длительность SQL-запросов для /metrics
+    instrument_engine(db_engine.sync_engine)
+    return db_engine
+
 
 # Создаем движок базы данных
-engine = create_async_engine(
-    DATABASE_URL,
-    echo=True,
-    future=True
-)
+engine = make_engine(DATABASE_URL)
 
 # Создаем сессии
 async_session = sessionmaker(
@@ -29,31 +103,37 @@ async_session = sessionmaker(
 # Создаем базовый класс для моделей
 Base = declarative_base()
 
+# Путь к конфигурации миграций Alembic
+ALEMBIC_INI_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    "alembic.ini"
+)
+
+def _run_migrations(connection):
+    """Применяет миграции Alembic до последней версии схемы."""
+    from alembic import command
+    from alembic.config import Config
+    
+    # Таблицы, созданные до перехода на миграции (без alembic_version),
+    # пересоздавались при каждом запуске, поэтому данных в них нет
+    table_names = inspect(connection).get_table_names()
+    if table_names and "alembic_version" not in table_names:
+        logger.warning("Найдена схема без версии миграций, таблицы будут пересозданы")
+        import app.models.models  # noqa: F401 - регистрирует модели в Base.metadata
+        Base.metadata.drop_all(connection)
+    
+    config = Config(ALEMBIC_INI_PATH)
+    config.set_main_option("script_location", os.path.join(os.path.dirname(ALEMBIC_INI_PATH), "migrations"))
+    config.attributes["connection"] = connection
+    command.upgrade(config, "head")
+
 # Инициализация базы данных
 async def init_db():
-    """Инициализирует базу данных, создавая все таблицы."""
+    """Приводит схему базы данных к последней версии миграций."""
     async with engine.begin() as conn:
-        # Полностью удаляем все существующие таблицы и создаем заново
-        try:
-            # Получаем список всех таблиц
-            await conn.execute(text("PRAGMA foreign_keys = OFF"))
-            
-            # Удаляем таблицы вручную для обеспечения правильного порядка
-            await conn.execute(text("DROP TABLE IF EXISTS model_settings"))
-            await conn.execute(text("DROP TABLE IF EXISTS messages"))
-            await conn.execute(text("DROP TABLE IF EXISTS chats"))
-            await conn.execute(text("DROP TABLE IF EXISTS prompt_templates"))
-            await conn.execute(text("DROP TABLE IF EXISTS models"))
-            
-            logger.info("Существующие таблицы удалены для обновления схемы")
-        except Exception as e:
-            logger.error(f"Ошибка при удалении таблиц: {e}")
-        
-        # Создаем все таблицы заново
-        await conn.run_sync(Base.metadata.create_all)
-        await conn.execute(text("PRAGMA foreign_keys = ON"))
+        await conn.run_sync(_run_migrations)
     
-    logger.info("База данных инициализирована с обновленной схемой")
+    logger.info("База данных инициализирована, схема актуальна")
 
 # Функция для получения сессии базы данных
 async def get_db():
@@ -61,4 +141,9 @@ async def get_db():
         try:
             yield session
         finally:
-            await session.close() 
\ No newline at end of file
+            await session.close()
+
+# Фабрика сессий для обработчиков, которые открывают короткие сессии сами
+# (WebSocket держит соединение долго, а сессию - только на время операции)
+def get_session_factory():
+    return async_session
@@ -75,5 +75,6 @@ async def seed_default_prompts(db: AsyncSession):
                 description=template_data["description"],
                 user_prompt=template_data["user_prompt"]
             )
+    await db.commit()
     
     return True 
\ No newline at end of file
@@ -0,0 +1,128 @@
+import os
+import sys
+import json
+import atexit
+import logging
+import datetime
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+from typing import Dict, Optional
+
+# Общий уровень, формат (json/text), файл и уровни отдельных модулей:
+# LOG_LEVELS="app.routes.chat_routes=DEBUG,sqlalchemy.engine=INFO"
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")
+LOG_FILE = os.environ.get("LOG_FILE", "")
+LOG_LEVELS = os.environ.get("LOG_LEVELS", "")
+
+# Атрибуты LogRecord, которые не считаются пользовательскими полями (extra)
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "color_message"}
+
+_listener: Optional[QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-запись на строку; поля из extra попадают в запись как есть."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                data[key] = value
+        if record.exc_text:
+            data["exc_info"] = record.exc_text
+        elif record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class _LazyQueueHandler(QueueHandler):
+    """
+    QueueHandler, который не форматирует запись в потоке event loop.
+
+    Стандартный prepare() прогоняет запись через форматтер; здесь только
+    подставляются аргументы сообщения и трассировка исключения, а
+    сериализация и запись в файл выполняются в потоке QueueListener.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def parse_levels(spec: str) -> Dict[str, str]:
+    """Разбирает строку вида "module=LEVEL,module2=LEVEL" в словарь."""
+    levels = {}
+    for item in spec.split(","):
+        if "=" in item:
+            name, level = item.split("=", 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def setup_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT, log_file: str = LOG_FILE,
+                  levels: str = LOG_LEVELS):
+    """
+    Настраивает логирование процесса: корневой логгер пишет в очередь,
+    обработчики (stderr и, при необходимости, файл) работают в отдельном
+    потоке QueueListener. Повторный вызов ничего не делает.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    if fmt == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    handlers = [logging.StreamHandler(sys.stderr)]
+    if log_file:
+        handlers.append(logging.FileHandler(log_file, encoding="utf-8"))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    queue = SimpleQueue()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_LazyQueueHandler(queue))
+    root.setLevel(level.upper())
+
+    # Логи uvicorn идут через ту же очередь
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        uvicorn_logger = logging.getLogger(name)
+        uvicorn_logger.handlers.clear()
+        uvicorn_logger.propagate = True
+
+    # SQLAlchemy пишет каждый запрос на уровне INFO своего логгера;
+    # показываем их только в отладочном режиме
+    logging.getLogger("sqlalchemy.engine").setLevel(
+        logging.INFO if root.level <= logging.DEBUG else logging.WARNING
+    )
+
+    for name, module_level in parse_levels(levels).items():
+        logging.getLogger(name).setLevel(module_level)
+
+    _listener = QueueListener(queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Дописывает оставшиеся в очереди записи и останавливает поток логирования."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
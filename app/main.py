@@ -5,18 +5,20 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.responses import HTMLResponse
 from fastapi.middleware.cors import CORSMiddleware
-from app.database.db import init_db
-from app.routes import chat_routes, model_routes, template_routes
+from app.logging_config import setup_logging
+from app.database.db import init_db, async_session
+from app.routes import chat_routes, model_routes, template_routes, health_routes, metrics_routes
+from app.services.ollama_service import ollama_service
+from app.services.model_catalog import model_catalog
+from app.services.startup import startup_warmup
+from app.services.response_cache import response_cache
+from app.services.live_generations import live_generations
+from app.services.chat_events import chat_events
+from app.services.message_writer import worker_heartbeat
+from app.services.metrics import MetricsMiddleware
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler("app.log")
-    ]
-)
+# Настройка логирования: запись в файл идет в отдельном потоке
+setup_logging(log_file=os.environ.get("LOG_FILE", "app.log"))
 logger = logging.getLogger(__name__)
 
 app = FastAPI()
@@ -30,6 +32,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Длительность запросов и число SQL-запросов для /metrics
+app.add_middleware(MetricsMiddleware)
+
 # Подключение статических файлов
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 
@@ -40,6 +45,8 @@ templates = Jinja2Templates(directory="app/templates")
 app.include_router(chat_routes.router)
 app.include_router(model_routes.router)
 app.include_router(template_routes.router)
+app.include_router(health_routes.router)
+app.include_router(metrics_routes.router)
 
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
@@ -50,10 +57,23 @@ async def startup_db_client():
     logger.info("Инициализация базы данных при запуске...")
     await init_db()
     
+    # Процесс отмечается живым; ответы упавших процессов помечаются прерванными
+    await worker_heartbeat.start()
+    
+    # Межпроцессная доставка событий чатов (LISTEN/NOTIFY для postgres)
+    await chat_events.start()
+    
+    # Открываем общий пул соединений к Ollama
+    await ollama_service.start()
+    
+    # Шаблоны и каталог моделей подготавливаются без задержки открытия порта
+    await startup_warmup.launch(warm_up())
+    
+    logger.info("Инициализация базы данных завершена")
+
+async def warm_up():
     # Создание начальных шаблонов промптов, если их еще нет
-    from sqlalchemy.ext.asyncio import AsyncSession
-    from app.database.db import async_session
-    from app.models.models import PromptTemplate, ChatModel, ModelSettings
+    from app.models.models import PromptTemplate
     
     async with async_session() as session:
         # Создаем шаблоны промптов
@@ -97,73 +117,22 @@ async def startup_db_client():
                 description="Веселый собеседник с хорошим чувством юмора.",
                 user_prompt="Расскажи что-нибудь смешное о программистах."
             )
+            await session.commit()
             
             logger.info("Начальные шаблоны промптов созданы.")
             
-        # Обновляем информацию о моделях через Ollama API
-        try:
-            # Создаем экземпляр OllamaService
-            from app.services.ollama_service import OllamaService
-            ollama_service = OllamaService()
-            
-            # Получаем список моделей из API
-            api_models = await ollama_service.list_models()
-            logger.info(f"Получено {len(api_models)} моделей из Ollama API")
-            
-            # Обрабатываем модели
-            for api_model in api_models:
-                model_name = api_model.get("name")
-                if not model_name:
-                    continue
-                
-                # Проверяем, существует ли модель в БД
-                model = await ChatModel.get_by_name(session, model_name)
-                
-                # Получаем информацию о размере параметров
-                details = api_model.get("details", {})
-                parameter_size = details.get("parameter_size", "Неизвестно")
-                
-                # Если модель не существует, создаем ее
-                if not model:
-                    model = await ChatModel.create(
-                        session,
-                        name=model_name,
-                        display_name=model_name,
-                        description=f"Модель {model_name} ({parameter_size})"
-                    )
-                    
-                    # Создаем настройки по умолчанию
-                    # Получаем шаблон "Личный ассистент Артём"
-                    artem_template = None
-                    templates = await PromptTemplate.get_all(session)
-                    for template in templates:
-                        if template.name == "Личный ассистент Артём":
-                            artem_template = template
-                            break
-                    
-                    if artem_template:
-                        await ModelSettings.create(
-                            session,
-                            model_id=model.id,
-                            temperature="0.7",
-                            top_p="0.9",
-                            top_k="40",
-                            max_tokens="1024",
-                            system_prompt=artem_template.system_prompt
-                        )
-                    else:
-                        await ModelSettings.create(
-                            session,
-                            model_id=model.id,
-                            temperature="0.7",
-                            top_p="0.9",
-                            top_k="40",
-                            max_tokens="1024",
-                            system_prompt="Ты полезный помощник по имени Артём. Отвечай на вопросы пользователя дружелюбно и информативно."
-                        )
-            
-            logger.info("Модели успешно обновлены из Ollama API")
-        except Exception as e:
-            logger.error(f"Ошибка при обновлении моделей: {str(e)}", exc_info=True)
-    
-    logger.info("Инициализация базы данных завершена") 
\ No newline at end of file
+    # Синхронизируем каталог моделей с Ollama API и продолжаем обновлять его в фоне
+    await model_catalog.refresh()
+    model_catalog.start(immediate=False)
+
+@app.on_event("shutdown")
+async def shutdown_ollama_client():
+    await startup_warmup.stop()
+    await model_catalog.stop()
+    # Прерываем идущие генерации, частичные ответы сохраняются
+    await live_generations.stop()
+    await worker_heartbeat.stop()
+    await chat_events.stop()
+    # Закрываем пул соединений к Ollama
+    await ollama_service.close()
+    await response_cache.close()
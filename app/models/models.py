@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, Text, Float, ForeignKey, DateTime, Boolean
+from sqlalchemy import Column, Integer, String, Text, Float, ForeignKey, DateTime, Boolean, Index, and_, or_, delete, update, literal, false
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.sql import func
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
@@ -11,13 +12,24 @@ from app.database.db import Base
 
 logger = logging.getLogger(__name__)
 
+# Статусы записи сообщения: ответ модели еще дописывается / записан целиком
+MESSAGE_STREAMING = "streaming"
+MESSAGE_COMPLETE = "complete"
+
+
+def _upsert(db: AsyncSession, model):
+    """INSERT с поддержкой ON CONFLICT для диалекта текущего подключения."""
+    if db.bind.dialect.name == "postgresql":
+        return postgresql.insert(model)
+    return sqlite.insert(model)
+
 
 class Chat(Base):
     __tablename__ = "chats"
 
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String(255), index=True)
-    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
     model_id = Column(Integer, ForeignKey("models.id"))
     messages = relationship("Message", back_populates="chat", cascade="all, delete-orphan")
     model = relationship("ChatModel")
@@ -36,8 +48,7 @@ class Chat(Base):
     async def create(cls, db: AsyncSession, title: str, model_id: int = None):
         chat = cls(title=title, model_id=model_id)
         db.add(chat)
-        await db.commit()
-        await db.refresh(chat)
+        await db.flush()
         return chat
     
     @classmethod
@@ -45,8 +56,7 @@ class Chat(Base):
         chat = await cls.get_by_id(db, chat_id)
         if chat:
             chat.title = title
-            await db.commit()
-            await db.refresh(chat)
+            await db.flush()
         return chat
     
     @classmethod
@@ -54,19 +64,32 @@ class Chat(Base):
         chat = await cls.get_by_id(db, chat_id)
         if chat:
             await db.delete(chat)
-            await db.commit()
+            await db.flush()
             return True
         return False
 
 
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        # Выборка истории чата (keyset-пагинация по created_at)
+        Index("ix_messages_chat_id_created_at", "chat_id", "created_at"),
+    )
+
+    # Значения по умолчанию со стороны БД возвращаются через RETURNING при вставке
+    __mapper_args__ = {"eager_defaults": True}
 
     id = Column(Integer, primary_key=True, index=True)
     chat_id = Column(Integer, ForeignKey("chats.id"))
     role = Column(String(50))
     content = Column(Text)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    # Ответ модели прерван (клиент отключился или остановил генерацию)
+    truncated = Column(Boolean, default=False, server_default=false(), nullable=False)
+    # streaming - ответ модели дописывается по частям, complete - записан целиком
+    status = Column(String(20), default=MESSAGE_COMPLETE, server_default=MESSAGE_COMPLETE, nullable=False)
+    # Процесс, который дописывает ответ в статусе streaming (см. Worker)
+    writer_id = Column(String(32), nullable=True)
     
     chat = relationship("Chat", back_populates="messages")
 
@@ -78,13 +101,114 @@ class Message(Base):
         return result.scalars().all()
 
     @classmethod
-    async def create(cls, db: AsyncSession, chat_id: int, role: str, content: str):
-        message = cls(chat_id=chat_id, role=role, content=content)
+    async def get_recent(cls, db: AsyncSession, chat_id: int, limit: int = 50):
+        """Последние limit сообщений чата в хронологическом порядке."""
+        return await cls.get_page(db, chat_id, limit=limit)
+
+    @classmethod
+    async def get_page(cls, db: AsyncSession, chat_id: int, before: int = None, after: int = None, limit: int = 50):
+        """
+        Страница сообщений чата с keyset-пагинацией по (created_at, id).
+
+        before - вернуть limit сообщений, предшествующих сообщению с этим id;
+        after - вернуть limit сообщений, следующих за ним; без курсора -
+        последние limit сообщений. Результат всегда в хронологическом порядке.
+        """
+        query = select(cls).filter(cls.chat_id == chat_id)
+        cursor_id = after if after is not None else before
+        if cursor_id is not None:
+            cursor_created_at = (
+                select(cls.created_at).filter(cls.id == cursor_id).scalar_subquery()
+            )
+            if after is not None:
+                query = query.filter(or_(
+                    cls.created_at > cursor_created_at,
+                    and_(cls.created_at == cursor_created_at, cls.id > cursor_id)
+                ))
+            else:
+                query = query.filter(or_(
+                    cls.created_at < cursor_created_at,
+                    and_(cls.created_at == cursor_created_at, cls.id < cursor_id)
+                ))
+
+        if after is not None:
+            result = await db.execute(query.order_by(cls.created_at, cls.id).limit(limit))
+            return result.scalars().all()
+
+        result = await db.execute(query.order_by(cls.created_at.desc(), cls.id.desc()).limit(limit))
+        return list(reversed(result.scalars().all()))
+
+    @classmethod
+    async def count_by_chat_id(cls, db: AsyncSession, chat_id: int) -> int:
+        result = await db.execute(select(func.count(cls.id)).filter(cls.chat_id == chat_id))
+        return result.scalar_one()
+
+    @classmethod
+    def new(cls, chat_id: int, role: str, content: str, truncated: bool = False, status: str = MESSAGE_COMPLETE,
+            writer_id: str = None):
+        """
+        Несохраненное сообщение со временем создания на момент вызова.
+        
+        Добавляется в сессию вместе с остальными изменениями операции,
+        например сообщение пользователя - вместе с ответом модели.
+        """
+        return cls(chat_id=chat_id, role=role, content=content, truncated=truncated, status=status,
+                   writer_id=writer_id, created_at=datetime.datetime.utcnow())
+
+    @classmethod
+    async def create(cls, db: AsyncSession, chat_id: int, role: str, content: str, truncated: bool = False,
+                     status: str = MESSAGE_COMPLETE, writer_id: str = None):
+        message = cls.new(chat_id, role, content, truncated, status, writer_id)
         db.add(message)
-        await db.commit()
-        await db.refresh(message)
+        await db.flush()
         return message
 
+    @classmethod
+    async def append_content(cls, db: AsyncSession, message_id: int, text: str):
+        """Дописывает text в конец содержимого одним UPDATE, без чтения строки."""
+        await db.execute(
+            update(cls).where(cls.id == message_id).values(content=cls.content + text)
+        )
+
+    @classmethod
+    async def close_orphaned(cls, db: AsyncSession, heartbeat_before: datetime.datetime) -> int:
+        """
+        Завершает ответы в статусе streaming, процесс которых упал: он не
+        отмечался в workers с heartbeat_before. Ответы помечаются complete
+        и truncated; ответы живых процессов не трогаются.
+        """
+        alive = select(Worker.id).where(Worker.heartbeat_at >= heartbeat_before)
+        result = await db.execute(
+            update(cls)
+            .where(cls.status == MESSAGE_STREAMING, or_(cls.writer_id.is_(None), cls.writer_id.not_in(alive)))
+            .values(status=MESSAGE_COMPLETE, truncated=True)
+        )
+        return result.rowcount
+
+
+class Worker(Base):
+    """Процесс приложения, который пишет ответы модели, и время его последней отметки."""
+    __tablename__ = "workers"
+
+    id = Column(String(32), primary_key=True)
+    heartbeat_at = Column(DateTime, nullable=False)
+
+    @classmethod
+    async def heartbeat(cls, db: AsyncSession, worker_id: str):
+        now = datetime.datetime.utcnow()
+        insert_worker = _upsert(db, cls).values(id=worker_id, heartbeat_at=now)
+        await db.execute(insert_worker.on_conflict_do_update(
+            index_elements=[cls.id], set_={"heartbeat_at": now}
+        ))
+
+    @classmethod
+    async def remove(cls, db: AsyncSession, worker_id: str):
+        await db.execute(delete(cls).where(cls.id == worker_id))
+
+    @classmethod
+    async def remove_stale(cls, db: AsyncSession, heartbeat_before: datetime.datetime):
+        await db.execute(delete(cls).where(cls.heartbeat_at < heartbeat_before))
+
 
 class ChatModel(Base):
     __tablename__ = "models"
@@ -114,8 +238,7 @@ class ChatModel(Base):
         
         model = cls(name=name, display_name=display_name, description=description)
         db.add(model)
-        await db.commit()
-        await db.refresh(model)
+        await db.flush()
         return model
     
     @classmethod
@@ -124,11 +247,80 @@ class ChatModel(Base):
         return result.scalars().first()
     
     async def save(self, db: AsyncSession):
-        """Сохраняет модель в базе данных."""
+        """Добавляет модель в текущую операцию (фиксирует вызывающий код)."""
         db.add(self)
-        await db.commit()
-        await db.refresh(self)
+        await db.flush()
         return self
+    
+    @classmethod
+    async def sync(cls, db: AsyncSession, api_models: list, system_prompt: str):
+        """
+        Синхронизирует таблицу моделей со списком /api/tags (фиксирует
+        транзакцию вызывающий код).
+        
+        Новые модели и их настройки вставляются пакетно через
+        INSERT ... ON CONFLICT, описание обновляется при смене parameter_size,
+        исчезнувшие из Ollama модели удаляются, если на них не ссылаются чаты.
+        Возвращает количество добавленных, обновленных и удаленных моделей.
+        """
+        rows = {}
+        for api_model in api_models:
+            name = api_model.get("name")
+            if not name:
+                logger.warning("Пропуск модели без имени: %s", api_model)
+                continue
+            parameter_size = (api_model.get("details") or {}).get("parameter_size", "Неизвестно")
+            rows[name] = {
+                "name": name,
+                "display_name": name,
+                "description": f"Модель {name} ({parameter_size})",
+            }
+        
+        result = await db.execute(select(cls.id, cls.name, cls.description))
+        existing = {name: (model_id, description) for model_id, name, description in result.all()}
+        
+        stats = {
+            "added": len(rows.keys() - existing.keys()),
+            "updated": sum(1 for name, row in rows.items()
+                           if name in existing and existing[name][1] != row["description"]),
+            "removed": 0,
+        }
+        
+        if rows:
+            insert_models = _upsert(db, cls).values(list(rows.values()))
+            await db.execute(insert_models.on_conflict_do_update(
+                index_elements=[cls.name],
+                set_={"description": insert_models.excluded.description},
+                where=cls.description.is_distinct_from(insert_models.excluded.description),
+            ))
+            
+            # Настройки по умолчанию для всех моделей, у которых их еще нет
+            missing = (
+                select(cls.id, literal(system_prompt))
+                .outerjoin(ModelSettings, ModelSettings.model_id == cls.id)
+                .where(ModelSettings.id.is_(None))
+            )
+            insert_settings = _upsert(db, ModelSettings).from_select(
+                [ModelSettings.model_id, ModelSettings.system_prompt], missing
+            )
+            await db.execute(insert_settings.on_conflict_do_nothing(index_elements=[ModelSettings.model_id]))
+        
+        # Пустой список от Ollama не повод очищать каталог
+        vanished = [model_id for name, (model_id, _) in existing.items() if name not in rows] if rows else []
+        if vanished:
+            result = await db.execute(
+                select(Chat.model_id).where(Chat.model_id.in_(vanished)).distinct()
+            )
+            in_use = set(result.scalars().all())
+            removable = [model_id for model_id in vanished if model_id not in in_use]
+            if in_use:
+                logger.info("Модели %s отсутствуют в Ollama, но используются в чатах и сохранены", sorted(in_use))
+            if removable:
+                await db.execute(delete(ModelSettings).where(ModelSettings.model_id.in_(removable)))
+                await db.execute(delete(cls).where(cls.id.in_(removable)))
+                stats["removed"] = len(removable)
+        
+        return stats
 
 
 class ModelSettings(Base):
@@ -136,10 +328,15 @@ class ModelSettings(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     model_id = Column(Integer, ForeignKey("models.id"), unique=True)
-    temperature = Column(String(10), default="0.7")
-    top_p = Column(String(10), default="0.9")
-    top_k = Column(String(10), default="40")
-    max_tokens = Column(String(10), default="1024")
+    temperature = Column(Float, default=0.7)
+    top_p = Column(Float, default=0.9)
+    top_k = Column(Integer, default=40)
+    max_tokens = Column(Integer, default=1024)
+    # Размер контекстного окна модели (бюджет токенов на историю чата)
+    context_tokens = Column(Integer, default=4096)
+    repeat_penalty = Column(Float, default=1.1)
+    # Время, на которое Ollama держит модель в памяти после запроса ("5m", "1h", "-1")
+    keep_alive = Column(String(20), default="5m")
     system_prompt = Column(Text, default="Вы полезный помощник.")
     
     model = relationship("ChatModel", back_populates="settings")
@@ -151,14 +348,9 @@ class ModelSettings(Base):
     
     @classmethod
     async def get_by_model_id(cls, db: AsyncSession, model_id: int):
+        """Настройки модели или None; строка с настройками по умолчанию создается только при сохранении."""
         result = await db.execute(select(cls).filter(cls.model_id == model_id))
-        settings = result.scalars().first()
-        
-        # Если настройки не найдены, создаем их с дефолтными значениями
-        if not settings:
-            settings = await cls.create(db, model_id)
-        
-        return settings
+        return result.scalars().first()
     
     @classmethod
     async def get_default_for_model(cls, db: AsyncSession, model_name: str):
@@ -171,18 +363,16 @@ class ModelSettings(Base):
         return result.scalars().first()
     
     @classmethod
-    async def create(cls, db: AsyncSession, model_id: int, temperature: str = "0.7", top_p: str = "0.9", top_k: str = "40", max_tokens: str = "1024", system_prompt: str = "Вы полезный помощник."):
-        settings = cls(model_id=model_id, temperature=temperature, top_p=top_p, top_k=top_k, max_tokens=max_tokens, system_prompt=system_prompt)
+    async def create(cls, db: AsyncSession, model_id: int, temperature: float = 0.7, top_p: float = 0.9, top_k: int = 40, max_tokens: int = 1024, system_prompt: str = "Вы полезный помощник.", context_tokens: int = 4096, repeat_penalty: float = 1.1, keep_alive: str = "5m"):
+        settings = cls(model_id=model_id, temperature=temperature, top_p=top_p, top_k=top_k, max_tokens=max_tokens, system_prompt=system_prompt, context_tokens=context_tokens, repeat_penalty=repeat_penalty, keep_alive=keep_alive)
         db.add(settings)
-        await db.commit()
-        await db.refresh(settings)
+        await db.flush()
         return settings
         
     async def save(self, db: AsyncSession):
-        """Сохраняет настройки модели в базе данных."""
+        """Добавляет настройки в текущую операцию (фиксирует вызывающий код)."""
         db.add(self)
-        await db.commit()
-        await db.refresh(self)
+        await db.flush()
         return self
 
 
@@ -210,7 +400,7 @@ class PromptTemplate(Base):
         template = await cls.get_by_id(db, template_id)
         if template:
             await db.delete(template)
-            await db.commit()
+            await db.flush()
             return True
         return False
     
@@ -223,13 +413,11 @@ class PromptTemplate(Base):
             user_prompt=user_prompt or ""
         )
         db.add(template)
-        await db.commit()
-        await db.refresh(template)
+        await db.flush()
         return template
         
     async def save(self, db: AsyncSession):
-        """Сохраняет шаблон промпта в базе данных."""
+        """Добавляет шаблон в текущую операцию (фиксирует вызывающий код)."""
         db.add(self)
-        await db.commit()
-        await db.refresh(self)
+        await db.flush()
         return self 
\ No newline at end of file
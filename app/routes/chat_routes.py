@@ -1,13 +1,34 @@
+import os
+import json
+import time
+import asyncio
 import logging
-from typing import List, Dict, Any, Optional
-from fastapi import APIRouter, Depends, Request, WebSocket, WebSocketDisconnect, HTTPException, Form, Body
-from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
+import contextlib
+from functools import partial
+from typing import List, Dict, Any, Awaitable, Callable, Optional, Set, Tuple
+import anyio
+from fastapi import APIRouter, Depends, Request, Response, WebSocket, WebSocketDisconnect, HTTPException, Form, Body, Query
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
+from starlette.background import BackgroundTask
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
 from pydantic import BaseModel
-from app.database.db import get_db
+from app.database.db import get_db, get_session_factory
 from app.models.models import Chat, Message, ChatModel, ModelSettings
-from app.services.ollama_service import OllamaService
+from app.services.ollama_service import GenerationError, OllamaService, StreamError, get_ollama_service
+from app.services.catalog_cache import catalog_cache, ModelInfo
+from app.services.model_catalog import model_catalog
+from app.services.frame_coalescer import FlushPolicy, FrameCoalescer
+from app.services.generation_scheduler import generation_scheduler, QueueFullError
+from app.services.generation_settings import GenerationSettings
+from app.services.response_cache import response_cache
+from app.services.live_generations import LiveGeneration, live_generations
+from app.services.message_writer import MessageWriter
+from app.services.chat_events import ChatSubscription, chat_events
+from app.services.metrics import WEBSOCKETS_ACTIVE
+from app.services.context_builder import ChatContextBuilder, DEFAULT_CONTEXT_TOKENS, CONTEXT_HISTORY_LIMIT
 
 # Настраиваем логгер
 logger = logging.getLogger(__name__)
@@ -20,6 +41,22 @@ class ChatCreate(BaseModel):
 # Схема для запроса сообщения
 class MessageRequest(BaseModel):
     content: str
+    # Кэш ответов: None - по умолчанию (только temperature 0), True/False - явно
+    cache: Optional[bool] = None
+
+# Размер страницы истории сообщений
+MESSAGES_PAGE_SIZE = 50
+MESSAGES_PAGE_MAX = 200
+
+# WebSocket: {"type": "ping"} после WS_PING_INTERVAL секунд молчания клиента,
+# закрытие после WS_IDLE_TIMEOUT секунд без его сообщений и предел открытых
+# сокетов на процесс (0 - отключить)
+WS_PING_INTERVAL = float(os.environ.get("WS_PING_INTERVAL", 30))
+WS_IDLE_TIMEOUT = float(os.environ.get("WS_IDLE_TIMEOUT", 600))
+WS_MAX_CONNECTIONS = int(os.environ.get("WS_MAX_CONNECTIONS", 1000))
+
+# Открытые WebSocket-соединения процесса
+_open_websockets = 0
 
 router = APIRouter(prefix="/chat", tags=["chat"])
 templates = Jinja2Templates(directory="app/templates")
@@ -61,9 +98,9 @@ async def create_chat(
     model_id: str = Form(None)
 ):
     """Создать новый чат"""
-    logger.info(f"ПОЛУЧЕН ЗАПРОС НА СОЗДАНИЕ ЧАТА")
-    logger.info(f"Form данные: title={title}, model_id={model_id}")
-    logger.info(f"JSON данные: {chat_data}")
+    logger.debug("ПОЛУЧЕН ЗАПРОС НА СОЗДАНИЕ ЧАТА")
+    logger.debug("Form данные: title=%s, model_id=%s", title, model_id)
+    logger.debug("JSON данные: %s", chat_data)
     
     try:
         # Используем Form данные, если они есть, иначе JSON
@@ -75,44 +112,32 @@ async def create_chat(
             raise HTTPException(status_code=400, detail="Не указаны данные для создания чата")
         
         # Логируем полученные данные
-        logger.info(f"Получены данные для создания чата: {chat_create_data.dict()}")
+        logger.debug("Получены данные для создания чата: %s", chat_create_data.dict())
         
         # Проверяем, существует ли модель с указанным ID
         try:
             model_id = int(chat_create_data.model_id)
-            logger.info(f"Преобразованный ID модели: {model_id}")
+            logger.debug("Преобразованный ID модели: %s", model_id)
         except ValueError as ve:
-            logger.error(f"Ошибка преобразования ID модели: {str(ve)}")
+            logger.error("Ошибка преобразования ID модели: %s", ve)
             raise HTTPException(status_code=400, detail=f"Неверный ID модели: {chat_create_data.model_id}")
         
         # Получаем модель
         model = await ChatModel.get_by_id(db, model_id)
-        logger.info(f"Результат запроса модели: {model}")
+        logger.debug("Результат запроса модели: %s", model)
         
-        # Если модель не найдена, попробуем обновить список моделей из API Ollama
+        # Если модель не найдена, запрашиваем фоновое обновление каталога из API Ollama
         if not model:
-            logger.warning(f"Модель с ID {model_id} не найдена. Пытаемся обновить список моделей из API Ollama")
-            
-            # Импортируем OllamaService для обновления моделей
-            from app.services.ollama_service import OllamaService
-            from app.routes.model_routes import refresh_models
-            
-            # Обновляем список моделей
-            await refresh_models(db)
-            
-            # Пробуем снова получить модель после обновления
-            model = await ChatModel.get_by_id(db, model_id)
-            
-            # Если модель все равно не найдена, возвращаем ошибку
-            if not model:
-                logger.error(f"Модель с ID {model_id} не найдена даже после обновления списка моделей")
-                raise HTTPException(status_code=404, detail=f"Модель с ID {model_id} не найдена. Пожалуйста, выберите другую модель.")
+            logger.warning("Модель с ID %s не найдена. Запрошено обновление списка моделей из API Ollama", model_id)
+            model_catalog.trigger()
+            raise HTTPException(status_code=404, detail=f"Модель с ID {model_id} не найдена. Пожалуйста, выберите другую модель.")
         
         # Создаем новый чат с указанием модели
-        logger.info(f"Создание чата с названием: {chat_create_data.title} и моделью: {model_id}")
+        logger.debug("Создание чата с названием: %s и моделью: %s", chat_create_data.title, model_id)
         chat = await Chat.create(db, chat_create_data.title, model_id)
+        await db.commit()
         
-        logger.info(f"Успешно создан чат: ID={chat.id}, title={chat.title}, model_id={chat.model_id}")
+        logger.info("Успешно создан чат: ID=%s, title=%s, model_id=%s", chat.id, chat.title, chat.model_id)
         
         # Если запрос был из формы - перенаправляем на страницу чата
         content_type = request.headers.get("content-type", "")
@@ -126,146 +151,322 @@ async def create_chat(
             "created_at": chat.created_at,
             "model_id": chat.model_id
         }
+    except HTTPException:
+        raise
     except ValueError as e:
-        logger.error(f"Ошибка при создании чата (ValueError): {str(e)}", exc_info=True)
+        logger.error("Ошибка при создании чата (ValueError): %s", e, exc_info=True)
         raise HTTPException(status_code=400, detail=f"Неверный ID модели: {str(e)}")
     except Exception as e:
-        logger.error(f"Ошибка при создании чата: {str(e)}", exc_info=True)
+        logger.error("Ошибка при создании чата: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail=f"Ошибка при создании чата: {str(e)}")
 
 @router.get("/chats/{chat_id}", response_class=HTMLResponse)
 async def get_chat(chat_id: int, request: Request, db: AsyncSession = Depends(get_db)):
     """Получить чат по ID"""
     try:
-        logger.info(f"Запрос чата с ID={chat_id}")
+        logger.debug("Запрос чата с ID=%s", chat_id)
         
         # Получаем чат по ID
         chat = await Chat.get_by_id(db, chat_id)
-        logger.info(f"Результат запроса чата: {chat}")
+        logger.debug("Результат запроса чата: %s", chat)
         
         if not chat:
-            logger.error(f"Чат с ID={chat_id} не найден")
+            logger.error("Чат с ID=%s не найден", chat_id)
             raise HTTPException(status_code=404, detail=f"Чат с ID={chat_id} не найден")
         
-        # Получаем все сообщения чата
-        messages = await Message.get_by_chat_id(db, chat_id)
-        logger.info(f"Получено {len(messages)} сообщений")
+        # Получаем последнюю страницу сообщений чата, остальные подгружаются при прокрутке
+        messages = await Message.get_recent(db, chat_id, MESSAGES_PAGE_SIZE)
+        logger.debug("Получено %d сообщений", len(messages))
         
         # Получаем список всех моделей
         models = await ChatModel.get_all(db)
-        logger.info(f"Получено {len(models)} моделей")
+        logger.debug("Получено %d моделей", len(models))
         
         # Возвращаем шаблон с данными
-        logger.info(f"Отправка шаблона chat.html с данными чата ID={chat_id}")
+        logger.debug("Отправка шаблона chat.html с данными чата ID=%s", chat_id)
         return templates.TemplateResponse(
             "chat.html", {
                 "request": request, 
                 "chat": chat,  # Имя переменной должно совпадать с используемым в шаблоне
                 "current_chat": chat,  # Для совместимости с обоими вариантами
                 "messages": messages, 
+                "messages_page_size": MESSAGES_PAGE_SIZE,
                 "models": models,
                 "chats": [chat]  # Для сайдбара, чтобы избежать ошибки с несуществующей переменной
             }
         )
     except Exception as e:
-        logger.error(f"Ошибка при получении чата: {str(e)}", exc_info=True)
+        logger.error("Ошибка при получении чата: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail=f"Ошибка при получении чата: {str(e)}")
 
+def _message_to_dict(message: Message) -> Dict[str, Any]:
+    """Представление сообщения для ответа API"""
+    return {
+        "id": message.id,
+        "content": message.content,
+        "role": message.role,
+        "created_at": message.created_at,
+        "truncated": message.truncated,
+        "status": message.status
+    }
+
+async def _resolve_model(db: AsyncSession, chat_id: int) -> Tuple[ModelInfo, GenerationSettings]:
+    """Модель чата и ее настройки (чат, модель и настройки читаются из кэша)"""
+    # Проверяем, существует ли чат
+    chat = await catalog_cache.get_chat(db, chat_id)
+    if not chat:
+        raise HTTPException(status_code=404, detail="Чат не найден")
+    
+    # Получаем модель, связанную с чатом
+    model = await catalog_cache.get_model(db, model_id=chat.model_id)
+    if not model:
+        raise HTTPException(status_code=404, detail="Модель не найдена")
+    
+    # Получаем настройки модели
+    return model, await catalog_cache.get_settings(db, model.id)
+
+async def _prepare_generation(db: AsyncSession, chat_id: int, content: str) -> Dict[str, Any]:
+    """
+    Собирает параметры генерации ответа на новое сообщение пользователя.
+    
+    Сообщение пользователя еще не добавлено в сессию: его сохраняет
+    вызывающий код вместе с ответом модели, чтобы не держать открытую
+    транзакцию записи на время генерации.
+    """
+    model, model_settings = await _resolve_model(db, chat_id)
+    
+    user_message = Message.new(chat_id, "user", content)
+    history, offset = await _load_history(db, chat_id, user_message)
+    
+    return {
+        "user_message": user_message,
+        "generation": _build_generation(model, model_settings, history, offset)
+    }
+
+async def _load_history(db: AsyncSession, chat_id: int, pending: Optional[Message] = None):
+    """
+    Загружает хвост истории чата для сборки контекста.
+    
+    pending - еще не сохраненное сообщение пользователя, оно добавляется
+    в конец истории. Возвращает сообщения и позицию первого из них в
+    полной истории.
+    """
+    history = await Message.get_recent(db, chat_id, CONTEXT_HISTORY_LIMIT)
+    offset = 0
+    if len(history) >= CONTEXT_HISTORY_LIMIT:
+        offset = await Message.count_by_chat_id(db, chat_id) - len(history)
+    if pending is not None:
+        history = [*history, pending]
+    return history, offset
+
+def _build_generation(model: ModelInfo, model_settings: GenerationSettings, history, offset: int = 0) -> Dict[str, Any]:
+    """Параметры вызова chat_stream для модели и истории чата"""
+    # Окно истории, укладывающееся в бюджет токенов модели
+    builder = ChatContextBuilder(
+        context_tokens=model_settings.context_tokens or DEFAULT_CONTEXT_TOKENS,
+        reserve_tokens=model_settings.max_tokens
+    )
+    
+    return {
+        "model": model.name,
+        "messages": builder.build(model_settings.system_prompt, history, offset),
+        "options": model_settings.to_options(),
+        "keep_alive": model_settings.keep_alive
+    }
+
 @router.post("/chats/{chat_id}/messages")
-async def add_message(chat_id: int, message: MessageRequest, db: AsyncSession = Depends(get_db)):
-    """Добавить сообщение в чат"""
+async def add_message(
+    chat_id: int,
+    message: MessageRequest,
+    db: AsyncSession = Depends(get_db),
+    session_factory: sessionmaker = Depends(get_session_factory),
+    ollama_service: OllamaService = Depends(get_ollama_service)
+):
+    """
+    Добавить сообщение в чат.
+    
+    Ответ модели читается потоком и сохраняется по частям (статус
+    streaming), клиенту возвращается целиком после завершения.
+    """
     try:
-        # Создаем экземпляр OllamaService
-        ollama_service = OllamaService()
-        
-        # Проверяем, существует ли чат
-        chat = await Chat.get_by_id(db, chat_id)
-        if not chat:
-            raise HTTPException(status_code=404, detail="Чат не найден")
-        
-        # Получаем модель, связанную с чатом
-        model = await ChatModel.get_by_id(db, chat.model_id)
-        if not model:
-            raise HTTPException(status_code=404, detail="Модель не найдена")
-        
-        # Получаем настройки модели
-        model_settings = await ModelSettings.get_by_model_id(db, model.id)
-        if not model_settings:
-            logger.warning(f"Настройки для модели {model.name} не найдены, используются значения по умолчанию")
-            system_prompt = "Вы полезный помощник по имени Артём."
-            temperature = 0.7
-            max_tokens = 1024
-        else:
-            system_prompt = model_settings.system_prompt
-            temperature = float(model_settings.temperature) if model_settings.temperature else 0.7
-            max_tokens = int(model_settings.max_tokens) if model_settings.max_tokens else 1024
-        
-        # Добавляем сообщение от пользователя
-        user_message = await Message.create(db, chat_id, "user", message.content)
-        
-        # Получаем все предыдущие сообщения для контекста
-        messages = await Message.get_by_chat_id(db, chat_id)
-        
-        # Формируем контекст из последних 5 сообщений
-        context_messages = []
-        for msg in messages[-10:]:  # берем последние 10 сообщений для контекста
-            context_messages.append(f"{msg.role}: {msg.content}")
-        
-        # Формируем полный промпт с контекстом
-        full_prompt = "\n".join(context_messages)
-        
-        logger.info(f"Вызов generate_completion с моделью {model.name}, промпт длиной {len(full_prompt)}")
-        
-        # Генерируем ответ модели
-        model_response = await ollama_service.generate_completion(
-            model=model.name,
-            prompt=full_prompt,
-            system_prompt=system_prompt,
-            temperature=temperature,
-            max_tokens=max_tokens
-        )
+        model, _ = await _resolve_model(db, chat_id)
+        if generation_scheduler.is_full(model.name):
+            raise QueueFullError(model.name)
+        
+        # История и настройки читаются до очереди, слот занимает только сама генерация
+        turn = await _prepare_generation(db, chat_id, message.content)
+        generation = turn["generation"]
+        # Место в очереди занимается до записи: при заполненной очереди - 429 без сообщения в чате
+        reservation = generation_scheduler.reserve(model.name, chat_id)
+        writer = MessageWriter(session_factory, chat_id)
+        try:
+            # Сообщение пользователя и строка ответа создаются одной транзакцией до слота
+            await writer.start(turn["user_message"])
+        except BaseException:
+            reservation.cancel()
+            raise
         
-        logger.info(f"Получен ответ от модели длиной {len(model_response)} символов")
+        logger.debug("Генерация ответа моделью %s, сообщений в контексте: %d", generation['model'], len(generation['messages']))
         
-        # Добавляем ответ модели в базу данных
-        assistant_message = await Message.create(db, chat_id, "assistant", model_response)
+        try:
+            # Ждем свободный слот генерации модели и держим его только на время вызова модели
+            async with generation_scheduler.slot(model.name, chat_id, reservation=reservation):
+                async for chunk in response_cache.stream(generation, ollama_service.chat_stream, message.cache):
+                    if isinstance(chunk, StreamError):
+                        raise GenerationError(chunk)
+                    await writer.push(chunk)
+        except BaseException:
+            # Пустой прерванный ответ (в том числе не дождавшийся слота) удаляется
+            with anyio.CancelScope(shield=True):
+                await writer.finish(truncated=True)
+            raise
+        
+        assistant_message = await writer.finish()
+        logger.debug("Получен ответ от модели длиной %d символов, промежуточных записей: %d", len(assistant_message.content), writer.flushes)
         
         return {
-            "user_message": {
-                "id": user_message.id,
-                "content": user_message.content,
-                "role": user_message.role,
-                "created_at": user_message.created_at
-            },
-            "assistant_message": {
-                "id": assistant_message.id,
-                "content": assistant_message.content,
-                "role": assistant_message.role,
-                "created_at": assistant_message.created_at
-            }
+            "user_message": _message_to_dict(turn["user_message"]),
+            "assistant_message": _message_to_dict(assistant_message)
         }
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except GenerationError as e:
+        # Полученная до ошибки часть ответа уже сохранена с truncated
+        logger.warning("Генерация для чата %s оборвалась: %s", chat_id, e)
+        raise HTTPException(status_code=502, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Ошибка при добавлении сообщения: {str(e)}", exc_info=True)
+        logger.error("Ошибка при добавлении сообщения: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail=f"Ошибка при добавлении сообщения: {str(e)}")
 
+@router.post("/chats/{chat_id}/messages/stream")
+async def add_message_stream(
+    chat_id: int,
+    message: MessageRequest,
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    session_factory: sessionmaker = Depends(get_session_factory),
+    ollama_service: OllamaService = Depends(get_ollama_service)
+):
+    """
+    Добавить сообщение в чат с потоковой передачей ответа модели.
+    
+    Формат выбирается по заголовку Accept: text/event-stream - Server-Sent
+    Events, иначе - NDJSON (по одному JSON-объекту на строку). Кадры те же,
+    что и в WebSocket: {"chunk": ..., "done": false}, затем
+    {"done": true, "full_response": ...}. Ответ сохраняется в БД по частям
+    по ходу генерации; если клиент отключился или Ollama вернула ошибку,
+    частичный ответ помечается truncated, а ошибка приходит кадром
+    {"error": ..., "done": true}.
+    Если очередь генерации модели заполнена, запрос отклоняется с 429.
+    """
+    model, _ = await _resolve_model(db, chat_id)
+    if generation_scheduler.is_full(model.name):
+        raise HTTPException(status_code=429, detail=str(QueueFullError(model.name)))
+    
+    turn = await _prepare_generation(db, chat_id, message.content)
+    generation = turn["generation"]
+    # Место в очереди занимается до записи: при заполненной очереди - 429 без сообщения в чате
+    try:
+        reservation = generation_scheduler.reserve(model.name, chat_id)
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    writer = MessageWriter(session_factory, chat_id)
+    try:
+        # Первый кадр несет id сообщения пользователя, поэтому оно фиксируется до генерации
+        db.add(turn["user_message"])
+        await db.commit()
+    except BaseException:
+        reservation.cancel()
+        raise
+    writer.publish_user_message(turn["user_message"])
+    use_sse = "text/event-stream" in request.headers.get("accept", "")
+    
+    def encode(frame: Dict[str, Any]) -> str:
+        data = json.dumps(jsonable_encoder(frame), ensure_ascii=False)
+        return f"data: {data}\n\n" if use_sse else f"{data}\n"
+    
+    async def stream():
+        yield encode({"type": "user_message", "message": _message_to_dict(turn["user_message"])})
+        
+        try:
+            # Строка ответа создается до слота, слот занимает только вызов модели
+            await writer.start()
+            async with generation_scheduler.slot(model.name, chat_id, reservation=reservation):
+                async for chunk in response_cache.stream(generation, ollama_service.chat_stream, message.cache):
+                    if isinstance(chunk, StreamError):
+                        raise GenerationError(chunk)
+                    await writer.push(chunk)
+                    yield encode({"chunk": chunk, "done": False})
+            
+            # Дописываем остаток и отмечаем ответ завершенным
+            assistant_message = await writer.finish()
+            yield encode({
+                "done": True,
+                "full_response": writer.text,
+                "message": _message_to_dict(assistant_message)
+            })
+        except asyncio.CancelledError:
+            # Клиент отключился: запрос к Ollama уже оборван, сохраняем то, что успели получить
+            with anyio.CancelScope(shield=True):
+                await writer.finish(truncated=True)
+            logger.info("Клиент отключился во время генерации для чата %s", chat_id)
+            raise
+        except GenerationError as e:
+            # Ошибка Ollama не попадает в текст ответа: полученная часть сохраняется с truncated
+            logger.warning("Генерация для чата %s оборвалась: %s", chat_id, e)
+            await writer.finish(truncated=True)
+            yield encode({"error": str(e), "done": True})
+        except Exception as e:
+            logger.error("Ошибка при потоковой генерации для чата %s: %s", chat_id, e, exc_info=True)
+            await writer.finish(truncated=True)
+            yield encode({"error": str(e), "done": True})
+    
+    async def release_reservation():
+        # Клиент отключился до начала потока: бронь не дошла до slot()
+        reservation.cancel()
+    
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream" if use_sse else "application/x-ndjson",
+        headers={
+            "Cache-Control": "no-cache",
+            # Отключаем буферизацию ответа в nginx
+            "X-Accel-Buffering": "no"
+        },
+        background=BackgroundTask(release_reservation)
+    )
+
 @router.get("/chats/{chat_id}/messages")
-async def get_messages(chat_id: int, db: AsyncSession = Depends(get_db)):
-    """Получить все сообщения чата"""
+async def get_messages(
+    chat_id: int,
+    response: Response,
+    before: Optional[int] = None,
+    after: Optional[int] = None,
+    limit: int = Query(MESSAGES_PAGE_SIZE, ge=1, le=MESSAGES_PAGE_MAX),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Получить страницу сообщений чата.
+    
+    Без курсора возвращает последние limit сообщений; before/after - id
+    сообщения, до или после которого нужна страница. Сообщения идут в
+    хронологическом порядке, заголовок X-Has-More сообщает, есть ли еще
+    сообщения в направлении запроса.
+    """
     chat = await Chat.get_by_id(db, chat_id)
     if not chat:
         raise HTTPException(status_code=404, detail="Чат не найден")
     
-    messages = await Message.get_by_chat_id(db, chat_id)
+    # Запрашиваем на одно сообщение больше, чтобы узнать, есть ли продолжение
+    messages = await Message.get_page(db, chat_id, before=before, after=after, limit=limit + 1)
+    has_more = len(messages) > limit
+    if has_more:
+        messages = messages[:limit] if after is not None else messages[1:]
+    response.headers["X-Has-More"] = "true" if has_more else "false"
     
-    return [
-        {
-            "id": message.id,
-            "content": message.content,
-            "role": message.role,
-            "created_at": message.created_at
-        } 
-        for message in messages
-    ]
+    return [_message_to_dict(message) for message in messages]
 
 @router.post("/{chat_id}/rename")
 async def rename_chat(chat_id: int, title: str = Form(...), db: AsyncSession = Depends(get_db)):
@@ -275,9 +476,8 @@ async def rename_chat(chat_id: int, title: str = Form(...), db: AsyncSession = D
         raise HTTPException(status_code=404, detail="Чат не найден")
     
     chat.title = title
-    db.add(chat)
     await db.commit()
-    await db.refresh(chat)
+    catalog_cache.invalidate_chat(chat_id)
     
     return {"id": chat.id, "title": chat.title}
 
@@ -287,25 +487,278 @@ async def delete_chat(chat_id: int, db: AsyncSession = Depends(get_db)):
     result = await Chat.delete(db, chat_id)
     if not result:
         raise HTTPException(status_code=404, detail="Чат не найден")
+    await db.commit()
+    catalog_cache.invalidate_chat(chat_id)
     
     return {"status": "success", "message": "Чат удален"}
 
+async def _wait_for_stop(websocket: WebSocket):
+    """
+    Читает сокет во время генерации.
+    
+    Возвращается на кадр {"type": "stop"}; при отключении клиента
+    выбрасывает WebSocketDisconnect.
+    """
+    while True:
+        data = await websocket.receive_json()
+        if data.get("type") == "stop":
+            return
+        if data.get("type") in ("ping", "pong"):
+            continue
+        await websocket.send_json({"error": "Дождитесь окончания ответа или отправьте stop"})
+
+async def _run_until_stopped(websocket: WebSocket, delivery: Awaitable[Any]) -> Tuple[bool, bool]:
+    """
+    Выполняет отправку ответа клиенту отдельной задачей, параллельно
+    слушая сокет.
+    
+    Кадр stop или отключение клиента прерывают отправку (но не саму
+    генерацию). Возвращает пару (получен stop, клиент отключился);
+    исключения отправки пробрасываются.
+    """
+    delivery_task = asyncio.ensure_future(delivery)
+    stop_task = asyncio.create_task(_wait_for_stop(websocket))
+    try:
+        await asyncio.wait({delivery_task, stop_task}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in (delivery_task, stop_task):
+            task.cancel()
+        await asyncio.wait({delivery_task, stop_task})
+    
+    stopped = disconnected = False
+    if not stop_task.cancelled():
+        if stop_task.exception() is None:
+            stopped = True
+        elif isinstance(stop_task.exception(), WebSocketDisconnect):
+            disconnected = True
+        else:
+            raise stop_task.exception()
+    
+    if not delivery_task.cancelled() and delivery_task.exception() is not None:
+        raise delivery_task.exception()
+    return stopped, disconnected
+
+async def _generate_and_save(
+    live: LiveGeneration,
+    session_factory: sessionmaker,
+    ollama_service: OllamaService,
+    generation: Dict[str, Any],
+    user_message: Message,
+    use_cache: Optional[bool],
+    on_position: Callable[[int], Awaitable[None]]
+):
+    """
+    Генерирует ответ в буфер повтора и сохраняет ход независимо от того,
+    подключен ли клиент. Ответ пишется в БД по частям с начала генерации,
+    прерванный ответ сохраняется с truncated; ход, отмененный еще в
+    очереди, не сохраняется.
+    """
+    writer = MessageWriter(session_factory, live.chat_id, generation_id=live.id)
+    truncated = False
+    try:
+        # Ждем слот генерации, пока ждем - сообщаем клиенту позицию в очереди
+        async with generation_scheduler.slot(generation["model"], live.chat_id, on_position=on_position):
+            # Сообщение пользователя и строка ответа создаются одной транзакцией
+            await writer.start(user_message)
+            # Потоковая передача ответа от модели (или из кэша ответов)
+            async for chunk in response_cache.stream(generation, ollama_service.chat_stream, use_cache):
+                if isinstance(chunk, StreamError):
+                    raise GenerationError(chunk)
+                live.append(chunk)
+                await writer.push(chunk)
+    except BaseException:
+        truncated = True
+        raise
+    finally:
+        if writer.message is not None:
+            if truncated:
+                logger.info("Генерация для чата %s прервана после %d символов", live.chat_id, len(writer.text))
+            # Пустой прерванный ответ удаляется
+            with anyio.CancelScope(shield=True):
+                await writer.finish(truncated)
+
+async def _deliver(websocket: WebSocket, live: LiveGeneration, offset: int, flush_policy: FlushPolicy):
+    """
+    Отправляет клиенту ответ генерации начиная с offset и финальный кадр
+    (при ошибке Ollama - с полем error).
+    
+    stop прерывает генерацию и дожидается сохранения частичного ответа;
+    при отключении клиента генерация продолжается без него.
+    """
+    async def send_chunk(text: str):
+        await websocket.send_json({"chunk": text, "done": False})
+    
+    coalescer = FrameCoalescer(send_chunk, flush_policy)
+    
+    async def follow():
+        # Токены склеиваются в кадры; ошибку Ollama клиент получит в финальном кадре
+        with contextlib.suppress(GenerationError):
+            async for chunk in live.follow(offset):
+                await coalescer.push(chunk)
+        await coalescer.close()
+    
+    stopped, disconnected = await _run_until_stopped(websocket, follow())
+    logger.debug("Ответ для чата %s: %d фрагментов в %d кадрах, в буфере отправки до %d байт",
+                 live.chat_id, coalescer.chunks_received, coalescer.frames_sent, coalescer.max_buffered)
+    if disconnected:
+        coalescer.discard()
+        logger.info("Клиент отключился, генерация %s для чата %s продолжается", live.id, live.chat_id)
+        raise WebSocketDisconnect()
+    
+    if stopped:
+        live.cancel()
+        await live.wait()
+    
+    # Досылаем остаток и сигнал о завершении потока
+    await coalescer.close()
+    frame = {
+        "done": True,
+        "full_response": live.text,
+        "truncated": live.truncated,
+        "generation_id": live.id
+    }
+    if isinstance(live.error, GenerationError):
+        frame["error"] = str(live.error)
+    await websocket.send_json(frame)
+
+async def _forward_chat_events(websocket: WebSocket, subscription: ChatSubscription, own: Set[str]):
+    """
+    Пересылает клиенту события чата ({"type": "chat_event", "event": ...}):
+    ответы, которые генерируются по запросам других вкладок и воркеров.
+    Генерации, которые этот сокет отправляет сам, пропускаются.
+    """
+    while True:
+        event = await subscription.get()
+        generation_id = event.get("generation_id")
+        if generation_id in own:
+            if event["type"] == "done":
+                own.discard(generation_id)
+            continue
+        try:
+            await websocket.send_json({"type": "chat_event", "event": event})
+        except Exception as e:
+            logger.debug("Пересылка событий чата %s остановлена: %s", subscription.chat_id, e)
+            return
+
+async def _receive_with_heartbeat(websocket: WebSocket) -> Optional[Dict[str, Any]]:
+    """
+    Ждет следующее сообщение клиента, пока ждет - шлет {"type": "ping"}
+    раз в WS_PING_INTERVAL секунд. Возвращает None, если клиент молчал
+    дольше WS_IDLE_TIMEOUT.
+    """
+    deadline = time.monotonic() + WS_IDLE_TIMEOUT if WS_IDLE_TIMEOUT > 0 else None
+    while True:
+        timeout = WS_PING_INTERVAL if WS_PING_INTERVAL > 0 else None
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        try:
+            return await asyncio.wait_for(websocket.receive_json(), timeout)
+        except asyncio.TimeoutError:
+            if WS_PING_INTERVAL > 0:
+                await websocket.send_json({"type": "ping"})
+
 @router.websocket("/ws/{chat_id}")
-async def websocket_endpoint(websocket: WebSocket, chat_id: int, db: AsyncSession = Depends(get_db)):
-    """WebSocket для потоковой передачи ответов модели"""
+async def websocket_endpoint(
+    websocket: WebSocket,
+    chat_id: int,
+    session_factory: sessionmaker = Depends(get_session_factory),
+    ollama_service: OllamaService = Depends(get_ollama_service)
+):
+    """
+    WebSocket для потоковой передачи ответов модели.
+    
+    Токены склеиваются в кадры по политике из query-строки рукопожатия:
+    ?flush=token|balanced|throughput или ?flush_ms=50&flush_bytes=1024.
+    Ответ модели читается с ее скоростью: пока медленный клиент принимает
+    кадр, токены копятся в буфере отправки и уходят следующим кадром.
+    
+    Каждая генерация получает id (кадр {"type": "generation", "id": ...})
+    и идет независимо от сокета: при отключении клиента ответ дописывается
+    и сохраняется. Переподключившийся клиент присылает {"type": "resume",
+    "generation_id": ..., "offset": N}, где N - число уже полученных
+    символов ответа, и получает недостающий текст, а затем живой поток.
+    Кадр {"type": "stop"} прерывает генерацию и запрос к Ollama, частичный
+    ответ сохраняется с флагом truncated.
+    
+    Сокет подписан на события чата: ответы, начатые из других вкладок,
+    по HTTP или на других воркерах, приходят кадрами
+    {"type": "chat_event", "event": ...} (см. ChatEventHub).
+    
+    Сессия БД открывается только на чтение в начале хода и на запись в
+    конце: простаивающий сокет и идущая генерация не занимают соединение
+    из пула. Молчащему клиенту сервер шлет ping и закрывает сокет по
+    простою; сверх WS_MAX_CONNECTIONS сокетов соединение закрывается с
+    кодом 1013.
+    """
+    global _open_websockets
     await websocket.accept()
+    if WS_MAX_CONNECTIONS > 0 and _open_websockets >= WS_MAX_CONNECTIONS:
+        logger.warning("Отклонено WebSocket-соединение для чата %s: открыто %d сокетов", chat_id, _open_websockets)
+        await websocket.send_json({"error": "Слишком много открытых соединений, повторите позже", "code": 503})
+        await websocket.close(code=1013)
+        return
+    
+    _open_websockets += 1
+    WEBSOCKETS_ACTIVE.inc()
+    flush_policy = FlushPolicy.from_handshake(websocket.query_params)
+    
+    async def send_position(position: int):
+        # Генерация переживает сокет: позиция в очереди отправляется, только пока он открыт
+        with contextlib.suppress(Exception):
+            await websocket.send_json({"type": "queued", "position": position})
+    
+    subscription: Optional[ChatSubscription] = None
+    forwarder: Optional[asyncio.Task] = None
+    # Генерации, которые сокет отправляет сам, - их события чата не пересылаются
+    own_generations: Set[str] = set()
     
     try:
         # Проверяем существование чата
-        chat = await Chat.get_by_id(db, chat_id)
+        async with session_factory() as db:
+            chat = await catalog_cache.get_chat(db, chat_id)
         if not chat:
             await websocket.send_json({"error": "Чат не найден"})
             await websocket.close()
             return
         
+        subscription = chat_events.subscribe(chat_id)
+        forwarder = asyncio.create_task(_forward_chat_events(websocket, subscription, own_generations))
+        
         while True:
             # Ожидаем сообщение от клиента
-            data = await websocket.receive_json()
+            data = await _receive_with_heartbeat(websocket)
+            if data is None:
+                logger.info("WebSocket для чата %s закрыт по простою", chat_id)
+                await websocket.close(code=1000, reason="idle timeout")
+                return
+            
+            # Отвечаем на ping клиента; pong и stop вне генерации ничего не делают
+            if data.get("type") == "ping":
+                await websocket.send_json({"type": "pong"})
+                continue
+            if data.get("type") in ("stop", "pong"):
+                continue
+            
+            # Продолжение генерации после переподключения
+            if data.get("type") == "resume":
+                live = live_generations.get(str(data.get("generation_id", "")))
+                if live is None or live.chat_id != chat_id:
+                    await websocket.send_json({"error": "Генерация не найдена или устарела", "code": 404})
+                    continue
+                try:
+                    offset = int(data.get("offset", 0))
+                except (TypeError, ValueError):
+                    offset = 0
+                if not live.done:
+                    own_generations.add(live.id)
+                try:
+                    await _deliver(websocket, live, offset, flush_policy)
+                except QueueFullError as e:
+                    await websocket.send_json({"error": str(e), "code": 429})
+                continue
             
             user_message = data.get("message", "")
             model_name = data.get("model", "")
@@ -316,70 +769,55 @@ async def websocket_endpoint(websocket: WebSocket, chat_id: int, db: AsyncSessio
                 })
                 continue
             
-            # Проверяем существование модели
-            model = await ChatModel.get_by_name(db, model_name)
+            # Чтение в начале хода: модель, ее настройки и история для контекста
+            async with session_factory() as db:
+                model = await catalog_cache.get_model(db, name=model_name)
+                if model:
+                    settings = await catalog_cache.get_settings(db, model.id)
+                    # Сообщение пользователя сохраняется вместе с ответом после генерации
+                    pending = Message.new(chat_id, "user", user_message)
+                    history, offset = await _load_history(db, chat_id, pending)
+            
             if not model:
                 await websocket.send_json({
                     "error": f"Модель '{model_name}' не найдена"
                 })
                 continue
             
-            # Получаем настройки модели
-            settings = await ModelSettings.get_by_model_id(db, model.id)
-            if not settings:
-                temperature = 0.7
-                max_tokens = 1024
-                system_prompt = "Вы полезный помощник."
-            else:
-                temperature = settings.temperature
-                max_tokens = settings.max_tokens
-                system_prompt = settings.system_prompt
-            
-            # Сохраняем сообщение пользователя
-            await Message.create(db, chat_id, "user", user_message)
-            
-            # Получаем историю сообщений для контекста
-            messages = await Message.get_by_chat_id(db, chat_id)
-            context = " ".join([msg.content for msg in messages[-5:] if msg.role == "user"])
-            
-            # Формируем промпт с контекстом предыдущих сообщений
-            prompt = f"Контекст предыдущих сообщений (если есть): {context}\n\nСообщение пользователя: {user_message}"
-            
-            # Создаем экземпляр сервиса Ollama
-            ollama_service = OllamaService()
-            
-            # Инициализируем буфер для полного ответа
-            full_response = ""
+            generation = _build_generation(model, settings, history, offset)
+            live = LiveGeneration(chat_id, model.name)
+            own_generations.add(live.id)
+            await websocket.send_json({"type": "generation", "id": live.id})
+            live_generations.start(live, partial(
+                _generate_and_save,
+                session_factory=session_factory,
+                ollama_service=ollama_service,
+                generation=generation,
+                user_message=pending,
+                use_cache=data.get("cache"),
+                on_position=send_position
+            ))
             
-            # Потоковая передача ответа от модели
-            async for chunk in ollama_service.generate_stream(
-                model=model_name,
-                prompt=prompt,
-                system_prompt=system_prompt,
-                temperature=temperature,
-                max_tokens=max_tokens
-            ):
-                full_response += chunk
-                await websocket.send_json({
-                    "chunk": chunk,
-                    "done": False
-                })
-            
-            # Сохраняем полный ответ в базу данных
-            await Message.create(db, chat_id, "assistant", full_response)
-            
-            # Отправляем сигнал о завершении потока
-            await websocket.send_json({
-                "done": True,
-                "full_response": full_response
-            })
+            try:
+                await _deliver(websocket, live, 0, flush_policy)
+            except QueueFullError as e:
+                await websocket.send_json({"error": str(e), "code": 429})
+                continue
             
     except WebSocketDisconnect:
-        logger.info(f"WebSocket отключен для чата {chat_id}")
+        logger.info("WebSocket отключен для чата %s", chat_id)
     except Exception as e:
-        logger.error(f"Ошибка в WebSocket для чата {chat_id}: {str(e)}", exc_info=True)
+        logger.error("Ошибка в WebSocket для чата %s: %s", chat_id, e, exc_info=True)
         await websocket.send_json({"error": str(e)})
         await websocket.close()
+    finally:
+        if forwarder is not None:
+            forwarder.cancel()
+            await asyncio.wait({forwarder})
+        if subscription is not None:
+            subscription.close()
+        _open_websockets -= 1
+        WEBSOCKETS_ACTIVE.dec()
 
 @router.get("/{chat_id}", response_class=HTMLResponse)
 async def get_chat_page(chat_id: int, request: Request, db: AsyncSession = Depends(get_db)):
@@ -390,7 +828,7 @@ async def get_chat_page(chat_id: int, request: Request, db: AsyncSession = Depen
     
     chats = await Chat.get_all(db)
     models = await ChatModel.get_all(db)
-    messages = await Message.get_by_chat_id(db, chat_id)
+    messages = await Message.get_recent(db, chat_id, MESSAGES_PAGE_SIZE)
     
     return templates.TemplateResponse(
         "index.html", {
@@ -414,11 +852,9 @@ async def edit_chat_page(chat_id: int, request: Request, db: AsyncSession = Depe
         # Получаем все доступные модели
         models = await ChatModel.get_all(db)
         
-        # Получаем текущие настройки модели
-        model_settings = await ModelSettings.get_by_model_id(db, chat.model_id)
-        if not model_settings:
-            # Если настроек нет, создаем дефолтные
-            model_settings = await ModelSettings.create(db, chat.model_id)
+        # Текущие настройки модели; если строки еще нет - значения по умолчанию,
+        # строка создается только при сохранении формы
+        model_settings = await catalog_cache.get_settings(db, chat.model_id)
         
         # Рендерим шаблон
         return templates.TemplateResponse(
@@ -430,7 +866,7 @@ async def edit_chat_page(chat_id: int, request: Request, db: AsyncSession = Depe
             }
         )
     except Exception as e:
-        logger.error(f"Ошибка при загрузке страницы редактирования чата: {str(e)}", exc_info=True)
+        logger.error("Ошибка при загрузке страницы редактирования чата: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail=f"Ошибка при загрузке страницы: {str(e)}")
 
 @router.post("/chats/{chat_id}/update", response_class=RedirectResponse)
@@ -464,11 +900,6 @@ async def update_chat(
             # Обновляем модель чата
             chat.model_id = model_id
         
-        # Сохраняем изменения чата
-        db.add(chat)
-        await db.commit()
-        await db.refresh(chat)
-        
         # Обновляем настройки модели
         model_settings = await ModelSettings.get_by_model_id(db, model_id)
         if not model_settings:
@@ -476,22 +907,24 @@ async def update_chat(
             model_settings = await ModelSettings.create(
                 db, 
                 model_id=model_id,
-                temperature=str(temperature),
-                max_tokens=str(max_tokens),
+                temperature=temperature,
+                max_tokens=max_tokens,
                 system_prompt=system_prompt
             )
         else:
             # Обновляем существующие настройки
-            model_settings.temperature = str(temperature)
-            model_settings.max_tokens = str(max_tokens)
+            model_settings.temperature = temperature
+            model_settings.max_tokens = max_tokens
             model_settings.system_prompt = system_prompt
-            
-            db.add(model_settings)
-            await db.commit()
-            await db.refresh(model_settings)
+        
+        # Чат и настройки модели сохраняются одной транзакцией
+        await db.commit()
+        
+        catalog_cache.invalidate_chat(chat_id)
+        catalog_cache.invalidate_model(model_id)
         
         # Перенаправляем обратно на страницу чата
         return RedirectResponse(url=f"/chat/chats/{chat_id}", status_code=303)
     except Exception as e:
-        logger.error(f"Ошибка при обновлении чата: {str(e)}", exc_info=True)
+        logger.error("Ошибка при обновлении чата: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail=f"Ошибка при обновлении чата: {str(e)}") 
\ No newline at end of file
@@ -0,0 +1,22 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from app.services.model_catalog import model_catalog
+from app.services.startup import startup_warmup
+
+router = APIRouter(prefix="/health", tags=["health"])
+
+@router.get("/live")
+async def liveness():
+    """Процесс запущен и принимает запросы"""
+    return {"status": "ok"}
+
+@router.get("/ready")
+async def readiness():
+    """Готовность к трафику: прогрев после запуска завершен"""
+    content = {
+        "status": "ready" if startup_warmup.ready else "starting",
+        "startup": startup_warmup.status(),
+        "catalog": model_catalog.status(),
+    }
+    return JSONResponse(content=content, status_code=200 if startup_warmup.ready else 503)
@@ -2,12 +2,19 @@ from fastapi import APIRouter, Depends, Request, HTTPException, Form
 from fastapi.responses import HTMLResponse, JSONResponse
 from fastapi.templating import Jinja2Templates
 from sqlalchemy.ext.asyncio import AsyncSession
+from dataclasses import replace
 from typing import Optional, List, Dict, Any
 import logging
 
 from app.database.db import get_db
 from app.models.models import ChatModel, ModelSettings, PromptTemplate
-from app.services.ollama_service import OllamaService
+from app.services.ollama_service import OllamaService, get_ollama_service
+from app.services.catalog_cache import catalog_cache
+from app.services.model_catalog import model_catalog
+from app.services.generation_scheduler import generation_scheduler
+from app.services.generation_settings import GenerationSettings
+from app.services.response_cache import response_cache
+from app.services.chat_events import chat_events
 from app.schemas.model_schema import ModelResponse
 
 # Настраиваем логгер
@@ -28,23 +35,16 @@ async def get_models_page(request: Request, db: AsyncSession = Depends(get_db)):
 async def list_models(db: AsyncSession = Depends(get_db)):
     """Получить список всех моделей"""
     try:
-        logger.info("Запрос на получение списка моделей")
+        logger.debug("Запрос на получение списка моделей")
         models = await ChatModel.get_all(db)
         
-        # Если моделей нет в БД, обновляем их из Ollama API и делаем повторную попытку
+        # Если моделей нет в БД, запрашиваем фоновое обновление из Ollama API
         if not models:
-            logger.info("В базе данных нет моделей. Автоматическое обновление из Ollama API.")
-            await refresh_models(db)  # Обновляем список моделей
-            
-            # Повторно запрашиваем модели из БД
-            models = await ChatModel.get_all(db)
-            
-            # Если и после обновления моделей нет, возвращаем пустой список
-            if not models:
-                logger.warning("После обновления модели всё еще не найдены в БД.")
-                return []
+            logger.info("В базе данных нет моделей. Запрошено фоновое обновление из Ollama API.")
+            model_catalog.trigger()
+            return []
         
-        logger.info(f"Получено {len(models)} моделей")
+        logger.debug("Получено %d моделей", len(models))
         
         result = [
             {
@@ -56,10 +56,10 @@ async def list_models(db: AsyncSession = Depends(get_db)):
             for model in models
         ]
         
-        logger.info(f"Возвращаемый результат: {result}")
+        logger.debug("Возвращаемый результат: %s", result)
         return result
     except Exception as e:
-        logger.error(f"Ошибка при получении списка моделей: {str(e)}", exc_info=True)
+        logger.error("Ошибка при получении списка моделей: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail=f"Ошибка при получении списка моделей: {str(e)}")
 
 @router.get("/refresh", response_model=List[ModelResponse])
@@ -70,58 +70,12 @@ async def refresh_models(db: AsyncSession = Depends(get_db)):
     try:
         logger.info("Начало обновления списка моделей")
         
-        # Создаем экземпляр сервиса Ollama для получения списка моделей
-        ollama_service = OllamaService()
-        
-        # Получаем список моделей из API Ollama
-        api_models = await ollama_service.list_models()
-        logger.info(f"Получено {len(api_models)} моделей из API Ollama")
-        
-        if not api_models:
-            logger.warning("Не получены модели от Ollama API. Проверьте соединение с сервером Ollama.")
-            return await ChatModel.get_all(db)
-        
-        # Перебираем модели из API и создаем/обновляем их в базе данных
-        for api_model in api_models:
-            model_name = api_model.get("name")
-            if not model_name:
-                logger.warning(f"Пропуск модели без имени: {api_model}")
-                continue
-                
-            logger.info(f"Обработка модели '{model_name}'")
-            
-            model = await ChatModel.get_by_name(db, model_name)
-            
-            # Получаем дополнительную информацию о модели
-            details = api_model.get("details", {})
-            parameter_size = details.get("parameter_size", "Неизвестно")
-            
-            # Если модель не существует в базе, создаем новую
-            if not model:
-                logger.info(f"Создание новой модели '{model_name}' в базе данных")
-                model = ChatModel(
-                    name=model_name,
-                    display_name=model_name,
-                    description=f"Модель {model_name} ({parameter_size})",
-                )
-                await model.save(db)
-                
-                # Создаем настройки по умолчанию для новой модели
-                default_system_prompt = "Вы полезный помощник по имени Артём. Вы всегда вежливы и дружелюбны."
-                
-                await ModelSettings.create(
-                    db,
-                    model_id=model.id,
-                    temperature="0.7",
-                    top_p="0.9",
-                    top_k="40",
-                    max_tokens="1024",
-                    system_prompt=default_system_prompt
-                )
+        # Одновременные запросы ждут одну общую синхронизацию
+        await model_catalog.refresh()
         
         # Получаем обновленный список моделей из базы данных
         models = await ChatModel.get_all(db)
-        logger.info(f"Обновленный список моделей содержит {len(models)} записей")
+        logger.debug("Обновленный список моделей содержит %d записей", len(models))
         
         # Преобразуем модели в ответ API
         result = [
@@ -136,9 +90,29 @@ async def refresh_models(db: AsyncSession = Depends(get_db)):
         
         return result
     except Exception as e:
-        logger.error(f"Ошибка при обновлении списка моделей: {str(e)}", exc_info=True)
+        logger.error("Ошибка при обновлении списка моделей: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail=f"Ошибка при обновлении списка моделей: {str(e)}")
 
+@router.get("/pool/stats")
+async def get_pool_stats(ollama_service: OllamaService = Depends(get_ollama_service)):
+    """Статистика пула соединений к Ollama API"""
+    return ollama_service.pool_stats()
+
+@router.get("/queue/stats")
+async def get_queue_stats():
+    """Занятость слотов и очереди генерации по моделям"""
+    return generation_scheduler.stats()
+
+@router.get("/cache/stats")
+async def get_response_cache_stats():
+    """Статистика кэша ответов моделей"""
+    return response_cache.stats()
+
+@router.get("/events/stats")
+async def get_chat_events_stats():
+    """Подписчики событий чатов и межпроцессная доставка"""
+    return chat_events.stats()
+
 @router.get("/{model_id}/settings")
 async def get_model_settings(model_id: str, db: AsyncSession = Depends(get_db)):
     """Получить настройки модели по ID или имени"""
@@ -146,42 +120,36 @@ async def get_model_settings(model_id: str, db: AsyncSession = Depends(get_db)):
         # Проверяем, является ли model_id числом или строкой
         try:
             model_id_int = int(model_id)
-            model = await ChatModel.get_by_id(db, model_id_int)
+            model = await catalog_cache.get_model(db, model_id=model_id_int)
         except ValueError:
             # Если не число, то это имя модели
-            model = await ChatModel.get_by_name(db, model_id)
+            model = await catalog_cache.get_model(db, name=model_id)
         
         if not model:
-            logger.error(f"Модель '{model_id}' не найдена")
+            logger.error("Модель '%s' не найдена", model_id)
             raise HTTPException(status_code=404, detail="Модель не найдена")
         
-        settings = await ModelSettings.get_by_model_id(db, model.id)
-        if not settings:
-            # Если нет настроек, создаем их с дефолтными значениями
-            settings = await ModelSettings.create(db, model.id)
+        # Если настроек еще нет, возвращаются значения по умолчанию (без id)
+        settings = await catalog_cache.get_settings(db, model.id)
         
-        return {
-            "id": settings.id,
-            "model_id": settings.model_id,
-            "model_name": model.name,
-            "temperature": settings.temperature,
-            "top_p": settings.top_p,
-            "top_k": settings.top_k,
-            "max_tokens": settings.max_tokens,
-            "system_prompt": settings.system_prompt
-        }
+        return {**settings.as_dict(), "model_name": model.name}
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Ошибка при получении настроек модели: {e}", exc_info=True)
+        logger.error("Ошибка при получении настроек модели: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail=f"Ошибка при получении настроек модели: {str(e)}")
 
 @router.post("/{model_id}/settings")
 async def update_model_settings(
     model_id: str,
-    temperature: str = Form(None),
-    top_p: str = Form(None),
-    top_k: str = Form(None),
-    max_tokens: str = Form(None),
-    system_prompt: str = Form(None),
+    temperature: Optional[float] = Form(None),
+    top_p: Optional[float] = Form(None),
+    top_k: Optional[int] = Form(None),
+    max_tokens: Optional[int] = Form(None),
+    system_prompt: Optional[str] = Form(None),
+    context_tokens: Optional[int] = Form(None),
+    repeat_penalty: Optional[float] = Form(None),
+    keep_alive: Optional[str] = Form(None),
     db: AsyncSession = Depends(get_db)
 ):
     """Обновить настройки модели"""
@@ -195,48 +163,44 @@ async def update_model_settings(
             model = await ChatModel.get_by_name(db, model_id)
         
         if not model:
-            logger.error(f"Модель '{model_id}' не найдена")
+            logger.error("Модель '%s' не найдена", model_id)
             raise HTTPException(status_code=404, detail="Модель не найдена")
         
+        # Если настроек нет, они создаются с дефолтными значениями в этой же транзакции
         settings = await ModelSettings.get_by_model_id(db, model.id)
-        
         if not settings:
-            # Если нет настроек, создаем их
-            settings = await ModelSettings.create(
-                db, model.id,
-                temperature=temperature or "0.7",
-                top_p=top_p or "0.9",
-                top_k=top_k or "40",
-                max_tokens=max_tokens or "1024",
-                system_prompt=system_prompt or "Вы полезный помощник."
-            )
-        else:
-            # Обновляем существующие настройки
-            if temperature is not None:
-                settings.temperature = temperature
-            if top_p is not None:
-                settings.top_p = top_p
-            if top_k is not None:
-                settings.top_k = top_k
-            if max_tokens is not None:
-                settings.max_tokens = max_tokens
-            if system_prompt is not None:
-                settings.system_prompt = system_prompt
-                
-            await db.commit()
-            await db.refresh(settings)
+            settings = await ModelSettings.create(db, model.id)
         
-        return {
-            "id": settings.id,
-            "model_id": settings.model_id,
-            "temperature": settings.temperature,
-            "top_p": settings.top_p,
-            "top_k": settings.top_k,
-            "max_tokens": settings.max_tokens,
-            "system_prompt": settings.system_prompt
+        changes = {
+            "temperature": temperature,
+            "top_p": top_p,
+            "top_k": top_k,
+            "max_tokens": max_tokens,
+            "system_prompt": system_prompt,
+            "context_tokens": context_tokens,
+            "repeat_penalty": repeat_penalty,
+            "keep_alive": keep_alive,
         }
+        changes = {field: value for field, value in changes.items() if value is not None}
+        
+        # Проверяем итоговый набор параметров до записи в базу
+        try:
+            validated = replace(GenerationSettings.from_model_settings(settings), **changes)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        for field, value in changes.items():
+            setattr(settings, field, value)
+        await settings.save(db)
+        await db.commit()
+        
+        catalog_cache.invalidate_model(model.id)
+        
+        return validated.as_dict()
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Ошибка при обновлении настроек модели: {e}", exc_info=True)
+        logger.error("Ошибка при обновлении настроек модели: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail=f"Ошибка при обновлении настроек модели: {str(e)}")
 
 @router.get("/prompts/list")
@@ -258,6 +222,7 @@ async def add_prompt_template(
         template = await PromptTemplate.create(
             db, name, system_prompt, description, user_prompt
         )
+        await db.commit()
         return {
             "id": template.id,
             "name": template.name,
@@ -266,7 +231,7 @@ async def add_prompt_template(
             "user_prompt": template.user_prompt
         }
     except Exception as e:
-        logger.error(f"Ошибка при добавлении шаблона: {str(e)}", exc_info=True)
+        logger.error("Ошибка при добавлении шаблона: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail=f"Ошибка при добавлении шаблона: {str(e)}")
 
 @router.get("/prompts/{template_id}")
@@ -274,7 +239,7 @@ async def get_prompt_template(template_id: int, db: AsyncSession = Depends(get_d
     """Получить шаблон промпта по ID"""
     template = await PromptTemplate.get_by_id(db, template_id)
     if not template:
-        logger.error(f"Шаблон промпта с ID {template_id} не найден")
+        logger.error("Шаблон промпта с ID %s не найден", template_id)
         raise HTTPException(status_code=404, detail="Шаблон не найден")
     
     return {
@@ -297,7 +262,7 @@ async def update_prompt_template(
     """Обновить шаблон промпта"""
     template = await PromptTemplate.get_by_id(db, template_id)
     if not template:
-        logger.error(f"Шаблон промпта с ID {template_id} не найден")
+        logger.error("Шаблон промпта с ID %s не найден", template_id)
         raise HTTPException(status_code=404, detail="Шаблон не найден")
     
     try:
@@ -307,6 +272,7 @@ async def update_prompt_template(
         template.user_prompt = user_prompt
         
         await template.save(db)
+        await db.commit()
         
         return {
             "id": template.id,
@@ -316,7 +282,7 @@ async def update_prompt_template(
             "user_prompt": template.user_prompt
         }
     except Exception as e:
-        logger.error(f"Ошибка при обновлении шаблона: {str(e)}", exc_info=True)
+        logger.error("Ошибка при обновлении шаблона: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail=f"Ошибка при обновлении шаблона: {str(e)}")
 
 @router.delete("/prompts/{template_id}")
@@ -324,7 +290,8 @@ async def delete_prompt_template(template_id: int, db: AsyncSession = Depends(ge
     """Удалить шаблон промпта"""
     result = await PromptTemplate.delete(db, template_id)
     if not result:
-        logger.error(f"Шаблон промпта с ID {template_id} не найден")
+        logger.error("Шаблон промпта с ID %s не найден", template_id)
         raise HTTPException(status_code=404, detail="Шаблон не найден")
+    await db.commit()
     
     return {"status": "success", "message": "Шаблон удален"} 
\ No newline at end of file
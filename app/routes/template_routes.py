@@ -15,10 +15,10 @@ async def list_templates(db: AsyncSession = Depends(get_db)):
     """Получить список всех шаблонов промптов"""
     try:
         templates = await PromptTemplate.get_all(db)
-        logger.info(f"Получено {len(templates)} шаблонов промптов")
+        logger.debug("Получено %d шаблонов промптов", len(templates))
         return templates
     except Exception as e:
-        logger.error(f"Ошибка при получении шаблонов промптов: {str(e)}", exc_info=True)
+        logger.error("Ошибка при получении шаблонов промптов: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail=f"Ошибка при получении шаблонов: {str(e)}")
 
 @router.get("/{template_id}")
@@ -26,7 +26,7 @@ async def get_template(template_id: int, db: AsyncSession = Depends(get_db)):
     """Получить шаблон промпта по ID"""
     template = await PromptTemplate.get_by_id(db, template_id)
     if not template:
-        logger.error(f"Шаблон с ID {template_id} не найден")
+        logger.error("Шаблон с ID %s не найден", template_id)
         raise HTTPException(status_code=404, detail="Шаблон не найден")
     
     return {
@@ -50,7 +50,8 @@ async def add_template(
         template = await PromptTemplate.create(
             db, name, system_prompt, description, user_prompt
         )
-        logger.info(f"Создан новый шаблон промпта '{name}' с ID {template.id}")
+        await db.commit()
+        logger.info("Создан новый шаблон промпта '%s' с ID %s", name, template.id)
         return {
             "id": template.id,
             "name": template.name,
@@ -59,7 +60,7 @@ async def add_template(
             "user_prompt": template.user_prompt
         }
     except Exception as e:
-        logger.error(f"Ошибка при создании шаблона: {str(e)}", exc_info=True)
+        logger.error("Ошибка при создании шаблона: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail=f"Ошибка при создании шаблона: {str(e)}")
 
 @router.delete("/{template_id}")
@@ -67,8 +68,9 @@ async def delete_template(template_id: int, db: AsyncSession = Depends(get_db)):
     """Удалить шаблон промпта"""
     result = await PromptTemplate.delete(db, template_id)
     if not result:
-        logger.error(f"Шаблон с ID {template_id} не найден при попытке удаления")
+        logger.error("Шаблон с ID %s не найден при попытке удаления", template_id)
         raise HTTPException(status_code=404, detail="Шаблон не найден")
+    await db.commit()
     
-    logger.info(f"Удален шаблон промпта с ID {template_id}")
+    logger.info("Удален шаблон промпта с ID %s", template_id)
     return {"status": "success", "message": "Шаблон удален"} 
\ No newline at end of file
@@ -0,0 +1,160 @@
+import os
+import time
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, NamedTuple, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.models import Chat, ChatModel, ModelSettings
+from app.services.generation_settings import GenerationSettings
+
+# Настраиваем логгер
+logger = logging.getLogger(__name__)
+
+# Время жизни и размер кэша каталога моделей
+CATALOG_CACHE_TTL = float(os.environ.get("CATALOG_CACHE_TTL", 60))
+CATALOG_CACHE_SIZE = int(os.environ.get("CATALOG_CACHE_SIZE", 1024))
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    LRU-кэш с ограничением размера и временем жизни записей.
+
+    Рассчитан на использование из одного event loop, блокировки не нужны.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = _MISSING) -> Any:
+        item = self._data.get(key)
+        if item is None or item[0] < time.monotonic():
+            if item is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def set(self, key: Hashable, value: Any):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class ChatInfo(NamedTuple):
+    """Неизменяемый снимок чата для горячего пути"""
+    id: int
+    title: str
+    model_id: Optional[int]
+
+
+class ModelInfo(NamedTuple):
+    """Неизменяемый снимок модели"""
+    id: int
+    name: str
+    display_name: Optional[str]
+    description: Optional[str]
+
+
+class CatalogCache:
+    """
+    Read-through кэш чатов, моделей и их настроек.
+
+    Возвращает неизменяемые снимки, а не ORM-объекты, чтобы их можно было
+    безопасно разделять между сессиями. Модели доступны и по id, и по имени.
+    Записи сбрасываются по TTL и явно - при изменении настроек, чата или
+    списка моделей.
+    """
+
+    def __init__(self, maxsize: int = CATALOG_CACHE_SIZE, ttl: float = CATALOG_CACHE_TTL):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    async def get_chat(self, db: AsyncSession, chat_id: int) -> Optional[ChatInfo]:
+        key = ("chat", chat_id)
+        info = self._cache.get(key)
+        if info is _MISSING:
+            chat = await Chat.get_by_id(db, chat_id)
+            if not chat:
+                return None
+            info = ChatInfo(chat.id, chat.title, chat.model_id)
+            self._cache.set(key, info)
+        return info
+
+    async def get_model(self, db: AsyncSession, model_id: int = None, name: str = None) -> Optional[ModelInfo]:
+        key = ("model_id", model_id) if model_id is not None else ("model_name", name)
+        info = self._cache.get(key)
+        if info is _MISSING:
+            if model_id is not None:
+                model = await ChatModel.get_by_id(db, model_id)
+            else:
+                model = await ChatModel.get_by_name(db, name)
+            if not model:
+                return None
+            info = ModelInfo(model.id, model.name, model.display_name, model.description)
+            self._cache.set(("model_id", info.id), info)
+            self._cache.set(("model_name", info.name), info)
+        return info
+
+    async def get_settings(self, db: AsyncSession, model_id: int) -> GenerationSettings:
+        """Настройки модели; если строки еще нет - значения по умолчанию без id."""
+        key = ("settings", model_id)
+        info = self._cache.get(key)
+        if info is _MISSING:
+            settings = await ModelSettings.get_by_model_id(db, model_id)
+            if not settings:
+                info = GenerationSettings(model_id=model_id)
+                self._cache.set(key, info)
+                return info
+            try:
+                info = GenerationSettings.from_model_settings(settings)
+            except ValueError as e:
+                logger.warning("Некорректные настройки модели %s: %s, используются значения по умолчанию", model_id, e)
+                info = GenerationSettings(model_id=model_id, id=settings.id, system_prompt=settings.system_prompt)
+            self._cache.set(key, info)
+        return info
+
+    def invalidate_chat(self, chat_id: int):
+        self._cache.pop(("chat", chat_id))
+
+    def invalidate_model(self, model_id: int):
+        """Сбрасывает модель (по id и имени) и ее настройки."""
+        info = self._cache.get(("model_id", model_id), None)
+        if info is not None:
+            self._cache.pop(("model_name", info.name))
+        self._cache.pop(("model_id", model_id))
+        self._cache.pop(("settings", model_id))
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return self._cache.stats()
+
+
+# Общий кэш каталога на процесс
+catalog_cache = CatalogCache()
@@ -0,0 +1,295 @@
+import os
+import json
+import uuid
+import asyncio
+import logging
+import contextlib
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+# Настраиваем логгер
+logger = logging.getLogger(__name__)
+
+# Доставка событий чата: local - только в пределах процесса,
+# postgres - между воркерами через LISTEN/NOTIFY
+CHAT_EVENTS_BACKEND = os.environ.get("CHAT_EVENTS_BACKEND", "local")
+# Адрес PostgreSQL для postgres; по умолчанию берется DATABASE_URL
+CHAT_EVENTS_URL = os.environ.get("CHAT_EVENTS_URL", "")
+CHAT_EVENTS_CHANNEL = os.environ.get("CHAT_EVENTS_CHANNEL", "chat_events")
+# Сколько событий ждет одного подписчика, прежде чем он считается отставшим
+CHAT_EVENTS_QUEUE_SIZE = int(os.environ.get("CHAT_EVENTS_QUEUE_SIZE", 1000))
+CHAT_EVENTS_RECONNECT_DELAY = float(os.environ.get("CHAT_EVENTS_RECONNECT_DELAY", 1))
+
+# Предел полезной нагрузки NOTIFY - 8000 байт, оставляем запас на обертку
+_NOTIFY_MAX_BYTES = 7500
+
+Event = Dict[str, Any]
+
+
+class ChatSubscription:
+    """
+    Подписка на события одного чата.
+
+    События копятся в ограниченной очереди. Если подписчик не успевает их
+    забирать, очередь очищается и вместо пропущенных событий он получает
+    {"type": "lagged"}: полный текст ответа можно перечитать из БД.
+    """
+
+    def __init__(self, hub: "ChatEventHub", chat_id: int, maxsize: int):
+        self.hub = hub
+        self.chat_id = chat_id
+        self.lagged = 0
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize)
+
+    def put(self, event: Event):
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            while not self._queue.empty():
+                self._queue.get_nowait()
+            self._queue.put_nowait({"type": "lagged"})
+            self.lagged += 1
+
+    async def get(self) -> Event:
+        return await self._queue.get()
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+
+class InProcessBackend:
+    """Доставка событий подписчикам текущего процесса."""
+
+    name = "local"
+
+    def __init__(self):
+        self.on_event: Optional[Callable[[int, Event], None]] = None
+
+    async def start(self):
+        pass
+
+    def publish(self, chat_id: int, event: Event):
+        if self.on_event is not None:
+            self.on_event(chat_id, event)
+
+    async def stop(self):
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+
+class PostgresNotifyBackend(InProcessBackend):
+    """
+    Доставка событий между процессами через PostgreSQL LISTEN/NOTIFY.
+
+    Подписчики своего процесса получают событие сразу, в другие воркеры
+    оно уходит через NOTIFY отдельным соединением: идущие подряд фрагменты
+    одного ответа склеиваются, слишком длинные - делятся по пределу
+    полезной нагрузки. Свои уведомления, вернувшиеся через LISTEN,
+    отбрасываются по id процесса. При обрыве соединения события за время
+    переподключения теряются - подписчик увидит разрыв по offset.
+    """
+
+    name = "postgres"
+
+    def __init__(self, dsn: str, channel: str = CHAT_EVENTS_CHANNEL,
+                 queue_size: int = CHAT_EVENTS_QUEUE_SIZE, reconnect_delay: float = CHAT_EVENTS_RECONNECT_DELAY):
+        super().__init__()
+        # asyncpg принимает обычный адрес PostgreSQL, без указания драйвера SQLAlchemy
+        self.dsn = dsn.replace("postgresql+asyncpg://", "postgresql://", 1)
+        self.channel = channel
+        self.reconnect_delay = reconnect_delay
+        self.origin = uuid.uuid4().hex
+        self.sent = 0
+        self.received = 0
+        self.dropped = 0
+        self._outbox: asyncio.Queue = asyncio.Queue(queue_size)
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self):
+        if not self._tasks:
+            self._tasks = [
+                asyncio.create_task(self._send_loop()),
+                asyncio.create_task(self._listen_loop()),
+            ]
+
+    def publish(self, chat_id: int, event: Event):
+        super().publish(chat_id, event)
+        try:
+            self._outbox.put_nowait((chat_id, event))
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def _connect(self):
+        import asyncpg
+        return await asyncpg.connect(self.dsn)
+
+    def _batch(self, first: Tuple[int, Event]) -> List[Tuple[int, Event]]:
+        """Забирает накопившиеся события, склеивая соседние фрагменты одного ответа."""
+        batch: List[Tuple[int, Event]] = [first]
+        while not self._outbox.empty():
+            chat_id, event = self._outbox.get_nowait()
+            if event.get("type") == "chunk":
+                last_chat, last = batch[-1]
+                if (last_chat == chat_id and last.get("type") == "chunk"
+                        and last["generation_id"] == event["generation_id"]
+                        and last["offset"] + len(last["chunk"]) == event["offset"]):
+                    batch[-1] = (chat_id, dict(last, chunk=last["chunk"] + event["chunk"]))
+                    continue
+            batch.append((chat_id, event))
+        return batch
+
+    def _payloads(self, chat_id: int, event: Event) -> List[str]:
+        payload = json.dumps({"origin": self.origin, "chat_id": chat_id, "event": event}, ensure_ascii=False)
+        if len(payload.encode()) <= _NOTIFY_MAX_BYTES:
+            return [payload]
+        if event.get("type") == "user_message" and "content" in event:
+            # Длинный вопрос подписчик перечитает из БД
+            return self._payloads(chat_id, {name: value for name, value in event.items() if name != "content"})
+        if event.get("type") != "chunk" or len(event["chunk"]) < 2:
+            logger.warning("Событие чата %s не помещается в NOTIFY и пропущено", chat_id)
+            return []
+        half = len(event["chunk"]) // 2
+        head = dict(event, chunk=event["chunk"][:half])
+        tail = dict(event, chunk=event["chunk"][half:], offset=event["offset"] + half)
+        return self._payloads(chat_id, head) + self._payloads(chat_id, tail)
+
+    async def _send_loop(self):
+        conn = None
+        try:
+            while True:
+                batch = self._batch(await self._outbox.get())
+                try:
+                    if conn is None:
+                        conn = await self._connect()
+                    for chat_id, event in batch:
+                        for payload in self._payloads(chat_id, event):
+                            await conn.execute("SELECT pg_notify($1, $2)", self.channel, payload)
+                            self.sent += 1
+                except Exception as e:
+                    logger.warning("Не удалось отправить события чатов через NOTIFY: %s", e)
+                    self.dropped += len(batch)
+                    if conn is not None:
+                        with contextlib.suppress(Exception):
+                            await conn.close()
+                        conn = None
+                    await asyncio.sleep(self.reconnect_delay)
+        finally:
+            if conn is not None:
+                with contextlib.suppress(Exception):
+                    await conn.close()
+
+    def _on_notify(self, connection, pid, channel, payload: str):
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            logger.warning("Некорректное уведомление в канале %s", channel)
+            return
+        if message.get("origin") == self.origin:
+            return
+        self.received += 1
+        if self.on_event is not None:
+            self.on_event(int(message["chat_id"]), message["event"])
+
+    async def _listen_loop(self):
+        while True:
+            try:
+                conn = await self._connect()
+            except Exception as e:
+                logger.warning("Нет соединения для LISTEN %s: %s", self.channel, e)
+                await asyncio.sleep(self.reconnect_delay)
+                continue
+            closed = asyncio.get_running_loop().create_future()
+            conn.add_termination_listener(lambda _: closed.done() or closed.set_result(None))
+            try:
+                await conn.add_listener(self.channel, self._on_notify)
+                logger.info("Подписка на события чатов через LISTEN %s", self.channel)
+                await closed
+                logger.warning("Соединение LISTEN %s закрыто, переподключение", self.channel)
+            except Exception as e:
+                logger.warning("Ошибка LISTEN %s: %s", self.channel, e)
+                await asyncio.sleep(self.reconnect_delay)
+            finally:
+                with contextlib.suppress(Exception):
+                    await conn.close()
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+        self._tasks = []
+
+    def stats(self) -> Dict[str, Any]:
+        return {"sent": self.sent, "received": self.received, "dropped": self.dropped}
+
+
+class ChatEventHub:
+    """
+    Публикация и подписка на события чатов.
+
+    Ответ модели публикуется по мере генерации (см. MessageWriter), и его
+    видит любой подписчик чата: другие вкладки и, с межпроцессной
+    доставкой, сокеты других воркеров. События:
+    {"type": "user_message", "generation_id", "message_id", "content"} -
+    сохранено сообщение пользователя, на которое пишется ответ;
+    {"type": "generation", "generation_id", "message_id"} - начат ответ;
+    {"type": "chunk", "generation_id", "message_id", "offset", "chunk"} -
+    фрагмент, offset - позиция в символах ответа;
+    {"type": "done", "generation_id", "message_id", "truncated"} - ответ
+    сохранен.
+    """
+
+    def __init__(self, backend: Optional[InProcessBackend] = None, queue_size: int = CHAT_EVENTS_QUEUE_SIZE):
+        self.backend = backend or InProcessBackend()
+        self.backend.on_event = self._dispatch
+        self.queue_size = queue_size
+        self._subscribers: Dict[int, Set[ChatSubscription]] = {}
+
+    def subscribe(self, chat_id: int) -> ChatSubscription:
+        subscription = ChatSubscription(self, chat_id, self.queue_size)
+        self._subscribers.setdefault(chat_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: ChatSubscription):
+        subscribers = self._subscribers.get(subscription.chat_id)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.chat_id]
+
+    def publish(self, chat_id: int, event: Event):
+        """Отправляет событие подписчикам чата, не дожидаясь доставки."""
+        self.backend.publish(chat_id, event)
+
+    def _dispatch(self, chat_id: int, event: Event):
+        for subscription in list(self._subscribers.get(chat_id, ())):
+            subscription.put(event)
+
+    async def start(self):
+        await self.backend.start()
+
+    async def stop(self):
+        await self.backend.stop()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.backend.name,
+            "chats": len(self._subscribers),
+            "subscribers": sum(len(s) for s in self._subscribers.values()),
+            **self.backend.stats(),
+        }
+
+
+def make_backend(name: str = CHAT_EVENTS_BACKEND) -> InProcessBackend:
+    if name == "postgres":
+        from app.database.db import DATABASE_URL
+        return PostgresNotifyBackend(CHAT_EVENTS_URL or DATABASE_URL)
+    if name != "local":
+        logger.warning("Неизвестный CHAT_EVENTS_BACKEND=%s, используется local", name)
+    return InProcessBackend()
+
+
+# Общий концентратор событий чатов на процесс
+chat_events = ChatEventHub(make_backend())
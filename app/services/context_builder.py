@@ -0,0 +1,100 @@
+import os
+import logging
+from typing import List, Dict, Optional, Sequence
+
+# Настраиваем логгер
+logger = logging.getLogger(__name__)
+
+# Размер контекстного окна по умолчанию (в токенах)
+DEFAULT_CONTEXT_TOKENS = 4096
+
+# Сколько последних сообщений чата загружать из БД для сборки контекста
+CONTEXT_HISTORY_LIMIT = int(os.environ.get("CONTEXT_HISTORY_LIMIT", 200))
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """
+    Грубая оценка числа токенов без токенизатора модели.
+
+    Около 4 байт UTF-8 на токен одинаково годится и для латиницы,
+    и для кириллицы (2 байта на символ). Плюс накладные расходы
+    шаблона чата на каждое сообщение.
+    """
+    if not text:
+        return 4
+    return len(text.encode("utf-8")) // 4 + 4
+
+
+class ChatContextBuilder:
+    """
+    Собирает массив messages для Ollama /api/chat из истории чата.
+
+    В контекст попадают самые новые сообщения, укладывающиеся в бюджет
+    токенов: размер окна модели за вычетом системного промпта и места,
+    зарезервированного под ответ.
+
+    Чтобы Ollama могла переиспользовать KV-кэш между ходами, начало окна
+    сдвигается не на каждом ходе, а блоками по block_size сообщений:
+    пока граница блока не пройдена, префикс контекста (системный промпт и
+    старые сообщения) остается байт-в-байт одинаковым.
+    """
+
+    def __init__(self, context_tokens: int = DEFAULT_CONTEXT_TOKENS,
+                 reserve_tokens: int = 1024, block_size: int = 8):
+        self.context_tokens = context_tokens or DEFAULT_CONTEXT_TOKENS
+        self.reserve_tokens = reserve_tokens or 0
+        self.block_size = max(1, block_size)
+
+    def history_budget(self, system_prompt: Optional[str]) -> int:
+        """Бюджет токенов, доступный для истории сообщений."""
+        budget = self.context_tokens - self.reserve_tokens
+        if system_prompt:
+            budget -= estimate_tokens(system_prompt)
+        return max(0, budget)
+
+    def window_start(self, history: Sequence, budget: int, offset: int = 0) -> int:
+        """
+        Индекс первого сообщения истории, попадающего в контекст.
+
+        history - последовательность объектов с атрибутами role и content
+        в хронологическом порядке; offset - позиция history[0] в полной
+        истории чата, если загружен только ее хвост.
+        """
+        if not history:
+            return 0
+
+        # Минимальный старт: идем от новых сообщений, пока хватает бюджета.
+        # Последнее сообщение попадает в контекст всегда.
+        used = 0
+        start = len(history)
+        for index in range(len(history) - 1, -1, -1):
+            used += estimate_tokens(history[index].content)
+            if used > budget and index < len(history) - 1:
+                break
+            start = index
+
+        # Выравниваем начало окна на границу блока, чтобы префикс не менялся
+        # на каждом ходе
+        if start + offset > 0:
+            aligned = -(-(start + offset) // self.block_size) * self.block_size - offset
+            start = min(aligned, len(history) - 1)
+
+        # Окно не должно начинаться с ответа ассистента без вопроса
+        while start < len(history) - 1 and history[start].role != "user":
+            start += 1
+
+        return start
+
+    def build(self, system_prompt: Optional[str], history: Sequence, offset: int = 0) -> List[Dict[str, str]]:
+        """Возвращает messages для /api/chat: системный промпт и окно истории."""
+        messages = []
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+
+        start = self.window_start(history, self.history_budget(system_prompt), offset)
+        if start:
+            logger.debug("Из контекста исключено %s старых сообщений", start)
+
+        for message in history[start:]:
+            messages.append({"role": message.role, "content": message.content or ""})
+        return messages
@@ -0,0 +1,152 @@
+import os
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Awaitable, Callable, List, Mapping, Optional
+
+# Настраиваем логгер
+logger = logging.getLogger(__name__)
+
+# Политика склейки по умолчанию: сброс раз в N мс или при накоплении M байт
+WS_FLUSH_INTERVAL_MS = int(os.environ.get("WS_FLUSH_INTERVAL_MS", 50))
+WS_FLUSH_MAX_BYTES = int(os.environ.get("WS_FLUSH_MAX_BYTES", 1024))
+# Предел неотправленных байт на соединение; при его достижении чтение
+# из модели ждет, пока клиент примет данные
+WS_SEND_BUFFER_BYTES = int(os.environ.get("WS_SEND_BUFFER_BYTES", 1024 * 1024))
+
+
+@dataclass(frozen=True, slots=True)
+class FlushPolicy:
+    """Когда отправлять накопленные токены: по времени или по размеру, что наступит раньше."""
+    interval_ms: int = WS_FLUSH_INTERVAL_MS
+    max_bytes: int = WS_FLUSH_MAX_BYTES
+
+    @property
+    def immediate(self) -> bool:
+        """Без склейки: каждый фрагмент уходит отдельным кадром."""
+        return self.interval_ms <= 0 or self.max_bytes <= 1
+
+    @classmethod
+    def from_handshake(cls, params: Mapping[str, str]) -> "FlushPolicy":
+        """
+        Политика из параметров рукопожатия WebSocket (query-строка):
+        flush=token|balanced|throughput или явные flush_ms и flush_bytes.
+        """
+        policy = FLUSH_PRESETS.get(params.get("flush", ""), cls())
+        try:
+            interval_ms = int(params.get("flush_ms", policy.interval_ms))
+            max_bytes = int(params.get("flush_bytes", policy.max_bytes))
+        except ValueError:
+            logger.warning("Некорректные параметры склейки кадров: %s", dict(params))
+            return policy
+        return cls(
+            interval_ms=max(0, min(interval_ms, 1000)),
+            max_bytes=max(0, min(max_bytes, 64 * 1024)),
+        )
+
+
+FLUSH_PRESETS = {
+    "token": FlushPolicy(interval_ms=0, max_bytes=0),
+    "balanced": FlushPolicy(interval_ms=50, max_bytes=1024),
+    "throughput": FlushPolicy(interval_ms=200, max_bytes=8192),
+}
+
+
+class FrameCoalescer:
+    """
+    Склеивает поток токенов в кадры.
+
+    Чтение токенов и отправка кадров развязаны: push() только кладет токен
+    в буфер, кадры отправляет отдельная задача. Кадр уходит, когда буфер
+    достигает max_bytes или с момента первого токена в нем прошло
+    interval_ms; пока клиент принимает предыдущий кадр, новые токены
+    копятся и уходят следующим кадром целиком. Поэтому медленный клиент не
+    задерживает чтение ответа модели, пока буфер меньше max_buffer_bytes.
+    """
+
+    def __init__(self, send: Callable[[str], Awaitable[None]], policy: Optional[FlushPolicy] = None,
+                 max_buffer_bytes: int = WS_SEND_BUFFER_BYTES):
+        self.send = send
+        self.policy = policy or FlushPolicy()
+        self.max_buffer_bytes = max_buffer_bytes
+        self._buffer: List[str] = []
+        self._size = 0
+        # В буфере есть данные / буфер меньше предела
+        self._pending = asyncio.Event()
+        self._space = asyncio.Event()
+        self._space.set()
+        self._writer: Optional[asyncio.Task] = None
+        self._closing = False
+        self.frames_sent = 0
+        self.chunks_received = 0
+        self.max_buffered = 0
+
+    async def push(self, chunk: str):
+        if not chunk:
+            return
+        self.chunks_received += 1
+        if self._writer is not None and self._writer.done():
+            # Отправка уже завершилась ошибкой, она будет проброшена из close()
+            return
+        # Клиент отстал на max_buffer_bytes - ждем, пока отправитель разгрузит буфер
+        while self._size >= self.max_buffer_bytes and self._writer is not None and not self._writer.done():
+            self._space.clear()
+            await self._space.wait()
+
+        self._buffer.append(chunk)
+        self._size += len(chunk.encode("utf-8"))
+        self.max_buffered = max(self.max_buffered, self._size)
+        self._pending.set()
+        if self._writer is None:
+            self._writer = asyncio.create_task(self._write_loop())
+        if self.policy.immediate or self._size >= self.policy.max_bytes:
+            # Кадр готов: даем отправителю забрать его сразу
+            await asyncio.sleep(0)
+
+    async def _write_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if self._closing and not self._buffer:
+                return
+            await self._pending.wait()
+            if not self.policy.immediate:
+                # Ждем порог размера или интервал с первого токена в буфере
+                deadline = loop.time() + self.policy.interval_ms / 1000
+                while self._size < self.policy.max_bytes and not self._closing:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    self._pending.clear()
+                    try:
+                        await asyncio.wait_for(self._pending.wait(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+
+            text = "".join(self._buffer)
+            self._buffer.clear()
+            self._size = 0
+            self._pending.clear()
+            self._space.set()
+            if text:
+                await self._send(text)
+
+    async def _send(self, text: str):
+        await self.send(text)
+        self.frames_sent += 1
+
+    async def close(self):
+        """Досылает остаток буфера и дожидается отправки; ошибки отправки пробрасываются."""
+        if self._writer is None:
+            return
+        self._closing = True
+        self._pending.set()
+        # Отмена вызывающего не должна обрывать отправку остатка
+        await asyncio.shield(self._writer)
+
+    def discard(self):
+        """Сбрасывает буфер без отправки (клиент уже отключился)."""
+        if self._writer is not None:
+            self._writer.cancel()
+        self._buffer.clear()
+        self._size = 0
+        self._space.set()
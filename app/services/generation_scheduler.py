@@ -0,0 +1,252 @@
+import os
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+# Настраиваем логгер
+logger = logging.getLogger(__name__)
+
+# Одновременных генераций на модель, переопределения вида "llama3:8b=4,mistral=1",
+# длина очереди ожидания на модель и порядок обслуживания (fifo/round_robin)
+GENERATION_CONCURRENCY = int(os.environ.get("GENERATION_CONCURRENCY", 2))
+GENERATION_MODEL_LIMITS = os.environ.get("GENERATION_MODEL_LIMITS", "")
+GENERATION_QUEUE_SIZE = int(os.environ.get("GENERATION_QUEUE_SIZE", 32))
+GENERATION_QUEUE_POLICY = os.environ.get("GENERATION_QUEUE_POLICY", "fifo")
+
+
+class QueueFullError(Exception):
+    """Очередь генераций модели заполнена, запрос нужно отклонить."""
+
+    def __init__(self, model: str):
+        super().__init__(f"Очередь генерации для модели '{model}' заполнена, повторите запрос позже")
+        self.model = model
+
+
+def parse_limits(spec: str) -> Dict[str, int]:
+    """Разбирает строку вида "model=N,model2=M" в словарь лимитов."""
+    limits = {}
+    for item in spec.split(","):
+        if "=" in item:
+            name, value = item.rsplit("=", 1)
+            try:
+                limits[name.strip()] = int(value)
+            except ValueError:
+                logger.warning("Некорректный лимит генераций: %s", item)
+    return limits
+
+
+class _Waiter:
+    __slots__ = ("key", "event", "granted")
+
+    def __init__(self, key: Hashable):
+        self.key = key
+        self.event = asyncio.Event()
+        self.granted = False
+
+
+class _ModelQueue:
+    """Слоты и очередь ожидания одной модели."""
+
+    def __init__(self, limit: int, policy: str):
+        self.limit = limit
+        self.policy = policy
+        self.active = 0
+        # Для fifo одна общая очередь, для round_robin - очередь на каждый чат
+        self._lanes: "OrderedDict[Hashable, deque]" = OrderedDict()
+        self.waiting = 0
+
+    def enqueue(self, waiter: _Waiter):
+        lane_key = waiter.key if self.policy == "round_robin" else None
+        self._lanes.setdefault(lane_key, deque()).append(waiter)
+        self.waiting += 1
+
+    def remove(self, waiter: _Waiter):
+        lane_key = waiter.key if self.policy == "round_robin" else None
+        lane = self._lanes.get(lane_key)
+        if lane is not None and waiter in lane:
+            lane.remove(waiter)
+            self.waiting -= 1
+            if not lane:
+                del self._lanes[lane_key]
+
+    def ordered(self) -> List[_Waiter]:
+        """Ожидающие в порядке, в котором они получат слот."""
+        lanes = list(self._lanes.values())
+        order = []
+        depth = max((len(lane) for lane in lanes), default=0)
+        for i in range(depth):
+            order.extend(lane[i] for lane in lanes if len(lane) > i)
+        return order
+
+    def pop_next(self) -> Optional[_Waiter]:
+        if not self._lanes:
+            return None
+        lane_key, lane = next(iter(self._lanes.items()))
+        waiter = lane.popleft()
+        self.waiting -= 1
+        if lane:
+            # Чат уходит в конец круга, чтобы не занимать модель подряд
+            self._lanes.move_to_end(lane_key)
+        else:
+            del self._lanes[lane_key]
+        return waiter
+
+
+class GenerationScheduler:
+    """
+    Планировщик генераций перед Ollama.
+
+    Ограничивает число одновременных генераций для каждой модели, ставит
+    остальные запросы в ограниченную очередь (FIFO или по кругу между
+    чатами) и сообщает ожидающим их позицию. При заполненной очереди
+    запрос сразу отклоняется с QueueFullError.
+    """
+
+    def __init__(self, concurrency: int = GENERATION_CONCURRENCY, limits: Optional[Dict[str, int]] = None,
+                 queue_size: int = GENERATION_QUEUE_SIZE, policy: str = GENERATION_QUEUE_POLICY):
+        self.concurrency = concurrency
+        self.limits = limits if limits is not None else parse_limits(GENERATION_MODEL_LIMITS)
+        self.queue_size = queue_size
+        self.policy = policy
+        self.rejected_total = 0
+        self._queues: Dict[str, _ModelQueue] = {}
+
+    def _queue(self, model: str) -> _ModelQueue:
+        queue = self._queues.get(model)
+        if queue is None:
+            queue = _ModelQueue(max(1, self.limits.get(model, self.concurrency)), self.policy)
+            self._queues[model] = queue
+        return queue
+
+    def is_full(self, model: str) -> bool:
+        """Новый запрос к модели будет отклонен."""
+        queue = self._queue(model)
+        return queue.active >= queue.limit and queue.waiting >= self.queue_size
+
+    def reserve(self, model: str, key: Hashable = None) -> "SlotReservation":
+        """
+        Сразу занимает слот модели или место в ее очереди; при заполненной
+        очереди выбрасывает QueueFullError. Слот затем ждут в slot(...,
+        reservation=...), неиспользованную бронь отменяют cancel().
+        """
+        return SlotReservation(self, model, key)
+
+    @asynccontextmanager
+    async def slot(self, model: str, key: Hashable = None,
+                   on_position: Optional[Callable[[int], Awaitable[Any]]] = None,
+                   reservation: Optional["SlotReservation"] = None):
+        """
+        Занимает слот генерации модели на время блока.
+
+        key - ключ справедливости (id чата) для round_robin. on_position
+        вызывается с позицией в очереди (начиная с 1) при каждом ее изменении.
+        reservation - бронь из reserve(), иначе место занимается здесь.
+        """
+        if reservation is None:
+            reservation = self.reserve(model, key)
+        reservation.used = True
+        await self._wait(model, reservation.waiter, on_position)
+        try:
+            yield
+        finally:
+            self._release(model)
+
+    def _admit(self, model: str, key: Hashable) -> _Waiter:
+        """Слот сразу (granted) или место в очереди; без ожидания."""
+        queue = self._queue(model)
+        waiter = _Waiter(key)
+        if queue.active < queue.limit and not queue.waiting:
+            queue.active += 1
+            waiter.granted = True
+            return waiter
+        if queue.waiting >= self.queue_size:
+            self.rejected_total += 1
+            raise QueueFullError(model)
+
+        queue.enqueue(waiter)
+        self._notify(queue)
+        return waiter
+
+    async def _wait(self, model: str, waiter: _Waiter, on_position):
+        queue = self._queue(model)
+        last_position = None
+        try:
+            while True:
+                waiter.event.clear()
+                if waiter.granted:
+                    return
+                position = queue.ordered().index(waiter) + 1
+                if on_position is not None and position != last_position:
+                    last_position = position
+                    await on_position(position)
+                    continue
+                await waiter.event.wait()
+        except BaseException:
+            self._abandon(model, waiter)
+            raise
+
+    def _abandon(self, model: str, waiter: _Waiter):
+        """Освобождает слот или место в очереди, которые так и не использовали."""
+        if waiter.granted:
+            self._release(model)
+        else:
+            queue = self._queue(model)
+            queue.remove(waiter)
+            self._notify(queue)
+
+    def _release(self, model: str):
+        queue = self._queue(model)
+        queue.active -= 1
+        while queue.active < queue.limit:
+            waiter = queue.pop_next()
+            if waiter is None:
+                break
+            queue.active += 1
+            waiter.granted = True
+            waiter.event.set()
+        self._notify(queue)
+
+    @staticmethod
+    def _notify(queue: _ModelQueue):
+        # Будим ожидающих, чтобы они пересчитали свою позицию
+        for waiter in queue.ordered():
+            waiter.event.set()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "policy": self.policy,
+            "queue_size": self.queue_size,
+            "rejected_total": self.rejected_total,
+            "models": {
+                model: {"limit": queue.limit, "active": queue.active, "waiting": queue.waiting}
+                for model, queue in self._queues.items()
+            },
+        }
+
+
+class SlotReservation:
+    """
+    Слот генерации или место в очереди, занятые при создании брони.
+
+    Нужна, когда запрос должен быть принят или отклонен (QueueFullError)
+    до записей в БД, а ждать слот можно позже.
+    """
+
+    def __init__(self, scheduler: GenerationScheduler, model: str, key: Hashable = None):
+        self.scheduler = scheduler
+        self.model = model
+        self.waiter = scheduler._admit(model, key)
+        # Бронь передана в slot() или отменена
+        self.used = False
+
+    def cancel(self):
+        """Отменяет бронь, если ее не передали в slot(); повторный вызов ничего не делает."""
+        if not self.used:
+            self.used = True
+            self.scheduler._abandon(self.model, self.waiter)
+
+
+# Общий планировщик генераций на процесс
+generation_scheduler = GenerationScheduler()
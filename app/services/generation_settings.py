@@ -0,0 +1,64 @@
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+DEFAULT_SYSTEM_PROMPT = "Вы полезный помощник."
+
+
+@dataclass(frozen=True, slots=True)
+class GenerationSettings:
+    """
+    Проверенные параметры генерации для модели.
+
+    Строится один раз из строки ModelSettings и кэшируется, поэтому на
+    каждом ходе чата не нужно заново разбирать и проверять значения.
+    """
+    model_id: int
+    id: Optional[int] = None
+    temperature: float = 0.7
+    top_p: float = 0.9
+    top_k: int = 40
+    max_tokens: int = 1024
+    context_tokens: int = 4096
+    repeat_penalty: float = 1.1
+    keep_alive: Optional[str] = "5m"
+    system_prompt: Optional[str] = DEFAULT_SYSTEM_PROMPT
+
+    def __post_init__(self):
+        if not 0 <= self.temperature <= 2:
+            raise ValueError("temperature должна быть в диапазоне от 0 до 2")
+        if not 0 < self.top_p <= 1:
+            raise ValueError("top_p должен быть в диапазоне (0, 1]")
+        if self.top_k < 1:
+            raise ValueError("top_k должен быть не меньше 1")
+        if self.max_tokens < 1:
+            raise ValueError("max_tokens должен быть не меньше 1")
+        if self.context_tokens < 256:
+            raise ValueError("context_tokens должен быть не меньше 256")
+        if self.repeat_penalty <= 0:
+            raise ValueError("repeat_penalty должен быть больше 0")
+
+    @classmethod
+    def from_model_settings(cls, settings) -> "GenerationSettings":
+        """Создает объект из строки ModelSettings, пустые поля заменяются значениями по умолчанию."""
+        values = {"model_id": settings.model_id, "id": settings.id}
+        for field in ("temperature", "top_p", "top_k", "max_tokens", "context_tokens",
+                      "repeat_penalty", "keep_alive", "system_prompt"):
+            value = getattr(settings, field)
+            if value is not None:
+                values[field] = value
+        return cls(**values)
+
+    def to_options(self) -> Dict[str, Any]:
+        """Параметры сэмплирования в формате options Ollama API."""
+        return {
+            "temperature": self.temperature,
+            "top_p": self.top_p,
+            "top_k": self.top_k,
+            "num_predict": self.max_tokens,
+            "num_ctx": self.context_tokens,
+            "repeat_penalty": self.repeat_penalty,
+        }
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Представление для ответа API"""
+        return {field: getattr(self, field) for field in self.__slots__}
@@ -0,0 +1,154 @@
+import os
+import time
+import uuid
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+# Настраиваем логгер
+logger = logging.getLogger(__name__)
+
+# Сколько секунд завершенная генерация доступна для продолжения по resume
+GENERATION_REPLAY_TTL = float(os.environ.get("GENERATION_REPLAY_TTL", 300))
+
+
+class LiveGeneration:
+    """
+    Генерация ответа, идущая независимо от клиента.
+
+    Полученные фрагменты копятся в буфере повтора: подписчик может начать
+    читать с любой позиции (в символах ответа) и получит сначала
+    пропущенный текст, затем новые фрагменты до конца генерации.
+    """
+
+    def __init__(self, chat_id: int, model: str):
+        self.id = uuid.uuid4().hex
+        self.chat_id = chat_id
+        self.model = model
+        self.parts: List[str] = []
+        self.size = 0
+        self.done = False
+        self.truncated = False
+        self.error: Optional[BaseException] = None
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        # Событие заменяется новым при каждом изменении, подписчики ждут текущее
+        self._changed = asyncio.Event()
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    def append(self, chunk: str):
+        if not chunk:
+            return
+        self.parts.append(chunk)
+        self.size += len(chunk)
+        self._notify()
+
+    def finish(self, truncated: bool = False, error: Optional[BaseException] = None):
+        self.done = True
+        self.truncated = truncated
+        self.error = error
+        self.finished_at = time.monotonic()
+        self._notify()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def follow(self, offset: int = 0) -> AsyncIterator[str]:
+        """
+        Текст ответа начиная с offset, затем новые фрагменты до конца
+        генерации. Ошибка генерации пробрасывается после отданного текста.
+        """
+        offset = max(0, min(offset, self.size))
+        index = position = 0
+        while index < len(self.parts) and position + len(self.parts[index]) <= offset:
+            position += len(self.parts[index])
+            index += 1
+        skip = offset - position
+
+        while True:
+            changed = self._changed
+            while index < len(self.parts):
+                part = self.parts[index][skip:]
+                index += 1
+                skip = 0
+                if part:
+                    yield part
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await changed.wait()
+
+    def cancel(self):
+        if self.task is not None:
+            self.task.cancel()
+
+    async def wait(self):
+        """Дожидается завершения генерации (вместе с сохранением ответа)."""
+        if self.task is not None:
+            await asyncio.wait({self.task})
+
+
+class GenerationRegistry:
+    """
+    Идущие и недавно завершенные генерации процесса по id.
+
+    Генерация выполняется отдельной задачей и не зависит от сокета,
+    который ее запустил: отключившийся клиент может переподключиться и
+    продолжить чтение с нужной позиции, пока запись не устарела.
+    """
+
+    def __init__(self, ttl: float = GENERATION_REPLAY_TTL):
+        self.ttl = ttl
+        self._generations: Dict[str, LiveGeneration] = {}
+
+    def start(self, live: LiveGeneration, run: Callable[[LiveGeneration], Awaitable[Any]]) -> LiveGeneration:
+        """Запускает run(live) фоновой задачей и регистрирует генерацию."""
+        self._prune()
+        self._generations[live.id] = live
+        live.task = asyncio.create_task(self._run(live, run))
+        return live
+
+    async def _run(self, live: LiveGeneration, run: Callable[[LiveGeneration], Awaitable[Any]]):
+        try:
+            await run(live)
+        except asyncio.CancelledError:
+            live.finish(truncated=True)
+        except Exception as e:
+            # Ошибку получат подписчики из follow()
+            logger.debug("Генерация %s завершилась ошибкой: %s", live.id, e)
+            live.finish(truncated=True, error=e)
+        else:
+            live.finish()
+
+    def get(self, generation_id: str) -> Optional[LiveGeneration]:
+        self._prune()
+        return self._generations.get(generation_id)
+
+    def _prune(self):
+        deadline = time.monotonic() - self.ttl
+        for generation_id, live in list(self._generations.items()):
+            if live.done and live.finished_at < deadline:
+                del self._generations[generation_id]
+
+    async def stop(self):
+        """Прерывает идущие генерации (частичные ответы сохраняются) при остановке приложения."""
+        running = [live for live in self._generations.values() if not live.done]
+        for live in running:
+            live.cancel()
+        for live in running:
+            await live.wait()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "running": sum(1 for live in self._generations.values() if not live.done),
+            "finished": sum(1 for live in self._generations.values() if live.done),
+        }
+
+
+# Общий реестр генераций на процесс
+live_generations = GenerationRegistry()
@@ -0,0 +1,245 @@
+import os
+import time
+import uuid
+import asyncio
+import datetime
+import logging
+import contextlib
+from typing import List, Optional
+
+from sqlalchemy.orm import sessionmaker
+
+from app.database.db import async_session
+from app.models.models import Message, Worker, MESSAGE_COMPLETE, MESSAGE_STREAMING
+from app.services.chat_events import ChatEventHub, chat_events
+
+# Настраиваем логгер
+logger = logging.getLogger(__name__)
+
+# Ответ модели дописывается в БД каждые N фрагментов или T мс, что наступит раньше
+MESSAGE_FLUSH_TOKENS = int(os.environ.get("MESSAGE_FLUSH_TOKENS", 32))
+MESSAGE_FLUSH_INTERVAL_MS = int(os.environ.get("MESSAGE_FLUSH_INTERVAL_MS", 1000))
+# Процесс отмечается в таблице workers раз в WORKER_HEARTBEAT_INTERVAL секунд;
+# ответы процесса, который не отмечался дольше WORKER_HEARTBEAT_TIMEOUT
+# секунд, при запуске другого процесса считаются оборванными
+WORKER_HEARTBEAT_INTERVAL = float(os.environ.get("WORKER_HEARTBEAT_INTERVAL", 10))
+WORKER_HEARTBEAT_TIMEOUT = float(os.environ.get("WORKER_HEARTBEAT_TIMEOUT", 60))
+
+# Id текущего процесса в workers и в messages.writer_id
+WORKER_ID = uuid.uuid4().hex
+
+
+class MessageWriter:
+    """
+    Сохраняет ответ модели по мере генерации.
+
+    Строка ответа создается со статусом streaming в начале генерации,
+    накопленные фрагменты дописываются одним UPDATE каждые flush_tokens
+    фрагментов или flush_interval_ms миллисекунд, в конце строка
+    получает статус complete. При падении процесса теряется не больше
+    одного интервала записи, а частичный ответ виден другим читателям.
+    Каждая запись идет в своей короткой сессии из session_factory.
+
+    Промежуточная запись выполняется фоновой задачей, чтобы чтение
+    ответа модели не ждало БД: одновременно идет не больше одной записи,
+    и она забирает все фрагменты, накопленные к ее началу.
+
+    Сообщение пользователя, начало, фрагменты и завершение ответа
+    публикуются подписчикам чата в events сразу, не дожидаясь записи в БД.
+
+    Строка ответа помечается worker_id процесса: если процесс упадет,
+    недописанный ответ завершит WorkerHeartbeat другого процесса.
+    """
+
+    def __init__(self, session_factory: sessionmaker, chat_id: int,
+                 flush_tokens: int = MESSAGE_FLUSH_TOKENS, flush_interval_ms: int = MESSAGE_FLUSH_INTERVAL_MS,
+                 events: ChatEventHub = chat_events, generation_id: Optional[str] = None,
+                 worker_id: str = WORKER_ID):
+        self.session_factory = session_factory
+        self.worker_id = worker_id
+        self.chat_id = chat_id
+        self.events = events
+        self.generation_id = generation_id or uuid.uuid4().hex
+        self.flush_tokens = max(1, flush_tokens)
+        self.flush_interval = flush_interval_ms / 1000
+        self.message: Optional[Message] = None
+        self.parts: List[str] = []
+        self.size = 0
+        # Индекс первого фрагмента, еще не записанного в БД
+        self._unflushed = 0
+        self._flushed_at = 0.0
+        self._flush_task: Optional[asyncio.Task] = None
+        self.flushes = 0
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    async def start(self, user_message: Optional[Message] = None) -> Message:
+        """Создает строку ответа; несохраненное сообщение пользователя пишется той же транзакцией."""
+        async with self.session_factory() as db:
+            if user_message is not None:
+                db.add(user_message)
+            self.message = await Message.create(db, self.chat_id, "assistant", "", status=MESSAGE_STREAMING,
+                                                writer_id=self.worker_id)
+            await db.commit()
+        self._flushed_at = time.monotonic()
+        if user_message is not None:
+            self.publish_user_message(user_message)
+        self._publish("generation")
+        return self.message
+
+    def publish_user_message(self, message: Message):
+        """Публикует сохраненное сообщение пользователя, на которое пишется ответ."""
+        self.events.publish(self.chat_id, {
+            "type": "user_message",
+            "generation_id": self.generation_id,
+            "message_id": message.id,
+            "content": message.content
+        })
+
+    async def push(self, chunk: str):
+        if not chunk:
+            return
+        self._publish("chunk", offset=self.size, chunk=chunk)
+        self.parts.append(chunk)
+        self.size += len(chunk)
+        if self._flush_task is not None and not self._flush_task.done():
+            # Запись уже идет, новые фрагменты заберет следующая
+            return
+        if (len(self.parts) - self._unflushed >= self.flush_tokens
+                or time.monotonic() - self._flushed_at >= self.flush_interval):
+            self._flush_task = asyncio.create_task(self._flush_in_background())
+
+    async def _flush_in_background(self):
+        try:
+            await self.flush()
+        except Exception as e:
+            # Итоговый текст все равно запишет finish()
+            logger.warning("Не удалось дописать ответ %s: %s", self.message.id, e)
+
+    async def flush(self):
+        """Дописывает накопленные фрагменты в строку ответа."""
+        if self._unflushed == len(self.parts):
+            return
+        text = "".join(self.parts[self._unflushed:])
+        self._unflushed = len(self.parts)
+        self._flushed_at = time.monotonic()
+        async with self.session_factory() as db:
+            await Message.append_content(db, self.message.id, text)
+            await db.commit()
+        self.flushes += 1
+
+    async def drain(self):
+        """Дожидается идущей фоновой записи."""
+        if self._flush_task is not None:
+            await asyncio.wait({self._flush_task})
+            self._flush_task = None
+
+    async def finish(self, truncated: bool = False) -> Optional[Message]:
+        """
+        Записывает итоговый текст и статус complete. Прерванный до первого
+        фрагмента ответ удаляется; тогда возвращается None.
+        """
+        if self.message is None:
+            return None
+        # Итоговая запись не должна обгонять промежуточную
+        await self.drain()
+        content = self.text
+        self._unflushed = len(self.parts)
+        async with self.session_factory() as db:
+            db.add(self.message)
+            if truncated and not content:
+                await db.delete(self.message)
+                await db.commit()
+                self._publish("done", truncated=True)
+                return None
+            self.message.content = content
+            self.message.truncated = truncated
+            self.message.status = MESSAGE_COMPLETE
+            await db.commit()
+        self._publish("done", truncated=truncated)
+        return self.message
+
+    def _publish(self, event_type: str, **fields):
+        self.events.publish(self.chat_id, {
+            "type": event_type,
+            "generation_id": self.generation_id,
+            "message_id": self.message.id,
+            **fields
+        })
+
+
+async def close_stale_messages(session_factory: sessionmaker, heartbeat_timeout: float = WORKER_HEARTBEAT_TIMEOUT) -> int:
+    """
+    Завершает ответы, оставшиеся в статусе streaming после падения
+    процесса, - они помечаются complete и truncated. Ответы процессов,
+    которые отмечались в workers за последние heartbeat_timeout секунд,
+    не трогаются; записи упавших процессов удаляются.
+    """
+    heartbeat_before = datetime.datetime.utcnow() - datetime.timedelta(seconds=heartbeat_timeout)
+    async with session_factory() as db:
+        closed = await Message.close_orphaned(db, heartbeat_before)
+        await Worker.remove_stale(db, heartbeat_before)
+        await db.commit()
+    if closed:
+        logger.warning("Завершено %d ответов, оборванных во время генерации", closed)
+    return closed
+
+
+class WorkerHeartbeat:
+    """
+    Отметка живого процесса в таблице workers.
+
+    При запуске процесс отмечается и завершает ответы упавших процессов,
+    затем отмечается в фоне раз в interval секунд. Ответы, которые пишет
+    другой живой воркер, не трогаются - ни при нескольких воркерах, ни
+    при поочередном перезапуске. При остановке запись процесса удаляется.
+    """
+
+    def __init__(self, session_factory: sessionmaker = async_session, worker_id: str = WORKER_ID,
+                 interval: float = WORKER_HEARTBEAT_INTERVAL, timeout: float = WORKER_HEARTBEAT_TIMEOUT):
+        self.session_factory = session_factory
+        self.worker_id = worker_id
+        self.interval = interval
+        self.timeout = timeout
+        self._task: Optional[asyncio.Task] = None
+
+    async def beat(self):
+        async with self.session_factory() as db:
+            await Worker.heartbeat(db, self.worker_id)
+            await db.commit()
+
+    async def start(self) -> int:
+        """Отмечает процесс и завершает оборванные ответы; возвращает их число."""
+        await self.beat()
+        closed = await close_stale_messages(self.session_factory, self.timeout)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop())
+        return closed
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.beat()
+            except Exception as e:
+                logger.warning("Не удалось отметить процесс %s: %s", self.worker_id, e)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        # Вызывается после остановки генераций: ответов процесса в статусе streaming уже нет
+        try:
+            async with self.session_factory() as db:
+                await Worker.remove(db, self.worker_id)
+                await db.commit()
+        except Exception as e:
+            logger.warning("Не удалось удалить запись процесса %s: %s", self.worker_id, e)
+
+
+# Отметка текущего процесса
+worker_heartbeat = WorkerHeartbeat()
@@ -0,0 +1,278 @@
+import time
+import logging
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.services.generation_scheduler import generation_scheduler
+
+# Настраиваем логгер
+logger = logging.getLogger(__name__)
+
+# Границы гистограмм (секунды и токены в секунду)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+DB_QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+DB_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+TOKENS_PER_SECOND_BUCKETS = (1, 5, 10, 20, 30, 50, 75, 100, 150, 250)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """Монотонно растущий счетчик."""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, value: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + value
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{_labels(self.labelnames, k)} {_number(v)}" for k, v in self._values.items()]
+
+
+class Gauge(Counter):
+    """Текущее значение, может уменьшаться."""
+    kind = "gauge"
+
+    def dec(self, *labels: str, value: float = 1):
+        self.inc(*labels, value=-value)
+
+    def set(self, *labels: str, value: float):
+        self._values[labels] = value
+
+
+class Histogram(_Metric):
+    """
+    Гистограмма с фиксированными границами.
+
+    observe() увеличивает один счетчик корзины, накопленные суммы
+    считаются только при выдаче метрик.
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Для каждого набора меток: [счетчики корзин..., +Inf], сумма
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str):
+        item = self._values.get(labels)
+        if item is None:
+            item = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        item[0][bisect_left(self.buckets, value)] += 1
+        item[1] += value
+
+    def render(self) -> List[str]:
+        lines = []
+        for labels, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Реестр метрик процесса в текстовом формате Prometheus.
+
+    Метрики агрегируются в памяти процесса; значения, которые дешевле
+    прочитать в момент выдачи (очередь генераций), отдают коллекторы.
+    """
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], Iterable[str]]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], Iterable[str]]):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.header())
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            try:
+                lines.extend(collector())
+            except Exception as e:
+                logger.warning("Ошибка сбора метрик: %s", e)
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+HTTP_REQUEST_DURATION = registry.register(Histogram(
+    "http_request_duration_seconds", "Длительность HTTP-запросов", ("method", "route", "status")))
+DB_QUERY_DURATION = registry.register(Histogram(
+    "db_query_duration_seconds", "Длительность SQL-запросов", buckets=DB_QUERY_BUCKETS))
+DB_QUERIES_PER_REQUEST = registry.register(Histogram(
+    "db_queries_per_request", "Число SQL-запросов на HTTP-запрос", ("route",), buckets=DB_COUNT_BUCKETS))
+DB_TIME_PER_REQUEST = registry.register(Histogram(
+    "db_time_per_request_seconds", "Суммарное время SQL-запросов на HTTP-запрос", ("route",)))
+OLLAMA_TIME_TO_FIRST_TOKEN = registry.register(Histogram(
+    "ollama_time_to_first_token_seconds", "Время до первого токена потоковой генерации", ("model",)))
+OLLAMA_REQUEST_DURATION = registry.register(Histogram(
+    "ollama_request_duration_seconds", "Полная длительность генерации", ("model", "mode")))
+OLLAMA_TOKENS_PER_SECOND = registry.register(Histogram(
+    "ollama_tokens_per_second", "Скорость генерации по eval_count/eval_duration", ("model",),
+    buckets=TOKENS_PER_SECOND_BUCKETS))
+OLLAMA_GENERATED_TOKENS = registry.register(Counter(
+    "ollama_generated_tokens_total", "Сгенерировано токенов (eval_count)", ("model",)))
+WEBSOCKETS_ACTIVE = registry.register(Gauge(
+    "websocket_connections_active", "Открытые WebSocket-соединения"))
+WEBSOCKETS_ACTIVE.set(value=0)
+
+
+def _generation_queue_metrics() -> List[str]:
+    """Занятость слотов и глубина очереди генераций на момент выдачи."""
+    stats = generation_scheduler.stats()
+    lines = [
+        "# HELP generation_active Выполняющиеся генерации",
+        "# TYPE generation_active gauge",
+    ]
+    lines += [f"generation_active{_labels(('model',), (m,))} {q['active']}" for m, q in stats["models"].items()]
+    lines += [
+        "# HELP generation_queue_waiting Запросы в очереди генерации",
+        "# TYPE generation_queue_waiting gauge",
+    ]
+    lines += [f"generation_queue_waiting{_labels(('model',), (m,))} {q['waiting']}" for m, q in stats["models"].items()]
+    lines += [
+        "# HELP generation_rejected_total Запросы, отклоненные из-за заполненной очереди",
+        "# TYPE generation_rejected_total counter",
+        f"generation_rejected_total {stats['rejected_total']}",
+    ]
+    return lines
+
+
+registry.add_collector(_generation_queue_metrics)
+
+
+class _RequestStats:
+    __slots__ = ("queries", "db_time")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+
+
+# Счетчики SQL текущего HTTP-запроса
+_request_stats: ContextVar[Optional[_RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def observe_generation(model: str, mode: str, started: float, done: Optional[dict] = None):
+    """
+    Записывает длительность генерации и, если есть итоговая строка Ollama
+    (done), число токенов и скорость по eval_count/eval_duration.
+    """
+    OLLAMA_REQUEST_DURATION.observe(time.perf_counter() - started, model, mode)
+    if not done:
+        return
+    eval_count = done.get("eval_count")
+    eval_duration = done.get("eval_duration")
+    if eval_count:
+        OLLAMA_GENERATED_TOKENS.inc(model, value=eval_count)
+        if eval_duration:
+            OLLAMA_TOKENS_PER_SECOND.observe(eval_count / (eval_duration / 1e9), model)
+
+
+def instrument_engine(engine: Engine):
+    """Подписывается на события движка: число и длительность SQL-запросов."""
+
+    # Время начала хранится в контексте выполнения запроса: у упавшего
+    # запроса after_cursor_execute не вызывается, и в соединении ничего не остается
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._query_started = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_query_started", None)
+        if started is None:
+            return
+        duration = time.perf_counter() - started
+        DB_QUERY_DURATION.observe(duration)
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_time += duration
+
+
+class MetricsMiddleware:
+    """
+    ASGI-middleware: длительность HTTP-запросов по шаблону маршрута
+    (не по пути, чтобы id в URL не раздували число рядов) и SQL-запросы
+    на запрос. Для потоковых ответов длительность включает отдачу тела.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = _RequestStats()
+        token = _request_stats.set(stats)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_stats.reset(token)
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            HTTP_REQUEST_DURATION.observe(time.perf_counter() - started, scope["method"], path, str(status))
+            DB_QUERIES_PER_REQUEST.observe(stats.queries, path)
+            DB_TIME_PER_REQUEST.observe(stats.db_time, path)
@@ -0,0 +1,127 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Dict, Optional
+
+from app.database.db import async_session
+from app.models.models import ChatModel, PromptTemplate
+from app.services.catalog_cache import catalog_cache
+from app.services.ollama_service import OllamaService, ollama_service
+
+# Настраиваем логгер
+logger = logging.getLogger(__name__)
+
+# Период опроса /api/tags (0 - только по запросу) и окно склейки триггеров
+MODEL_REFRESH_INTERVAL = float(os.environ.get("MODEL_REFRESH_INTERVAL", 300))
+MODEL_REFRESH_DEBOUNCE = float(os.environ.get("MODEL_REFRESH_DEBOUNCE", 1.0))
+
+DEFAULT_TEMPLATE_NAME = "Личный ассистент Артём"
+DEFAULT_SYSTEM_PROMPT = "Ты полезный помощник по имени Артём. Отвечай на вопросы пользователя дружелюбно и информативно."
+
+
+class ModelCatalogRefresher:
+    """
+    Фоновая синхронизация таблицы моделей с Ollama.
+
+    Обработчики запросов только читают каталог из БД и при необходимости
+    вызывают trigger(). Одновременные запросы на обновление склеиваются
+    в одну синхронизацию (single-flight), триггеры в пределах окна
+    debounce - в один запуск.
+    """
+
+    def __init__(self, ollama: OllamaService = ollama_service, session_factory=async_session,
+                 interval: float = MODEL_REFRESH_INTERVAL, debounce: float = MODEL_REFRESH_DEBOUNCE):
+        self.ollama = ollama
+        self.session_factory = session_factory
+        self.interval = interval
+        self.debounce = debounce
+        self._inflight: Optional[asyncio.Task] = None
+        self._pending: Optional[asyncio.Task] = None
+        self._poller: Optional[asyncio.Task] = None
+        self.syncs_total = 0
+        self.last_sync: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    def start(self, immediate: bool = True):
+        """Запускает фоновый опрос Ollama; immediate - первая синхронизация сразу."""
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.create_task(self._poll(immediate))
+
+    async def stop(self):
+        for task in (self._poller, self._pending, self._inflight):
+            if task is not None and not task.done():
+                task.cancel()
+        for task in (self._poller, self._pending, self._inflight):
+            if task is not None:
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+        self._poller = self._pending = self._inflight = None
+
+    async def _poll(self, immediate: bool):
+        if immediate:
+            await self.refresh()
+        while self.interval > 0:
+            await asyncio.sleep(self.interval)
+            await self.refresh()
+
+    def trigger(self):
+        """Запрашивает обновление без ожидания; повторные вызовы в окне debounce склеиваются."""
+        if self._pending is None or self._pending.done():
+            self._pending = asyncio.create_task(self._debounced())
+
+    async def _debounced(self):
+        await asyncio.sleep(self.debounce)
+        await self.refresh()
+
+    async def refresh(self) -> Optional[Dict[str, Any]]:
+        """Синхронизирует каталог; если синхронизация уже идет, ждет ее результата."""
+        if self._inflight is None or self._inflight.done():
+            self._inflight = asyncio.create_task(self._sync())
+        # shield: отмена одного ожидающего не прерывает общую синхронизацию
+        return await asyncio.shield(self._inflight)
+
+    async def _sync(self) -> Optional[Dict[str, Any]]:
+        try:
+            api_models = await self.ollama.list_models()
+            if not api_models:
+                logger.warning("Не получены модели от Ollama API. Проверьте соединение с сервером Ollama.")
+                self.last_error = "Ollama API не вернул список моделей"
+                return None
+
+            async with self.session_factory() as db:
+                stats = await ChatModel.sync(db, api_models, system_prompt=await self._default_system_prompt(db))
+                await db.commit()
+
+            # Список моделей мог измениться - сбрасываем кэш каталога
+            catalog_cache.clear()
+            self.syncs_total += 1
+            self.last_sync = time.time()
+            self.last_error = None
+            logger.info("Синхронизация моделей: добавлено %s, обновлено %s, удалено %s", stats['added'], stats['updated'], stats['removed'])
+            return stats
+        except Exception as e:
+            self.last_error = str(e)
+            logger.error("Ошибка при синхронизации моделей: %s", e, exc_info=True)
+            return None
+
+    async def _default_system_prompt(self, db) -> str:
+        for template in await PromptTemplate.get_all(db):
+            if template.name == DEFAULT_TEMPLATE_NAME:
+                return template.system_prompt
+        return DEFAULT_SYSTEM_PROMPT
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "syncs_total": self.syncs_total,
+            "last_sync": self.last_sync,
+            "last_error": self.last_error,
+            "in_progress": self._inflight is not None and not self._inflight.done(),
+            "interval": self.interval,
+        }
+
+
+# Общий фоновый синхронизатор каталога на процесс
+model_catalog = ModelCatalogRefresher()
@@ -0,0 +1,153 @@
+import os
+import re
+import time
+import asyncio
+import logging
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+# Настраиваем логгер
+logger = logging.getLogger(__name__)
+
+# Период проверки бэкендов через /api/tags (секунды, 0 - только по запросу)
+OLLAMA_HEALTH_INTERVAL = float(os.environ.get("OLLAMA_HEALTH_INTERVAL", 15))
+
+
+def parse_backends(spec: str) -> List[str]:
+    """Разбирает список адресов Ollama, разделенных запятыми или пробелами."""
+    urls = [url.strip().rstrip("/") for url in re.split(r"[,\s]+", spec or "")]
+    return [url for url in urls if url]
+
+
+class OllamaBackend:
+    """Один сервер Ollama: доступность, загруженные модели и текущая нагрузка."""
+
+    __slots__ = ("url", "healthy", "models", "active", "requests_total", "failures", "last_check", "last_error")
+
+    def __init__(self, url: str):
+        self.url = url
+        self.healthy = True
+        # None - список моделей еще не известен, считаем что модель может быть
+        self.models: Optional[Set[str]] = None
+        self.active = 0
+        self.requests_total = 0
+        self.failures = 0
+        self.last_check: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    def has_model(self, name: str) -> bool:
+        if self.models is None:
+            return True
+        return name in self.models or f"{name}:latest" in self.models
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "models": sorted(self.models) if self.models is not None else None,
+            "active": self.active,
+            "requests_total": self.requests_total,
+            "failures": self.failures,
+            "last_check": self.last_check,
+            "last_error": self.last_error,
+        }
+
+
+class OllamaRouter:
+    """
+    Выбор сервера Ollama для запроса.
+
+    Генерация уходит на наименее загруженный доступный бэкенд, на котором
+    есть модель. Списки моделей и доступность обновляются периодической
+    проверкой /api/tags; бэкенд, на котором запрос упал с ошибкой
+    соединения, считается недоступным до следующей успешной проверки.
+    """
+
+    def __init__(self, urls: Iterable[str], interval: float = OLLAMA_HEALTH_INTERVAL):
+        self.backends = [OllamaBackend(url) for url in urls]
+        if not self.backends:
+            raise ValueError("Не задан ни один адрес Ollama")
+        self.interval = interval
+        self._checker: Optional[asyncio.Task] = None
+
+    def pick(self, model: Optional[str] = None, exclude: Iterable[OllamaBackend] = ()) -> OllamaBackend:
+        """
+        Бэкенд для запроса к модели. Уже опробованные (exclude) пропускаются,
+        пока есть другие. Порядок предпочтения: доступные с моделью, затем
+        недоступные с моделью, затем любые доступные и, наконец, любые.
+        """
+        excluded = set(map(id, exclude))
+        pool = [b for b in self.backends if id(b) not in excluded] or self.backends
+        with_model = [b for b in pool if model is None or b.has_model(model)]
+        candidates = (
+            [b for b in with_model if b.healthy] or with_model
+            or [b for b in pool if b.healthy] or pool
+        )
+        return min(candidates, key=lambda b: (b.active, b.requests_total))
+
+    @contextmanager
+    def lease(self, backend: OllamaBackend):
+        """Учитывает запрос в нагрузке бэкенда на время блока."""
+        backend.active += 1
+        backend.requests_total += 1
+        try:
+            yield backend
+        finally:
+            backend.active -= 1
+
+    def mark_failed(self, backend: OllamaBackend, error: BaseException):
+        if backend.healthy:
+            logger.warning("Бэкенд Ollama %s недоступен: %s", backend.url, error)
+        backend.healthy = False
+        backend.failures += 1
+        backend.last_error = str(error) or type(error).__name__
+
+    def mark_healthy(self, backend: OllamaBackend, models: List[Dict[str, Any]]):
+        if not backend.healthy:
+            logger.info("Бэкенд Ollama %s снова доступен", backend.url)
+        backend.healthy = True
+        backend.models = {m.get("name") for m in models if m.get("name")}
+        backend.last_check = time.time()
+        backend.last_error = None
+
+    def forget_model(self, backend: OllamaBackend, model: str):
+        """Модели не оказалось на бэкенде (например, ее удалили после проверки)."""
+        if backend.models is not None:
+            backend.models.discard(model)
+            backend.models.discard(f"{model}:latest")
+
+    async def check(self, probe: Callable[[OllamaBackend], Awaitable[List[Dict[str, Any]]]]) -> List[Optional[List[Dict[str, Any]]]]:
+        """Опрашивает все бэкенды; для недоступных в результате None."""
+        return await asyncio.gather(*(self._check_one(backend, probe) for backend in self.backends))
+
+    async def _check_one(self, backend: OllamaBackend, probe) -> Optional[List[Dict[str, Any]]]:
+        try:
+            models = await probe(backend)
+        except Exception as e:
+            backend.last_check = time.time()
+            self.mark_failed(backend, e)
+            return None
+        self.mark_healthy(backend, models)
+        return models
+
+    def start(self, probe: Callable[[OllamaBackend], Awaitable[List[Dict[str, Any]]]]):
+        """Запускает периодическую проверку бэкендов."""
+        if self.interval > 0 and (self._checker is None or self._checker.done()):
+            self._checker = asyncio.create_task(self._check_loop(probe))
+
+    async def _check_loop(self, probe):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.check(probe)
+
+    async def stop(self):
+        if self._checker is not None and not self._checker.done():
+            self._checker.cancel()
+            try:
+                await self._checker
+            except asyncio.CancelledError:
+                pass
+        self._checker = None
+
+    def status(self) -> List[Dict[str, Any]]:
+        return [backend.status() for backend in self.backends]
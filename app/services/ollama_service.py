@@ -1,169 +1,290 @@
 import aiohttp
+import asyncio
 import os
 import json
+import time
 import logging
 from typing import List, Dict, Any, Optional, AsyncGenerator
+from app.services.ollama_router import OllamaBackend, OllamaRouter, parse_backends
+from app.services.metrics import OLLAMA_TIME_TO_FIRST_TOKEN, observe_generation
 
 # Настраиваем логгер
 logger = logging.getLogger(__name__)
 
+# Параметры пула соединений и таймаутов для запросов к Ollama
+OLLAMA_POOL_LIMIT = int(os.environ.get("OLLAMA_POOL_LIMIT", 100))
+OLLAMA_POOL_LIMIT_PER_HOST = int(os.environ.get("OLLAMA_POOL_LIMIT_PER_HOST", 20))
+OLLAMA_KEEPALIVE_TIMEOUT = float(os.environ.get("OLLAMA_KEEPALIVE_TIMEOUT", 60))
+OLLAMA_DNS_CACHE_TTL = int(os.environ.get("OLLAMA_DNS_CACHE_TTL", 300))
+OLLAMA_CONNECT_TIMEOUT = float(os.environ.get("OLLAMA_CONNECT_TIMEOUT", 5))
+OLLAMA_READ_TIMEOUT = float(os.environ.get("OLLAMA_READ_TIMEOUT", 300))
+# 0 - без ограничения общего времени запроса (генерация может идти долго)
+OLLAMA_TOTAL_TIMEOUT = float(os.environ.get("OLLAMA_TOTAL_TIMEOUT", 0))
+# Попыток генерации при ошибке соединения до первого токена и пауза между ними
+OLLAMA_MAX_ATTEMPTS = max(1, int(os.environ.get("OLLAMA_MAX_ATTEMPTS", 3)))
+OLLAMA_RETRY_BACKOFF = float(os.environ.get("OLLAMA_RETRY_BACKOFF", 0.2))
+# Таймаут проверки доступности бэкенда
+OLLAMA_HEALTH_TIMEOUT = float(os.environ.get("OLLAMA_HEALTH_TIMEOUT", 5))
+
+
+class StreamError(str):
+    """
+    Фрагмент потока с текстом ошибки генерации.
+
+    Это не часть ответа: потребитель потока прекращает чтение и поднимает
+    GenerationError, а ответ, полученный до ошибки, сохраняется с флагом
+    truncated (и не кэшируется). Пустой StreamError означает, что поток
+    оборвался без итоговой строки.
+    """
+
+
+class GenerationError(Exception):
+    """Генерация ответа оборвалась ошибкой Ollama (см. StreamError)."""
+
+    def __init__(self, error: StreamError):
+        super().__init__(error or "Ошибка: поток ответа модели оборвался")
+
+
 class OllamaService:
     """
     Сервис для взаимодействия с API Ollama.
+
+    Все запросы идут через одну общую aiohttp-сессию с ограниченным пулом
+    keep-alive соединений. Сессия создается при старте приложения
+    (или лениво при первом запросе) и закрывается при остановке.
+
+    OLLAMA_API_URL может содержать несколько адресов через запятую:
+    генерации распределяются OllamaRouter между доступными серверами,
+    на которых есть модель, а при ошибке соединения до первого токена
+    запрос повторяется на другом сервере.
     """
     
-    def __init__(self):
-        # Получаем базовый URL из переменных окружения или используем значение по умолчанию
-        self.base_url = os.environ.get("OLLAMA_API_URL", "http://localhost:11434/api")
-        logger.info(f"Инициализация OllamaService с base_url: {self.base_url}")
+    def __init__(self, base_url: Optional[str] = None):
+        # Получаем базовые URL из переменных окружения или используем значение по умолчанию
+        urls = parse_backends(base_url or os.environ.get("OLLAMA_API_URL", "http://localhost:11434/api"))
+        self.router = OllamaRouter(urls)
+        self.base_url = urls[0]
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._session_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._requests_total = 0
+        self._sessions_created = 0
+        logger.info("Инициализация OllamaService с бэкендами: %s", urls)
+
+    def _create_session(self) -> aiohttp.ClientSession:
+        """Создает сессию с пулом соединений по настройкам из окружения."""
+        connector = aiohttp.TCPConnector(
+            limit=OLLAMA_POOL_LIMIT,
+            limit_per_host=OLLAMA_POOL_LIMIT_PER_HOST,
+            keepalive_timeout=OLLAMA_KEEPALIVE_TIMEOUT,
+            ttl_dns_cache=OLLAMA_DNS_CACHE_TTL,
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=OLLAMA_TOTAL_TIMEOUT or None,
+            connect=OLLAMA_CONNECT_TIMEOUT,
+            sock_read=OLLAMA_READ_TIMEOUT,
+        )
+        self._sessions_created += 1
+        return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+    async def start(self):
+        """Открывает общую сессию и запускает проверку бэкендов (при старте приложения)."""
+        await self._get_session()
+        self.router.start(self._fetch_tags)
+
+    async def close(self):
+        """Останавливает проверку бэкендов, закрывает общую сессию и все соединения пула."""
+        await self.router.stop()
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._session_loop = None
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Возвращает общую сессию, пересоздавая ее при необходимости."""
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._session_loop is not loop:
+            # Сессия привязана к event loop, в котором была создана
+            if self._session is not None and not self._session.closed and not self._session_loop.is_closed():
+                await self._session.close()
+            self._session = self._create_session()
+            self._session_loop = loop
+        self._requests_total += 1
+        return self._session
+
+    def pool_stats(self) -> Dict[str, Any]:
+        """Статистика использования пула соединений."""
+        stats = {
+            "base_url": self.base_url,
+            "limit": OLLAMA_POOL_LIMIT,
+            "limit_per_host": OLLAMA_POOL_LIMIT_PER_HOST,
+            "keepalive_timeout": OLLAMA_KEEPALIVE_TIMEOUT,
+            "requests_total": self._requests_total,
+            "sessions_created": self._sessions_created,
+            "backends": self.router.status(),
+            "active": 0,
+            "idle": 0,
+            "active_per_host": {},
+        }
+        if self._session is None or self._session.closed:
+            return stats
+        connector = self._session.connector
+        acquired = getattr(connector, "_acquired", ())
+        idle = getattr(connector, "_conns", {})
+        acquired_per_host = getattr(connector, "_acquired_per_host", {})
+        stats["active"] = len(acquired)
+        stats["idle"] = sum(len(conns) for conns in idle.values())
+        stats["active_per_host"] = {
+            f"{key.host}:{key.port}": len(conns) for key, conns in acquired_per_host.items()
+        }
+        return stats
+        
+    async def _fetch_tags(self, backend: OllamaBackend) -> List[Dict[str, Any]]:
+        """Список моделей одного бэкенда; ошибки пробрасываются."""
+        url = f"{backend.url}/tags"
+        logger.debug("Запрос списка моделей: GET %s", url)
         
+        session = await self._get_session()
+        async with session.get(url, timeout=aiohttp.ClientTimeout(total=OLLAMA_HEALTH_TIMEOUT)) as response:
+            if response.status != 200:
+                error_text = await response.text()
+                raise aiohttp.ClientResponseError(
+                    response.request_info, response.history, status=response.status, message=error_text
+                )
+            data = await response.json()
+            return data.get("models", [])
+    
     async def list_models(self):
         """
-        Получает список доступных моделей из API Ollama.
+        Получает список доступных моделей со всех бэкендов Ollama.
+        
+        Заодно обновляет доступность бэкендов и списки их моделей в роутере.
+        Модель, загруженная на нескольких серверах, попадает в список один раз.
         """
-        url = f"{self.base_url}/tags"
-        logger.info(f"Запрос списка моделей: GET {url}")
+        results = await self.router.check(self._fetch_tags)
         
-        try:
-            async with aiohttp.ClientSession() as session:
-                logger.info(f"Отправка запроса на получение моделей...")
-                async with session.get(url) as response:
-                    logger.info(f"Получен ответ от API Ollama, статус: {response.status}")
-                    if response.status == 200:
-                        text_response = await response.text()
-                        logger.info(f"Текст ответа: {text_response[:200]}...")
-                        
-                        data = await response.json()
-                        models = data.get("models", [])
-                        logger.info(f"Получено {len(models)} моделей")
-                        
-                        # Логируем каждую полученную модель
-                        for i, model in enumerate(models):
-                            logger.info(f"Модель {i+1}: {model.get('name')}")
-                        
-                        return models
-                    else:
-                        error_text = await response.text()
-                        logger.error(f"Ошибка при получении моделей: {response.status}, {error_text}")
-                        return []
-        except Exception as e:
-            logger.error(f"Исключение при получении моделей: {str(e)}", exc_info=True)
-            return []
+        models, seen = [], set()
+        for backend_models in results:
+            for model in backend_models or []:
+                if model.get("name") not in seen:
+                    seen.add(model.get("name"))
+                    models.append(model)
+        if all(backend_models is None for backend_models in results):
+            logger.error("Ни один бэкенд Ollama не вернул список моделей")
+        logger.debug("Получено %d моделей: %s", len(models), [m.get("name") for m in models])
+        return models
     
-    async def generate_completion(self, model: str, prompt: str, system_prompt: str = None, 
-                                 temperature: float = 0.7, max_tokens: int = 1024) -> str:
-        """
-        Генерирует завершение промпта с помощью указанной модели.
-        """
+    def _chat_payload(self, model: str, messages: List[Dict[str, str]], options: Optional[Dict[str, Any]],
+                      keep_alive: Optional[str], stream: bool) -> Dict[str, Any]:
+        """Формирует тело запроса к /api/chat."""
         payload = {
             "model": model,
-            "prompt": prompt,
-            "options": {
-                "temperature": temperature,
-            }
+            "messages": messages,
+            "options": dict(options or {}),
+            "stream": stream
         }
         
-        if max_tokens:
-            payload["options"]["num_predict"] = max_tokens
-            
-        if system_prompt:
-            payload["system"] = system_prompt
+        if keep_alive:
+            payload["keep_alive"] = keep_alive
         
-        url = f"{self.base_url}/generate"
-        logger.info(f"Генерация ответа: POST {url}, модель: {model}")
-        logger.info(f"Payload: {payload}")
-        
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, json=payload) as response:
-                    if response.status == 200:
-                        content_type = response.headers.get('Content-Type', '')
-                        logger.info(f"Content-Type ответа: {content_type}")
-                        
-                        if 'application/x-ndjson' in content_type:
-                            # Обработка потокового ответа
-                            full_response = ""
-                            async for line in response.content:
-                                if line:
-                                    try:
-                                        data = json.loads(line)
-                                        if not data.get("done", False):
-                                            chunk = data.get("response", "")
-                                            full_response += chunk
-                                    except Exception as e:
-                                        logger.error(f"Ошибка при обработке строки NDJSON: {str(e)}")
-                            return full_response
-                        else:
-                            # Обычный JSON ответ
-                            data = await response.json()
-                            return data.get("response", "")
-                    else:
-                        error_text = await response.text()
-                        logger.error(f"Ошибка при генерации ответа: {response.status}, {error_text}")
-                        return f"Ошибка: {response.status}, {error_text}"
-        except Exception as e:
-            logger.error(f"Исключение при генерации ответа: {str(e)}")
-            return f"Ошибка: {str(e)}"
+        return payload
     
-    async def generate_stream(self, model: str, prompt: str, system_prompt: str = None, 
-                            temperature: float = 0.7, max_tokens: int = 1024) -> AsyncGenerator[str, None]:
+    async def chat_stream(self, model: str, messages: List[Dict[str, str]],
+                          options: Optional[Dict[str, Any]] = None, keep_alive: Optional[str] = None) -> AsyncGenerator[str, None]:
         """
-        Потоково генерирует завершение промпта с помощью указанной модели.
+        Потоково генерирует ответ на диалог (массив messages) через /api/chat.
+        
+        При отмене задачи или закрытии генератора HTTP-запрос к Ollama
+        обрывается. Ошибка соединения до первого токена приводит к повтору
+        на другом бэкенде.
         """
-        payload = {
-            "model": model,
-            "prompt": prompt,
-            "options": {
-                "temperature": temperature,
-            },
-            "stream": True
-        }
+        payload = self._chat_payload(model, messages, options, keep_alive, stream=True)
+        started = time.perf_counter()
         
-        if max_tokens:
-            payload["options"]["num_predict"] = max_tokens
+        tried = []
+        for attempt in range(1, OLLAMA_MAX_ATTEMPTS + 1):
+            backend = self.router.pick(model, exclude=tried)
+            tried.append(backend)
+            url = f"{backend.url}/chat"
+            logger.info("Потоковая генерация: POST %s, модель: %s, сообщений: %d", url, model, len(messages))
             
-        if system_prompt:
-            payload["system"] = system_prompt
-        
-        url = f"{self.base_url}/generate"
-        logger.info(f"Потоковая генерация: POST {url}, модель: {model}")
-        
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, json=payload) as response:
-                    if response.status == 200:
-                        async for line in response.content:
-                            if line:
-                                try:
-                                    data = json.loads(line)
-                                    if not data.get("done"):
-                                        yield data.get("response", "")
-                                except Exception as e:
-                                    logger.error(f"Ошибка при обработке потокового ответа: {str(e)}")
-                                    print(f"Ошибка при обработке ответа: {e}")
-                    else:
+            streaming = False
+            finished = False
+            try:
+                session = await self._get_session()
+                with self.router.lease(backend):
+                    async with session.post(url, json=payload) as response:
+                        if response.status == 200:
+                            try:
+                                async for line in response.content:
+                                    if line.strip():
+                                        try:
+                                            data = json.loads(line)
+                                            if not data.get("done"):
+                                                if not streaming:
+                                                    streaming = True
+                                                    OLLAMA_TIME_TO_FIRST_TOKEN.observe(time.perf_counter() - started, model)
+                                                yield data.get("message", {}).get("content", "")
+                                            else:
+                                                # Итоговая строка: eval_count/eval_duration для скорости генерации
+                                                finished = True
+                                                observe_generation(model, "chat_stream", started, data)
+                                        except Exception as e:
+                                            logger.error("Ошибка при обработке потокового ответа: %s", e)
+                            except (asyncio.CancelledError, GeneratorExit):
+                                # Генерацию прервали: закрываем соединение, а не возвращаем
+                                # его в пул, чтобы Ollama сразу остановила модель
+                                response.close()
+                                logger.info("Потоковая генерация прервана, модель: %s", model)
+                                raise
+                            if not finished:
+                                logger.warning("Поток ответа модели %s закончился без итоговой строки", model)
+                                yield StreamError("")
+                            return
                         error_text = await response.text()
-                        logger.error(f"Ошибка при потоковой генерации: {response.status}, {error_text}")
-                        yield f"Ошибка: {response.status}, {error_text}"
-        except Exception as e:
-            logger.error(f"Исключение при потоковой генерации: {str(e)}")
-            yield f"Ошибка: {str(e)}"
+                        if response.status == 404 and attempt < OLLAMA_MAX_ATTEMPTS:
+                            # Модели на этом сервере уже нет, пробуем другой
+                            self.router.forget_model(backend, model)
+                            continue
+                        logger.error("Ошибка при потоковой генерации: %s, %s", response.status, error_text)
+                        yield StreamError(f"Ошибка: {response.status}, {error_text}")
+                        return
+            except aiohttp.ClientConnectionError as e:
+                self.router.mark_failed(backend, e)
+                # После первого токена повтор невозможен: клиент уже получил часть ответа
+                if streaming or attempt == OLLAMA_MAX_ATTEMPTS:
+                    logger.error("Исключение при потоковой генерации: %s", e)
+                    yield StreamError(f"Ошибка: {str(e)}")
+                    return
+                logger.warning("Ошибка соединения с %s, повтор (%d/%d): %s", backend.url, attempt, OLLAMA_MAX_ATTEMPTS, e)
+                await asyncio.sleep(OLLAMA_RETRY_BACKOFF * attempt)
+            except Exception as e:
+                logger.error("Исключение при потоковой генерации: %s", e)
+                yield StreamError(f"Ошибка: {str(e)}")
+                return
     
     async def get_model_info(self, model_name: str) -> Optional[Dict[str, Any]]:
         """Получает информацию о модели"""
-        url = f"{self.base_url}/show?name={model_name}"
-        logger.info(f"Запрос информации о модели: GET {url}")
+        url = f"{self.router.pick(model_name).url}/show?name={model_name}"
+        logger.debug("Запрос информации о модели: GET %s", url)
         
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        return data
-                    else:
-                        error_text = await response.text()
-                        logger.error(f"Ошибка при получении информации о модели: {response.status}, {error_text}")
-                        return None
+            session = await self._get_session()
+            async with session.get(url) as response:
+                if response.status == 200:
+                    data = await response.json()
+                    return data
+                else:
+                    error_text = await response.text()
+                    logger.error("Ошибка при получении информации о модели: %s, %s", response.status, error_text)
+                    return None
         except Exception as e:
-            logger.error(f"Исключение при получении информации о модели: {str(e)}")
-            return None 
\ No newline at end of file
+            logger.error("Исключение при получении информации о модели: %s", e)
+            return None 
+
+# Общий экземпляр сервиса на все приложение
+ollama_service = OllamaService()
+
+
+def get_ollama_service() -> OllamaService:
+    """Зависимость FastAPI, возвращающая общий экземпляр OllamaService."""
+    return ollama_service
@@ -0,0 +1,164 @@
+import os
+import re
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+
+import aiosqlite
+
+from app.services.catalog_cache import TTLCache
+from app.services.ollama_service import StreamError
+
+# Настраиваем логгер
+logger = logging.getLogger(__name__)
+
+# auto - кэшировать только ответы с temperature 0, always - все ответы, off - выключен.
+# Размер и время жизни кэша в памяти; RESPONSE_CACHE_DB - файл SQLite для
+# постоянного уровня кэша (пусто - только память)
+RESPONSE_CACHE_MODE = os.environ.get("RESPONSE_CACHE_MODE", "auto")
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", 512))
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", 3600))
+RESPONSE_CACHE_DB = os.environ.get("RESPONSE_CACHE_DB", "")
+
+# Ответ из кэша отдается по словам, чтобы кадры склеивались так же, как при генерации
+_REPLAY_CHUNK = re.compile(r"\s*\S+\s*|\s+")
+
+
+class ResponseCache:
+    """
+    Кэш ответов модели для одинаковых запросов.
+
+    Ключ - хэш имени модели, параметров генерации и точного контекста
+    сообщений. По умолчанию кэшируются только детерминированные ответы
+    (temperature 0); запрос может явно включить или выключить кэш.
+    Записи живут в LRU-кэше в памяти и, если задан файл, в SQLite, откуда
+    переживают перезапуск.
+    """
+
+    def __init__(self, mode: str = RESPONSE_CACHE_MODE, maxsize: int = RESPONSE_CACHE_SIZE,
+                 ttl: float = RESPONSE_CACHE_TTL, db_path: str = RESPONSE_CACHE_DB):
+        self.mode = mode
+        self.ttl = ttl
+        self.db_path = db_path
+        self._memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._db: Optional[aiosqlite.Connection] = None
+        self._db_lock = asyncio.Lock()
+        self.db_hits = 0
+        self.stores = 0
+
+    @staticmethod
+    def make_key(generation: Dict[str, Any]) -> str:
+        """Хэш модели, параметров генерации и контекста; keep_alive на ответ не влияет."""
+        options = {
+            name: round(value, 6) if isinstance(value, float) else value
+            for name, value in (generation.get("options") or {}).items()
+            if value is not None
+        }
+        data = json.dumps(
+            {"model": generation["model"], "options": options, "messages": generation["messages"]},
+            sort_keys=True, ensure_ascii=False, separators=(",", ":"),
+        )
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def key_for(self, generation: Dict[str, Any], use_cache: Optional[bool] = None) -> Optional[str]:
+        """Ключ кэша для запроса или None, если ответ кэшировать не нужно."""
+        if self.mode == "off" or use_cache is False:
+            return None
+        if use_cache is None and self.mode != "always":
+            if (generation.get("options") or {}).get("temperature") != 0:
+                return None
+        return self.make_key(generation)
+
+    async def _connection(self) -> Optional[aiosqlite.Connection]:
+        if not self.db_path:
+            return None
+        async with self._db_lock:
+            if self._db is None:
+                self._db = await aiosqlite.connect(self.db_path)
+                await self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS response_cache ("
+                    "key TEXT PRIMARY KEY, model TEXT NOT NULL, response TEXT NOT NULL, created_at REAL NOT NULL)"
+                )
+                await self._db.execute("DELETE FROM response_cache WHERE created_at < ?", (time.time() - self.ttl,))
+                await self._db.commit()
+        return self._db
+
+    async def get(self, key: str) -> Optional[str]:
+        response = self._memory.get(key, None)
+        if response is not None:
+            return response
+        db = await self._connection()
+        if db is None:
+            return None
+        async with db.execute(
+            "SELECT response FROM response_cache WHERE key = ? AND created_at >= ?",
+            (key, time.time() - self.ttl),
+        ) as cursor:
+            row = await cursor.fetchone()
+        if row is None:
+            return None
+        self.db_hits += 1
+        self._memory.set(key, row[0])
+        return row[0]
+
+    async def set(self, key: str, model: str, response: str):
+        if not response:
+            return
+        self._memory.set(key, response)
+        self.stores += 1
+        db = await self._connection()
+        if db is not None:
+            await db.execute(
+                "INSERT OR REPLACE INTO response_cache (key, model, response, created_at) VALUES (?, ?, ?, ?)",
+                (key, model, response, time.time()),
+            )
+            await db.commit()
+
+    async def stream(self, generation: Dict[str, Any], source: Callable[..., AsyncIterator[str]],
+                     use_cache: Optional[bool] = None) -> AsyncIterator[str]:
+        """
+        Поток ответа: из кэша (по словам) или от source(**generation).
+        Прерванная или завершившаяся ошибкой (фрагмент StreamError)
+        генерация в кэш не попадает.
+        """
+        key = self.key_for(generation, use_cache)
+        if key is not None:
+            cached = await self.get(key)
+            if cached is not None:
+                logger.debug("Ответ для модели %s взят из кэша", generation["model"])
+                for chunk in _REPLAY_CHUNK.findall(cached):
+                    yield chunk
+                return
+
+        parts = []
+        failed = False
+        async for chunk in source(**generation):
+            if isinstance(chunk, StreamError):
+                # Ошибка может прийти после части ответа; маркер отдается потребителю как есть
+                failed = True
+            else:
+                parts.append(chunk)
+            yield chunk
+        if key is not None and not failed:
+            await self.set(key, generation["model"], "".join(parts))
+
+    async def close(self):
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "persistent": bool(self.db_path),
+            "db_hits": self.db_hits,
+            "stores": self.stores,
+            **self._memory.stats(),
+        }
+
+
+# Общий кэш ответов на процесс
+response_cache = ResponseCache()
@@ -0,0 +1,75 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Dict, Optional
+
+# Настраиваем логгер
+logger = logging.getLogger(__name__)
+
+# background - порт открывается сразу, прогрев идет в фоне;
+# blocking - startup ждет окончания прогрева (прежнее поведение)
+STARTUP_MODE = os.environ.get("STARTUP_MODE", "background")
+
+
+class StartupWarmup:
+    """
+    Прогрев приложения после открытия порта: заполнение шаблонов промптов
+    и первая синхронизация каталога моделей с Ollama.
+
+    Состояние прогрева отдается эндпоинтом готовности, чтобы балансировщик
+    не направлял трафик на экземпляр, который еще не закончил запуск.
+    """
+
+    def __init__(self, mode: str = STARTUP_MODE):
+        self.mode = mode
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.error: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.finished_at is not None
+
+    async def launch(self, warmup: Awaitable[Any]):
+        """Запускает прогрев: в фоне или с ожиданием, в зависимости от режима."""
+        self.started_at = time.time()
+        self.finished_at = None
+        self.error = None
+        if self.mode == "blocking":
+            await self._run(warmup)
+        else:
+            self._task = asyncio.create_task(self._run(warmup))
+
+    async def _run(self, warmup: Awaitable[Any]):
+        try:
+            await warmup
+        except Exception as e:
+            # Экземпляр все равно становится готовым: каталог дотянет фоновая синхронизация
+            self.error = str(e)
+            logger.error("Ошибка при прогреве приложения: %s", e, exc_info=True)
+        self.finished_at = time.time()
+        logger.info("Прогрев приложения завершен за %.2f с", self.finished_at - self.started_at)
+
+    async def stop(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "mode": self.mode,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+        }
+
+
+# Состояние прогрева на процесс
+startup_warmup = StartupWarmup()
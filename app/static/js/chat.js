@@ -7,6 +7,9 @@ document.addEventListener('DOMContentLoaded', function() {
     // Сразу устанавливаем обработчик нажатия клавиш для поля ввода
     setupKeyboardHandlers();
     
+    // Сокет чата: пинги сервера, события других вкладок и воркеров
+    setupChatSocket();
+    
     // Далее асинхронно загружаем данные
     initChatAsync();
 });
@@ -48,6 +51,9 @@ async function initChatAsync() {
             }
         }
         
+        // Подгрузка старых сообщений при прокрутке вверх
+        setupHistoryScroll();
+        
         // Добавляем обработчик отправки формы сообщения
         const messageForm = document.getElementById('messageForm');
         if (messageForm) {
@@ -157,129 +163,243 @@ function setupEventListeners() {
 }
 
 // Глобальные переменные и конфигурация
-let isWebSocketActive = false;
-let socket = null;
 let activeMessageId = null; // Глобальная переменная для отслеживания активного сообщения
 const API_BASE_URL = ''; // Базовый URL API (пустой для относительных путей)
 
+// Пауза перед переподключением сокета чата, мс: удваивается до WS_RECONNECT_MAX_MS
+const WS_RECONNECT_MIN_MS = 1000;
+const WS_RECONNECT_MAX_MS = 30000;
+let wsReconnectDelay = WS_RECONNECT_MIN_MS;
+let wsReconnectTimer = null;
+
+/**
+ * Открывает сокет чата при загрузке страницы чата
+ */
+function setupChatSocket() {
+    const chatContainer = document.getElementById('chatContainer');
+    if (!chatContainer || !chatContainer.dataset.chatId || !isWebSocketSupported()) {
+        return;
+    }
+    setupWebSocket(chatContainer.dataset.chatId);
+}
+
 /**
  * Настройка WebSocket соединения для чата
  */
 function setupWebSocket(chatId) {
-    if (window.chatSocket && window.chatSocket.readyState === WebSocket.OPEN) {
+    clearTimeout(wsReconnectTimer);
+    if (window.chatSocket && window.chatSocket.readyState <= WebSocket.OPEN) {
+        // Старый сокет закрывается без переподключения
+        window.chatSocket.onclose = null;
         window.chatSocket.close();
     }
     
     const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-    const wsUrl = `${protocol}//${window.location.host}/chat/ws/${chatId}`;
+    // Токены приходят склеенными кадрами: сброс раз в 50 мс или по 1 КБ
+    const wsUrl = `${protocol}//${window.location.host}/chat/ws/${chatId}?flush=balanced`;
     
-    window.chatSocket = new WebSocket(wsUrl);
+    const chatSocket = new WebSocket(wsUrl);
+    window.chatSocket = chatSocket;
     
-    window.chatSocket.onopen = function(e) {
+    chatSocket.onopen = function() {
         console.log('WebSocket соединение установлено');
+        wsReconnectDelay = WS_RECONNECT_MIN_MS;
+        // Ответ, прерванный обрывом связи, досылается с уже полученной позиции
+        // (offset - в символах Unicode, как считает сервер)
+        if (socketTurn) {
+            chatSocket.send(JSON.stringify({
+                type: 'resume',
+                generation_id: socketTurn.generationId,
+                offset: Array.from(socketTurn.text).length
+            }));
+        }
     };
     
-    window.chatSocket.onmessage = function(event) {
+    chatSocket.onmessage = function(event) {
         const data = JSON.parse(event.data);
         
-        if (data.error) {
-            showError(data.error);
+        // Сервер проверяет, что клиент на связи
+        if (data.type === 'ping') {
+            chatSocket.send(JSON.stringify({type: 'pong'}));
             return;
         }
         
-        if (data.type === 'user_message') {
-            // Пользовательское сообщение подтверждено
-            console.log('Сообщение пользователя подтверждено:', data);
-        } 
-        else if (data.type === 'assistant_message_chunk') {
-            // Обрабатываем фрагмент ответа от ассистента
-            const messageId = data.id;
-            const chunk = data.content;
-            
-            // Находим или создаем сообщение ассистента
-            const aiMessageElement = document.getElementById(`message-${messageId}`);
-            if (aiMessageElement) {
-                const contentElement = aiMessageElement.querySelector('.message-content');
-                contentElement.innerHTML = marked.parse(contentElement.innerHTML + chunk);
-                // Прокручиваем к последнему сообщению
-                scrollToBottom();
-            } else {
-                // Создаем новое сообщение ассистента
-                addAssistantMessageToUI(messageId, chunk);
-            }
-        }
-        else if (data.type === 'done') {
-            // Завершение генерации ответа
-            console.log('Генерация ответа завершена:', data);
-            // Включаем кнопку отправки и поле ввода
-            enableMessageInput();
-        }
-        else if (data.type === 'error') {
-            // Обрабатываем ошибку
-            showError(data.content);
-            enableMessageInput();
-        }
+        handleSocketFrame(data);
     };
     
-    window.chatSocket.onclose = function(event) {
-        if (event.wasClean) {
-            console.log(`Соединение закрыто (код=${event.code} причина=${event.reason})`);
-        } else {
-            console.log('Соединение прервано');
+    chatSocket.onclose = function(event) {
+        console.log(`Соединение закрыто (код=${event.code} причина=${event.reason})`);
+        const idle = event.code === 1000 && event.reason === 'idle timeout';
+        // Без id генерации ответ не продолжить, но он дописывается и сохраняется на сервере
+        if (socketTurn && (idle || !socketTurn.generationId)) {
+            finishSocketTurn();
+            showError('Соединение потеряно, ответ будет в истории чата');
         }
+        // Сервер закрыл сокет по простою - вкладка долго спала; следующий ход уйдет
+        // по HTTP и откроет сокет заново
+        if (idle) {
+            return;
+        }
+        // Сеть пропала или сервер перегружен (1013) - переподключаемся с растущей паузой
+        wsReconnectTimer = setTimeout(() => setupWebSocket(chatId), wsReconnectDelay);
+        wsReconnectDelay = Math.min(wsReconnectDelay * 2, WS_RECONNECT_MAX_MS);
     };
     
-    window.chatSocket.onerror = function(error) {
-        console.error(`WebSocket ошибка: ${error.message}`);
-        showError('Ошибка WebSocket соединения');
+    chatSocket.onerror = function(error) {
+        console.error('WebSocket ошибка:', error);
     };
 }
 
 /**
- * Добавляет сообщение ассистента в UI
+ * Обрабатывает кадр сервера
  */
-function addAssistantMessageToUI(messageId, content) {
-    const messagesList = document.querySelector('.messages-list');
-    const messageHTML = `
-        <div id="message-${messageId}" class="message message-assistant">
-            <div class="message-content">${marked.parse(content)}</div>
-        </div>
-    `;
-    messagesList.insertAdjacentHTML('beforeend', messageHTML);
+function handleSocketFrame(data) {
+    // Ответ, запрошенный из другой вкладки или на другом воркере
+    if (data.type === 'chat_event') {
+        handleChatEvent(data.event);
+        return;
+    }
+    
+    if (data.error) {
+        if (socketTurn) {
+            finishSocketTurn();
+        }
+        showError(data.error);
+        return;
+    }
+    
+    if (!socketTurn) {
+        return;
+    }
+    
+    if (data.type === 'generation') {
+        socketTurn.generationId = data.id;
+    }
+    else if (data.type === 'queued') {
+        if (!socketTurn.text) {
+            renderSocketTurn(`Ожидание в очереди: ${data.position}`);
+        }
+    }
+    else if (data.done) {
+        socketTurn.text = data.full_response;
+        renderSocketTurn(socketTurn.text);
+        finishSocketTurn();
+    }
+    else if (data.chunk) {
+        socketTurn.text += data.chunk;
+        renderSocketTurn(socketTurn.text);
+    }
+}
+
+// Ход, ответ на который идет через сокет: элемент ответа, id генерации и полученный текст
+let socketTurn = null;
+
+/**
+ * Выводит текст ответа в элемент текущего хода
+ */
+function renderSocketTurn(text) {
+    const element = document.getElementById(socketTurn.elementId);
+    if (element) {
+        element.querySelector('.message-content').innerHTML = marked.parse(text);
+        scrollToBottom();
+    }
+}
+
+/**
+ * Завершает ход: подсвечивает код и включает поле ввода
+ */
+function finishSocketTurn() {
+    const element = document.getElementById(socketTurn.elementId);
+    if (element) {
+        element.removeAttribute('id');
+    }
+    socketTurn = null;
     highlightCode();
-    scrollToBottom();
+    enableMessageInput();
 }
 
+// Текст ответов из событий чата по id сообщения
+const liveAnswers = {};
+// Ответ этой вкладки идет по HTTP - его события чата уже выводятся из потока
+let httpTurnActive = false;
+
 /**
- * Отправка сообщения через WebSocket
+ * Обрабатывает событие чата: сообщение пользователя, начало ответа,
+ * фрагмент (offset - позиция в символах ответа) или завершение. Сообщения
+ * выводятся в #chatMessages той же разметкой, что и история чата
  */
-function sendMessageViaWebSocket(message, modelName) {
-    if (!window.chatSocket || window.chatSocket.readyState !== WebSocket.OPEN) {
-        showError('WebSocket соединение не установлено');
+function handleChatEvent(event) {
+    // Часть событий пропущена или длинный вопрос пришел без текста - показываем сохраненную историю
+    if (event.type === 'lagged' || (event.type === 'user_message' && event.content === undefined)) {
+        window.location.reload();
         return;
     }
     
-    const messageData = {
-        prompt: message,
-        model: modelName
-    };
-    
-    window.chatSocket.send(JSON.stringify(messageData));
-    
-    // Добавляем сообщение пользователя в UI сразу
-    const messagesList = document.querySelector('.messages-list');
-    const messageHTML = `
-        <div class="message message-user">
-            <div class="message-content">${message}</div>
-        </div>
-    `;
-    messagesList.insertAdjacentHTML('beforeend', messageHTML);
-    
-    // Отключаем поле ввода и кнопку до получения ответа
-    disableMessageInput();
-    
-    // Прокручиваем к последнему сообщению
-    scrollToBottom();
+    const messageId = event.message_id;
+    if (event.type === 'user_message') {
+        if (httpTurnActive || findMessageElement(messageId)) {
+            return;
+        }
+        const chatMessages = document.getElementById('chatMessages');
+        chatMessages.insertAdjacentHTML('beforeend', createMessageHTML(event.content, 'user'));
+        chatMessages.lastElementChild.dataset.messageId = messageId;
+        scrollToBottom();
+    }
+    else if (event.type === 'generation') {
+        if (httpTurnActive) {
+            return;
+        }
+        liveAnswers[messageId] = '';
+        if (!findMessageElement(messageId)) {
+            const chatMessages = document.getElementById('chatMessages');
+            chatMessages.insertAdjacentHTML('beforeend', createMessageHTML('', 'assistant'));
+            chatMessages.lastElementChild.dataset.messageId = messageId;
+            scrollToBottom();
+        }
+    }
+    else if (event.type === 'chunk') {
+        // Ответ, начатый до открытия сокета, видно в истории после перезагрузки
+        if (!(messageId in liveAnswers)) {
+            return;
+        }
+        const text = liveAnswers[messageId];
+        // Пропущенный или уже полученный фрагмент не применяем
+        // (offset считается в символах Unicode)
+        if (event.offset !== Array.from(text).length) {
+            return;
+        }
+        liveAnswers[messageId] = text + event.chunk;
+        const element = findMessageElement(messageId);
+        if (element) {
+            element.querySelector('.message-content').innerHTML = marked.parse(liveAnswers[messageId]);
+            scrollToBottom();
+        }
+    }
+    else if (event.type === 'done') {
+        // Прерванный до первого фрагмента ответ удален на сервере
+        const element = findMessageElement(messageId);
+        if (element && event.truncated && !liveAnswers[messageId]) {
+            element.remove();
+        }
+        delete liveAnswers[messageId];
+        highlightCode();
+    }
+}
+
+/**
+ * Находит сообщение в #chatMessages по id
+ */
+function findMessageElement(messageId) {
+    return document.querySelector(`#chatMessages [data-message-id="${messageId}"]`);
+}
+
+/**
+ * Отправка сообщения через WebSocket: ответ выводится в элемент loadingId
+ * по кадрам, склеенным по политике ?flush=balanced
+ */
+function sendMessageViaWebSocket(message, modelName, loadingId) {
+    socketTurn = {elementId: loadingId, generationId: null, text: ''};
+    window.chatSocket.send(JSON.stringify({message: message, model: modelName}));
 }
 
 /**
@@ -464,6 +584,64 @@ function addMessageToUI(role, content) {
     }, 100);
 }
 
+/**
+ * Бесконечная прокрутка истории: при прокрутке к началу чата
+ * подгружает предыдущую страницу сообщений
+ */
+function setupHistoryScroll() {
+    const chatMessages = document.getElementById('chatMessages');
+    const chatContainer = document.getElementById('chatContainer');
+    if (!chatMessages || !chatContainer) {
+        return;
+    }
+    
+    let isLoadingHistory = false;
+    
+    chatMessages.addEventListener('scroll', async function() {
+        if (isLoadingHistory || chatMessages.dataset.hasMore !== 'true' || chatMessages.scrollTop > 100) {
+            return;
+        }
+        
+        const oldest = chatMessages.querySelector('[data-message-id]');
+        if (!oldest) {
+            return;
+        }
+        
+        isLoadingHistory = true;
+        try {
+            const chatId = chatContainer.dataset.chatId;
+            const response = await fetch(`/chat/chats/${chatId}/messages?before=${oldest.dataset.messageId}&limit=50`);
+            if (!response.ok) {
+                throw new Error(`Ошибка HTTP: ${response.status}`);
+            }
+            
+            const messages = await response.json();
+            chatMessages.dataset.hasMore = response.headers.get('X-Has-More') === 'true' ? 'true' : 'false';
+            
+            // Сохраняем позицию прокрутки при добавлении сообщений сверху
+            const previousHeight = chatMessages.scrollHeight;
+            const html = messages.map(message => {
+                const content = message.role === 'assistant' ? marked.parse(message.content || '') : formatMessage(message.content);
+                return `
+                    <div class="message ${message.role}-message" data-message-id="${message.id}">
+                        <div class="message-avatar">
+                            <div class="avatar ${message.role}-avatar">${message.role === 'user' ? 'Вы' : 'AI'}</div>
+                        </div>
+                        <div class="message-content">${content}</div>
+                    </div>
+                `;
+            }).join('');
+            chatMessages.insertAdjacentHTML('afterbegin', html);
+            chatMessages.scrollTop += chatMessages.scrollHeight - previousHeight;
+            highlightCode();
+        } catch (error) {
+            console.error('Ошибка при загрузке истории сообщений:', error);
+        } finally {
+            isLoadingHistory = false;
+        }
+    });
+}
+
 /**
  * Отправка сообщения через обычный HTTP запрос
  */
@@ -1350,6 +1528,17 @@ async function handleMessageSubmit(event) {
     console.log('Отключение поля ввода');
     disableMessageInput();
     
+    // Через открытый сокет; поле ввода включится по кадру завершения
+    if (window.chatSocket && window.chatSocket.readyState === WebSocket.OPEN) {
+        sendMessageViaWebSocket(message, currentModelName, loadingId);
+        return;
+    }
+    // Сокет закрыт сервером по простою - открываем заново для следующих ходов
+    if (window.chatSocket && window.chatSocket.readyState === WebSocket.CLOSED) {
+        setupChatSocket();
+    }
+    
+    httpTurnActive = true;
     try {
         console.log('Начало отправки сообщения на сервер...');
         
@@ -1360,53 +1549,97 @@ async function handleMessageSubmit(event) {
         };
         console.log('Данные для отправки:', requestBody);
         
-        // Отправляем запрос на сервер
-        console.log(`Отправка POST запроса на /chat/chats/${chatId}/messages`);
-        const response = await fetch(`/chat/chats/${chatId}/messages`, {
+        // Сокета нет - отправляем запрос на потоковый эндпоинт (NDJSON)
+        console.log(`Отправка POST запроса на /chat/chats/${chatId}/messages/stream`);
+        const response = await fetch(`/chat/chats/${chatId}/messages/stream`, {
             method: 'POST',
             headers: {
-                'Content-Type': 'application/json'
+                'Content-Type': 'application/json',
+                'Accept': 'application/x-ndjson'
             },
             body: JSON.stringify(requestBody)
         });
         console.log('Получен ответ от сервера, статус:', response.status);
         
-        // Удаляем индикатор загрузки
-        const loadingElement = document.getElementById(loadingId);
-        if (loadingElement) {
-            console.log('Удаление индикатора загрузки');
-            loadingElement.remove();
-        } else {
-            console.warn('Индикатор загрузки не найден:', loadingId);
-        }
-        
         if (!response.ok) {
+            const loadingElement = document.getElementById(loadingId);
+            if (loadingElement) {
+                loadingElement.remove();
+            }
             throw new Error(`Ошибка HTTP: ${response.status}`);
         }
         
-        const data = await response.json();
-        console.log('Получен ответ от сервера:', data);
+        // Выводим токены по мере поступления в элемент индикатора загрузки
+        const loadingElement = document.getElementById(loadingId);
+        const contentElement = loadingElement ? loadingElement.querySelector('.message-content') : null;
+        let fullResponse = '';
         
-        // Добавляем ответ модели в UI
-        if (data.assistant_message && data.assistant_message.content) {
-            console.log('Добавление ответа ассистента в UI');
-            addMessageToUI('assistant', data.assistant_message.content);
-            // Подсвечиваем код после добавления ответа
-            highlightCode();
+        await readNdjsonStream(response, (frame) => {
+            if (frame.error) {
+                throw new Error(frame.error);
+            }
+            if (frame.chunk) {
+                fullResponse += frame.chunk;
+                if (contentElement) {
+                    contentElement.innerHTML = marked.parse(fullResponse);
+                    scrollToBottom();
+                }
+            }
+            if (frame.done && frame.full_response !== undefined) {
+                fullResponse = frame.full_response;
+                if (loadingElement && frame.message) {
+                    loadingElement.dataset.messageId = frame.message.id;
+                }
+            }
+        });
+        
+        if (contentElement) {
+            contentElement.innerHTML = marked.parse(fullResponse);
+            loadingElement.removeAttribute('id');
         } else {
-            console.error('Ответ не содержит сообщения ассистента:', data);
-            showToast('Получен некорректный ответ от сервера', 'error');
+            addMessageToUI('assistant', fullResponse);
         }
+        // Подсвечиваем код после добавления ответа
+        highlightCode();
     } catch (error) {
         console.error('Ошибка при отправке сообщения:', error);
         showToast('Ошибка при отправке сообщения: ' + error.message, 'error');
     } finally {
+        httpTurnActive = false;
         // Включаем поле ввода и кнопки
         console.log('Включение поля ввода');
         enableMessageInput();
     }
 }
 
+/**
+ * Читает NDJSON-поток ответа и вызывает onFrame для каждого кадра
+ */
+async function readNdjsonStream(response, onFrame) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
+        
+        for (const line of lines) {
+            if (line.trim()) {
+                onFrame(JSON.parse(line));
+            }
+        }
+    }
+    
+    if (buffer.trim()) {
+        onFrame(JSON.parse(buffer));
+    }
+}
+
 /**
  * Проверяет, поддерживает ли браузер WebSocket
  */
@@ -0,0 +1,125 @@
+"""
+Заглушка Ollama API для нагрузочных тестов.
+
+Отвечает на /api/tags, /api/show и /api/chat, генерируя
+заданное число токенов с заданной скоростью и задержкой до первого
+токена. Итоговая строка содержит eval_count/eval_duration, как у Ollama.
+
+Запуск отдельным процессом:
+    python -m benchmarks.fake_ollama --port 11435 --token-rate 50 --latency 0.2
+"""
+import json
+import time
+import asyncio
+import argparse
+from dataclasses import dataclass, field
+from typing import List
+
+from aiohttp import web
+
+
+@dataclass
+class FakeOllamaConfig:
+    # Модели, которые отдает /api/tags
+    models: List[str] = field(default_factory=lambda: ["bench-model:latest"])
+    # Токенов в ответе, токенов в секунду (0 - без задержки) и задержка до первого токена
+    tokens: int = 32
+    token_rate: float = 200
+    latency: float = 0.01
+
+
+def _token(i: int) -> str:
+    return f"tok{i} "
+
+
+class FakeOllama:
+    """aiohttp-приложение, имитирующее Ollama API."""
+
+    def __init__(self, config: FakeOllamaConfig = None):
+        self.config = config or FakeOllamaConfig()
+        self.requests = 0
+        self.app = web.Application()
+        self.app.router.add_get("/api/tags", self.tags)
+        self.app.router.add_post("/api/show", self.show)
+        self.app.router.add_get("/api/show", self.show)
+        self.app.router.add_post("/api/chat", self.chat)
+
+    async def tags(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "models": [
+                {"name": name, "details": {"parameter_size": "7B", "family": "bench"}}
+                for name in self.config.models
+            ]
+        })
+
+    async def show(self, request: web.Request) -> web.Response:
+        return web.json_response({"details": {"parameter_size": "7B"}, "parameters": ""})
+
+    async def _tokens(self):
+        """Токены с задержкой до первого и паузами по token_rate."""
+        await asyncio.sleep(self.config.latency)
+        interval = 1 / self.config.token_rate if self.config.token_rate > 0 else 0
+        for i in range(self.config.tokens):
+            if i and interval:
+                await asyncio.sleep(interval)
+            yield _token(i)
+
+    def _stats(self, started: float, eval_started: float) -> dict:
+        now = time.perf_counter()
+        return {
+            "done": True,
+            "eval_count": self.config.tokens,
+            "eval_duration": int((now - eval_started) * 1e9),
+            "total_duration": int((now - started) * 1e9),
+        }
+
+    async def _respond(self, request: web.Request, wrap) -> web.StreamResponse:
+        self.requests += 1
+        payload = await request.json()
+        started = time.perf_counter()
+        eval_started = started + self.config.latency
+
+        if not payload.get("stream", True):
+            text = "".join([token async for token in self._tokens()])
+            return web.json_response({**wrap(text), **self._stats(started, eval_started), "model": payload.get("model")})
+
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await response.prepare(request)
+        async for token in self._tokens():
+            await response.write(json.dumps({**wrap(token), "done": False}).encode() + b"\n")
+        await response.write(json.dumps({**wrap(""), **self._stats(started, eval_started)}).encode() + b"\n")
+        await response.write_eof()
+        return response
+
+    async def chat(self, request: web.Request) -> web.StreamResponse:
+        return await self._respond(request, lambda text: {"message": {"role": "assistant", "content": text}})
+
+
+async def start_fake_ollama(config: FakeOllamaConfig = None, host: str = "127.0.0.1", port: int = 0):
+    """Запускает заглушку в текущем event loop; возвращает (runner, базовый URL API)."""
+    fake = FakeOllama(config)
+    runner = web.AppRunner(fake.app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    bound_port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{bound_port}/api"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Заглушка Ollama API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--models", default="bench-model:latest", help="модели через запятую")
+    parser.add_argument("--tokens", type=int, default=32)
+    parser.add_argument("--token-rate", type=float, default=200)
+    parser.add_argument("--latency", type=float, default=0.01)
+    args = parser.parse_args()
+
+    config = FakeOllamaConfig(models=args.models.split(","), tokens=args.tokens,
+                              token_rate=args.token_rate, latency=args.latency)
+    web.run_app(FakeOllama(config).app, host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+"""
+Нагрузочные сценарии для приложения на заглушке Ollama.
+
+Поднимает заглушку Ollama, запускает приложение через uvicorn отдельным
+процессом на временной базе SQLite и прогоняет сценарии:
+
+    rest_message  - POST /chat/chats/{id}/messages (ответ целиком)
+    ws_stream     - потоковый ответ через WebSocket /chat/ws/{id}
+    chat_list     - GET /chat/chats/list
+    model_refresh - GET /models/refresh (синхронизация каталога с Ollama)
+
+Для каждого сценария выводятся p50/p95/p99 задержки, запросы в секунду
+и процессорное время сервера. С --check сравнивает результат с порогами
+из JSON-файла и завершается с ошибкой при регрессии.
+
+    python -m benchmarks.run --requests 200 --concurrency 10
+    python -m benchmarks.run --check benchmarks/thresholds.json --json results.json
+"""
+import os
+import sys
+import json
+import math
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import aiohttp
+
+from benchmarks.fake_ollama import FakeOllamaConfig, start_fake_ollama
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ("rest_message", "ws_stream", "chat_list", "model_refresh")
+MODEL_NAME = "bench-model:latest"
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Перцентиль по ближайшему рангу; для пустого списка 0."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, min(len(ordered), math.ceil(q / 100 * len(ordered))))
+    return ordered[rank - 1]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def process_cpu_seconds(pid: int) -> Optional[float]:
+    """Процессорное время (user + system) процесса по /proc; None, если недоступно."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    # utime и stime - 14-е и 15-е поля stat, после имени процесса это 12-е и 13-е
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+class AppServer:
+    """Приложение под uvicorn в отдельном процессе."""
+
+    def __init__(self, ollama_url: str, database_path: str, concurrency: int):
+        self.port = _free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self.env = {
+            **os.environ,
+            "DATABASE_URL": f"sqlite+aiosqlite:///{database_path}",
+            "OLLAMA_API_URL": ollama_url,
+            "STARTUP_MODE": "blocking",
+            "LOG_LEVEL": os.environ.get("LOG_LEVEL", "WARNING"),
+            "MODEL_REFRESH_INTERVAL": "0",
+            "OLLAMA_HEALTH_INTERVAL": "0",
+            "GENERATION_CONCURRENCY": os.environ.get("GENERATION_CONCURRENCY", str(concurrency)),
+        }
+        self.process: Optional[subprocess.Popen] = None
+
+    async def start(self, timeout: float = 30):
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+             "--port", str(self.port), "--log-level", "warning", "--no-access-log"],
+            cwd=ROOT, env=self.env,
+        )
+        deadline = time.monotonic() + timeout
+        async with aiohttp.ClientSession() as session:
+            while time.monotonic() < deadline:
+                if self.process.poll() is not None:
+                    raise RuntimeError(f"Приложение завершилось с кодом {self.process.returncode}")
+                try:
+                    async with session.get(f"{self.base_url}/health/ready") as response:
+                        if response.status == 200:
+                            return
+                except aiohttp.ClientConnectionError:
+                    pass
+                await asyncio.sleep(0.2)
+        raise RuntimeError("Приложение не стало готовым за отведенное время")
+
+    def cpu_seconds(self) -> Optional[float]:
+        return process_cpu_seconds(self.process.pid) if self.process else None
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+async def run_scenario(name: str, server: AppServer, requests: int, concurrency: int,
+                       make_worker: Callable[[int], Awaitable[Callable[[], Awaitable[None]]]]) -> Dict[str, Any]:
+    """
+    Выполняет requests запросов в concurrency параллельных потоках.
+    make_worker(i) готовит поток (соединение, чат) и возвращает функцию одного запроса.
+    """
+    workers = [await make_worker(i) for i in range(concurrency)]
+    latencies: List[float] = []
+    errors = 0
+    remaining = requests
+
+    async def loop(request: Callable[[], Awaitable[None]]):
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            started = time.perf_counter()
+            try:
+                await request()
+            except Exception:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    cpu_before = server.cpu_seconds()
+    started = time.perf_counter()
+    await asyncio.gather(*(loop(worker) for worker in workers))
+    elapsed = time.perf_counter() - started
+    cpu_after = server.cpu_seconds()
+    for worker in workers:
+        close = getattr(worker, "close", None)
+        if close is not None:
+            await close()
+
+    cpu = cpu_after - cpu_before if cpu_before is not None and cpu_after is not None else None
+    return {
+        "scenario": name,
+        "requests": len(latencies),
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "server_cpu_s": round(cpu, 3) if cpu is not None else None,
+        "server_cpu_pct": round(cpu / elapsed * 100, 1) if cpu is not None and elapsed else None,
+    }
+
+
+async def _create_chat(session: aiohttp.ClientSession, base_url: str, model_id: int, title: str) -> int:
+    # Форма создания чата отвечает редиректом на /chat/chats/{id}
+    async with session.post(f"{base_url}/chat/chats/new", data={"title": title, "model_id": str(model_id)},
+                            allow_redirects=False) as response:
+        response.raise_for_status()
+        return int(response.headers["Location"].rstrip("/").rsplit("/", 1)[1])
+
+
+async def run_benchmarks(args) -> List[Dict[str, Any]]:
+    config = FakeOllamaConfig(models=[MODEL_NAME], tokens=args.tokens, token_rate=args.token_rate, latency=args.latency)
+    runner, ollama_url = await start_fake_ollama(config)
+    tmpdir = tempfile.TemporaryDirectory()
+    server = AppServer(ollama_url, os.path.join(tmpdir.name, "bench.db"), args.concurrency)
+    connector = aiohttp.TCPConnector(limit=args.concurrency * 2)
+    session = aiohttp.ClientSession(connector=connector)
+    results = []
+    try:
+        await server.start()
+        base = server.base_url
+
+        async with session.get(f"{base}/models/refresh") as response:
+            response.raise_for_status()
+            models = await response.json()
+        model_id = next(m["id"] for m in models if m["name"] == MODEL_NAME)
+
+        async def rest_worker(i: int):
+            chat_id = await _create_chat(session, base, model_id, f"REST {i}")
+
+            async def request():
+                async with session.post(f"{base}/chat/chats/{chat_id}/messages", json={"content": f"Вопрос {i}"}) as response:
+                    response.raise_for_status()
+                    await response.read()
+            return request
+
+        async def ws_worker(i: int):
+            chat_id = await _create_chat(session, base, model_id, f"WS {i}")
+            ws = await session.ws_connect(f"{base}/chat/ws/{chat_id}?flush=balanced")
+
+            async def request():
+                await ws.send_json({"message": f"Вопрос {i}", "model": MODEL_NAME})
+                while True:
+                    frame = await ws.receive_json()
+                    if frame.get("error"):
+                        raise RuntimeError(frame["error"])
+                    if frame.get("done"):
+                        return
+            request.close = ws.close
+            return request
+
+        def get_worker(path: str):
+            async def make(i: int):
+                async def request():
+                    async with session.get(f"{base}{path}") as response:
+                        response.raise_for_status()
+                        await response.read()
+                return request
+            return make
+
+        workers = {
+            "rest_message": rest_worker,
+            "ws_stream": ws_worker,
+            "chat_list": get_worker("/chat/chats/list"),
+            "model_refresh": get_worker("/models/refresh"),
+        }
+        for name in args.scenarios:
+            result = await run_scenario(name, server, args.requests, args.concurrency, workers[name])
+            results.append(result)
+            print(_format_row(result), flush=True)
+    finally:
+        await session.close()
+        server.stop()
+        await runner.cleanup()
+        tmpdir.cleanup()
+    return results
+
+
+def _format_row(result: Dict[str, Any]) -> str:
+    cpu = f"{result['server_cpu_pct']:>6}%" if result["server_cpu_pct"] is not None else "      -"
+    return (
+        f"{result['scenario']:<14} n={result['requests']:<5} err={result['errors']:<3} "
+        f"p50={result['p50_ms']:>8.2f}мс p95={result['p95_ms']:>8.2f}мс p99={result['p99_ms']:>8.2f}мс "
+        f"rps={result['rps']:>8.2f} cpu={cpu}"
+    )
+
+
+def check_thresholds(results: List[Dict[str, Any]], thresholds: Dict[str, Dict[str, float]]) -> List[str]:
+    """Нарушения порогов: max_p95_ms, max_p99_ms, min_rps и max_errors по сценариям."""
+    failures = []
+    for result in results:
+        limits = thresholds.get(result["scenario"], {})
+        name = result["scenario"]
+        if "max_p95_ms" in limits and result["p95_ms"] > limits["max_p95_ms"]:
+            failures.append(f"{name}: p95 {result['p95_ms']} мс > {limits['max_p95_ms']} мс")
+        if "max_p99_ms" in limits and result["p99_ms"] > limits["max_p99_ms"]:
+            failures.append(f"{name}: p99 {result['p99_ms']} мс > {limits['max_p99_ms']} мс")
+        if "min_rps" in limits and result["rps"] < limits["min_rps"]:
+            failures.append(f"{name}: {result['rps']} rps < {limits['min_rps']} rps")
+        if result["errors"] > limits.get("max_errors", 0):
+            failures.append(f"{name}: ошибок {result['errors']}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочные сценарии на заглушке Ollama")
+    parser.add_argument("--requests", type=int, default=200, help="запросов на сценарий")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="сценарии через запятую")
+    parser.add_argument("--tokens", type=int, default=32, help="токенов в ответе заглушки")
+    parser.add_argument("--token-rate", type=float, default=0, help="токенов в секунду, 0 - без задержки")
+    parser.add_argument("--latency", type=float, default=0, help="задержка до первого токена, секунды")
+    parser.add_argument("--json", help="сохранить результаты в JSON-файл")
+    parser.add_argument("--check", help="JSON-файл с порогами; при нарушении код возврата 1")
+    args = parser.parse_args()
+    args.scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"неизвестные сценарии: {', '.join(sorted(unknown))}")
+
+    results = asyncio.run(run_benchmarks(args))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if args.check:
+        with open(args.check, encoding="utf-8") as f:
+            failures = check_thresholds(results, json.load(f))
+        for failure in failures:
+            print(f"РЕГРЕССИЯ: {failure}", file=sys.stderr)
+        if failures:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,27 +5,71 @@ from fastapi.templating import Jinja2Templates
 import uvicorn
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.logging_config import setup_logging
+
+# Настройка логирования до импорта модулей приложения
+setup_logging()
+
 from app.database.db import get_db, init_db, async_session
 from app.database.seed_data import seed_default_prompts
 from app.models.models import ChatModel
-from app.routes import chat_routes, model_routes
+from app.routes import chat_routes, model_routes, health_routes, metrics_routes
+from app.services.ollama_service import ollama_service
+from app.services.model_catalog import model_catalog
+from app.services.startup import startup_warmup
+from app.services.response_cache import response_cache
+from app.services.live_generations import live_generations
+from app.services.chat_events import chat_events
+from app.services.message_writer import worker_heartbeat
+from app.services.metrics import MetricsMiddleware
 
 app = FastAPI(title="LLM Chat UI")
+# Длительность запросов и число SQL-запросов для /metrics
+app.add_middleware(MetricsMiddleware)
 
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 templates = Jinja2Templates(directory="app/templates")
 
 app.include_router(chat_routes.router)
 app.include_router(model_routes.router)
+app.include_router(health_routes.router)
+app.include_router(metrics_routes.router)
+
+
+async def warm_up():
+    # Добавление начальных данных
+    async with async_session() as session:
+        await seed_default_prompts(session)
+    # Первая синхронизация каталога моделей, дальше он обновляется в фоне
+    await model_catalog.refresh()
+    model_catalog.start(immediate=False)
 
 
 @app.on_event("startup")
 async def startup_event():
     # Инициализация базы данных
     await init_db()
-    # Добавление начальных данных
-    async with async_session() as session:
-        await seed_default_prompts(session)
+    # Процесс отмечается живым; ответы упавших процессов помечаются прерванными
+    await worker_heartbeat.start()
+    # Межпроцессная доставка событий чатов (LISTEN/NOTIFY для postgres)
+    await chat_events.start()
+    # Открываем общий пул соединений к Ollama
+    await ollama_service.start()
+    # Шаблоны и каталог моделей подготавливаются без задержки открытия порта
+    await startup_warmup.launch(warm_up())
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await startup_warmup.stop()
+    await model_catalog.stop()
+    # Прерываем идущие генерации, частичные ответы сохраняются
+    await live_generations.stop()
+    await worker_heartbeat.stop()
+    await chat_events.stop()
+    # Закрываем пул соединений к Ollama
+    await ollama_service.close()
+    await response_cache.close()
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -36,4 +80,4 @@ async def index(request: Request, db: AsyncSession = Depends(get_db)):
     )
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True) 
\ No newline at end of file
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True, log_config=None) 
\ No newline at end of file
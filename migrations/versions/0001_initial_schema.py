@@ -0,0 +1,105 @@
+"""Начальная схема с индексами истории сообщений
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'models',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=100), nullable=True),
+        sa.Column('display_name', sa.String(length=100), nullable=True),
+        sa.Column('description', sa.String(length=255), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_models_id', 'models', ['id'], unique=False)
+    op.create_index('ix_models_name', 'models', ['name'], unique=True)
+
+    op.create_table(
+        'prompt_templates',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=100), nullable=True),
+        sa.Column('system_prompt', sa.Text(), nullable=True),
+        sa.Column('description', sa.String(length=255), nullable=True),
+        sa.Column('user_prompt', sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_prompt_templates_id', 'prompt_templates', ['id'], unique=False)
+    op.create_index('ix_prompt_templates_name', 'prompt_templates', ['name'], unique=False)
+
+    op.create_table(
+        'chats',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('title', sa.String(length=255), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('model_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['model_id'], ['models.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_chats_id', 'chats', ['id'], unique=False)
+    op.create_index('ix_chats_title', 'chats', ['title'], unique=False)
+    op.create_index('ix_chats_created_at', 'chats', ['created_at'], unique=False)
+
+    op.create_table(
+        'model_settings',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('model_id', sa.Integer(), nullable=True),
+        sa.Column('temperature', sa.String(length=10), nullable=True),
+        sa.Column('top_p', sa.String(length=10), nullable=True),
+        sa.Column('top_k', sa.String(length=10), nullable=True),
+        sa.Column('max_tokens', sa.String(length=10), nullable=True),
+        sa.Column('context_tokens', sa.Integer(), nullable=True),
+        sa.Column('system_prompt', sa.Text(), nullable=True),
+        sa.ForeignKeyConstraint(['model_id'], ['models.id']),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('model_id'),
+    )
+    op.create_index('ix_model_settings_id', 'model_settings', ['id'], unique=False)
+
+    op.create_table(
+        'messages',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('chat_id', sa.Integer(), nullable=True),
+        sa.Column('role', sa.String(length=50), nullable=True),
+        sa.Column('content', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['chat_id'], ['chats.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_messages_id', 'messages', ['id'], unique=False)
+    op.create_index('ix_messages_chat_id_created_at', 'messages', ['chat_id', 'created_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_messages_chat_id_created_at', table_name='messages')
+    op.drop_index('ix_messages_id', table_name='messages')
+    op.drop_table('messages')
+    op.drop_index('ix_model_settings_id', table_name='model_settings')
+    op.drop_table('model_settings')
+    op.drop_index('ix_chats_created_at', table_name='chats')
+    op.drop_index('ix_chats_title', table_name='chats')
+    op.drop_index('ix_chats_id', table_name='chats')
+    op.drop_table('chats')
+    op.drop_index('ix_prompt_templates_name', table_name='prompt_templates')
+    op.drop_index('ix_prompt_templates_id', table_name='prompt_templates')
+    op.drop_table('prompt_templates')
+    op.drop_index('ix_models_name', table_name='models')
+    op.drop_index('ix_models_id', table_name='models')
+    op.drop_table('models')
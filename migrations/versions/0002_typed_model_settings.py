@@ -0,0 +1,69 @@
+"""Числовые типы параметров генерации в model_settings
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+_NUMERIC_COLUMNS = (
+    ('temperature', sa.Float(), 'double precision'),
+    ('top_p', sa.Float(), 'double precision'),
+    ('top_k', sa.Integer(), 'integer'),
+    ('max_tokens', sa.Integer(), 'integer'),
+)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Пустые строки не приводятся к числу, заменяем их на NULL до смены типа
+    for name, _, _ in _NUMERIC_COLUMNS:
+        op.execute(f"UPDATE model_settings SET {name} = NULL WHERE trim({name}) = ''")
+
+    with op.batch_alter_table('model_settings') as batch_op:
+        for name, type_, pg_type in _NUMERIC_COLUMNS:
+            batch_op.alter_column(
+                name,
+                existing_type=sa.String(length=10),
+                type_=type_,
+                existing_nullable=True,
+                postgresql_using=f"{name}::{pg_type}",
+            )
+        batch_op.add_column(sa.Column('repeat_penalty', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('keep_alive', sa.String(length=20), nullable=True))
+
+    # SQLite копирует данные при пересоздании таблицы без приведения типов;
+    # PostgreSQL уже привел их через USING
+    if op.get_context().dialect.name == "sqlite":
+        for name, type_, _ in _NUMERIC_COLUMNS:
+            sql_type = 'REAL' if isinstance(type_, sa.Float) else 'INTEGER'
+            op.execute(f"UPDATE model_settings SET {name} = CAST({name} AS {sql_type}) WHERE {name} IS NOT NULL")
+    op.execute("UPDATE model_settings SET repeat_penalty = 1.1 WHERE repeat_penalty IS NULL")
+    op.execute("UPDATE model_settings SET keep_alive = '5m' WHERE keep_alive IS NULL")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('model_settings') as batch_op:
+        batch_op.drop_column('keep_alive')
+        batch_op.drop_column('repeat_penalty')
+        for name, type_, _ in _NUMERIC_COLUMNS:
+            batch_op.alter_column(
+                name,
+                existing_type=type_,
+                type_=sa.String(length=10),
+                existing_nullable=True,
+                postgresql_using=f"{name}::varchar(10)",
+            )
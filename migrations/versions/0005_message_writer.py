@@ -0,0 +1,37 @@
+"""Процесс, который пишет ответ модели, и таблица живых процессов
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 21:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0005'
+down_revision: Union[str, None] = '0004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'workers',
+        sa.Column('id', sa.String(length=32), nullable=False),
+        sa.Column('heartbeat_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    with op.batch_alter_table('messages') as batch_op:
+        batch_op.add_column(sa.Column('writer_id', sa.String(length=32), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('messages') as batch_op:
+        batch_op.drop_column('writer_id')
+    op.drop_table('workers')
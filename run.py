@@ -28,4 +28,4 @@ if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8000))
     
     # Запускаем сервер
-    uvicorn.run("main:app", host=host, port=port, reload=os.environ.get("DEBUG", "False").lower() == "true") 
\ No newline at end of file
+    uvicorn.run("main:app", host=host, port=port, reload=os.environ.get("DEBUG", "False").lower() == "true", log_config=None) 
\ No newline at end of file
@@ -29,6 +29,8 @@ async def test_ollama_connection():
             print("\nНе удалось получить список моделей или список пуст.")
     except Exception as e:
         print(f"Ошибка при тестировании: {str(e)}")
+    finally:
+        await service.close()
 
 if __name__ == "__main__":
     asyncio.run(test_ollama_connection()) 
\ No newline at end of file
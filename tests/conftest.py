@@ -10,7 +10,9 @@ from sqlalchemy.orm import sessionmaker
 # Добавляем корневую директорию проекта в sys.path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from app.database.db import Base, get_db
+from app.database.db import Base, get_db, get_session_factory
+from app.services.catalog_cache import catalog_cache
+from app.services.metrics import instrument_engine
 from main import app
 
 # Используем SQLite в памяти для тестов
@@ -22,6 +24,8 @@ engine = create_async_engine(
     echo=False,
     future=True
 )
+# SQL-запросы тестовой базы учитываются в /metrics так же, как в приложении
+instrument_engine(engine.sync_engine)
 
 # Создаем сессии для тестов
 async_session_test = sessionmaker(
@@ -39,6 +43,7 @@ async def override_get_db():
 
 # Переопределяем зависимость в приложении для тестов
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_session_factory] = lambda: async_session_test
 
 @pytest.fixture(scope="session")
 def event_loop():
@@ -64,6 +69,8 @@ async def setup_test_db():
 @pytest.fixture
 async def db_session(setup_test_db) -> AsyncGenerator[AsyncSession, None]:
     """Дает сессию базы данных для каждого теста."""
+    # Кэш каталога общий на процесс, сбрасываем его между тестами
+    catalog_cache.clear()
     async with async_session_test() as session:
         yield session
         # Сбрасываем изменения после каждого теста
@@ -0,0 +1,36 @@
+import pytest
+from benchmarks.fake_ollama import FakeOllamaConfig, start_fake_ollama
+from benchmarks.run import check_thresholds, percentile
+from app.services.ollama_service import OllamaService
+
+
+def test_percentile_and_thresholds():
+    """Тест расчета перцентилей и проверки порогов нагрузочных сценариев"""
+    values = [i / 1000 for i in range(1, 101)]
+    assert percentile(values, 50) == 0.05
+    assert percentile(values, 95) == 0.095
+    assert percentile(values, 99) == 0.099
+    assert percentile([], 95) == 0.0
+
+    results = [
+        {"scenario": "chat_list", "p95_ms": 20, "p99_ms": 30, "rps": 400, "errors": 0},
+        {"scenario": "rest_message", "p95_ms": 2500, "p99_ms": 3000, "rps": 5, "errors": 1},
+    ]
+    thresholds = {"chat_list": {"max_p95_ms": 500}, "rest_message": {"max_p95_ms": 2000, "min_rps": 10}}
+    failures = check_thresholds(results, thresholds)
+    assert len(failures) == 3
+    assert all(failure.startswith("rest_message") for failure in failures)
+
+
+@pytest.mark.asyncio
+async def test_fake_ollama_streams_tokens_with_eval_stats():
+    """Тест заглушки Ollama: токены и итоговая строка понятны OllamaService"""
+    runner, url = await start_fake_ollama(FakeOllamaConfig(models=["bench:latest"], tokens=5, token_rate=0, latency=0))
+    service = OllamaService(base_url=url)
+    try:
+        assert [m["name"] for m in await service.list_models()] == ["bench:latest"]
+        chunks = [chunk async for chunk in service.chat_stream("bench:latest", [{"role": "user", "content": "?"}])]
+        assert chunks == [f"tok{i} " for i in range(5)]
+    finally:
+        await service.close()
+        await runner.cleanup()
@@ -0,0 +1,66 @@
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models.models import ChatModel, ModelSettings
+from app.services.catalog_cache import TTLCache, CatalogCache
+
+
+def test_ttl_cache_eviction_and_expiry():
+    """Тест вытеснения по размеру и устаревания по TTL"""
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    # "b" давно не использовался и вытесняется первым
+    cache.set("c", 3)
+    assert cache.get("b", None) is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    
+    expired = TTLCache(maxsize=2, ttl=-1)
+    expired.set("a", 1)
+    assert expired.get("a", None) is None
+    assert expired.stats()["size"] == 0
+
+
+@pytest.mark.asyncio
+async def test_catalog_cache_read_through(db_session: AsyncSession):
+    """Тест чтения моделей и настроек через кэш с инвалидацией"""
+    model = ChatModel(name="test-model-cache", display_name="Test Model Cache")
+    db_session.add(model)
+    await db_session.commit()
+    db_session.add(ModelSettings(model_id=model.id, system_prompt="Первый промпт"))
+    await db_session.commit()
+    
+    cache = CatalogCache(maxsize=16, ttl=60)
+    by_id = await cache.get_model(db_session, model_id=model.id)
+    by_name = await cache.get_model(db_session, name="test-model-cache")
+    assert by_id == by_name
+    assert cache.stats()["misses"] == 1
+    
+    settings = await cache.get_settings(db_session, model.id)
+    assert settings.system_prompt == "Первый промпт"
+    
+    # Изменение в БД не видно до инвалидации
+    db_settings = await ModelSettings.get_by_model_id(db_session, model.id)
+    db_settings.system_prompt = "Второй промпт"
+    await db_session.commit()
+    assert (await cache.get_settings(db_session, model.id)).system_prompt == "Первый промпт"
+    
+    cache.invalidate_model(model.id)
+    assert (await cache.get_settings(db_session, model.id)).system_prompt == "Второй промпт"
+
+
+@pytest.mark.asyncio
+async def test_missing_settings_read_without_write(db_session: AsyncSession):
+    """Тест: для модели без настроек чтение отдает значения по умолчанию и ничего не пишет"""
+    model = ChatModel(name="test-model-no-settings", display_name="Test Model No Settings")
+    db_session.add(model)
+    await db_session.commit()
+    
+    cache = CatalogCache(maxsize=16, ttl=60)
+    settings = await cache.get_settings(db_session, model.id)
+    assert settings.id is None
+    assert settings.temperature == 0.7
+    # Чтение не добавляет строку в сессию
+    assert not db_session.new
+    assert await ModelSettings.get_by_model_id(db_session, model.id) is None
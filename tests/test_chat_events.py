@@ -0,0 +1,81 @@
+import json
+import pytest
+from app.services.chat_events import ChatEventHub, PostgresNotifyBackend
+
+
+def _chunk(offset, text, generation_id="g1"):
+    return {"type": "chunk", "generation_id": generation_id, "message_id": 1, "offset": offset, "chunk": text}
+
+
+@pytest.mark.asyncio
+async def test_hub_fans_out_to_chat_subscribers():
+    """Тест: событие получают все подписчики своего чата и только они"""
+    hub = ChatEventHub()
+    first, second = hub.subscribe(1), hub.subscribe(1)
+    other = hub.subscribe(2)
+
+    hub.publish(1, _chunk(0, "Привет"))
+    assert await first.get() == _chunk(0, "Привет")
+    assert await second.get() == _chunk(0, "Привет")
+    assert other._queue.empty()
+
+    second.close()
+    other.close()
+    assert hub.stats() == {"backend": "local", "chats": 1, "subscribers": 1}
+
+
+@pytest.mark.asyncio
+async def test_slow_subscriber_gets_lagged_marker():
+    """Тест: переполненная очередь подписчика заменяется событием lagged"""
+    hub = ChatEventHub(queue_size=2)
+    subscription = hub.subscribe(1)
+    for offset in range(3):
+        hub.publish(1, _chunk(offset, "x"))
+
+    assert await subscription.get() == {"type": "lagged"}
+    assert subscription.lagged == 1
+    assert subscription._queue.empty()
+
+
+@pytest.mark.asyncio
+async def test_postgres_backend_batches_and_filters_own_notifications():
+    """Тест NOTIFY-доставки: склейка фрагментов, деление по пределу, отбрасывание своих уведомлений"""
+    backend = PostgresNotifyBackend("postgresql+asyncpg://user:secret@db/llm_chat")
+    assert backend.dsn == "postgresql://user:secret@db/llm_chat"
+    hub = ChatEventHub(backend)
+    subscription = hub.subscribe(1)
+
+    hub.publish(1, _chunk(3, "вет"))
+    hub.publish(1, {"type": "done", "generation_id": "g1", "message_id": 1, "truncated": False})
+    # Подписчики своего процесса получают события сразу
+    assert (await subscription.get())["chunk"] == "вет"
+
+    backend._outbox.get_nowait()
+    backend._outbox.get_nowait()
+    backend.publish(1, _chunk(3, "вет"))
+    backend.publish(1, _chunk(6, "!"))
+    backend.publish(1, _chunk(0, "другой", generation_id="g2"))
+    batch = backend._batch(backend._outbox.get_nowait())
+    assert [event["chunk"] for _, event in batch] == ["вет!", "другой"]
+
+    # Длинный фрагмент делится на несколько уведомлений с правильными offset
+    payloads = backend._payloads(1, _chunk(10, "я" * 5000))
+    events = [json.loads(p)["event"] for p in payloads]
+    assert len(events) > 1 and all(len(p.encode()) <= 7500 for p in payloads)
+    assert "".join(e["chunk"] for e in events) == "я" * 5000
+    assert [e["offset"] for e in events] == [10 + sum(len(e["chunk"]) for e in events[:i]) for i in range(len(events))]
+
+    # Длинное сообщение пользователя уходит без текста - подписчик перечитает его из БД
+    question = {"type": "user_message", "generation_id": "g3", "message_id": 5, "content": "?" * 8000}
+    [payload] = backend._payloads(1, question)
+    assert json.loads(payload)["event"] == {"type": "user_message", "generation_id": "g3", "message_id": 5}
+
+    # Уведомление другого процесса доставляется, свое - отбрасывается
+    while not subscription._queue.empty():
+        subscription._queue.get_nowait()
+    remote = json.dumps({"origin": "other", "chat_id": 1, "event": _chunk(0, "удаленный")})
+    backend._on_notify(None, 0, "chat_events", remote)
+    backend._on_notify(None, 0, "chat_events", payloads[0])
+    assert await subscription.get() == _chunk(0, "удаленный")
+    assert subscription._queue.empty()
+    assert backend.received == 1
@@ -0,0 +1,46 @@
+from types import SimpleNamespace
+from app.services.context_builder import ChatContextBuilder, estimate_tokens
+
+
+def make_history(count, size=40):
+    """Создает историю из чередующихся сообщений пользователя и ассистента"""
+    return [
+        SimpleNamespace(role="user" if i % 2 == 0 else "assistant", content=f"{i:03d}" + "x" * size)
+        for i in range(count)
+    ]
+
+
+def test_build_includes_system_prompt_and_short_history():
+    """Короткая история целиком попадает в контекст после системного промпта"""
+    builder = ChatContextBuilder(context_tokens=4096, reserve_tokens=1024)
+    history = make_history(3)
+
+    messages = builder.build("Системный промпт", history)
+
+    assert messages[0] == {"role": "system", "content": "Системный промпт"}
+    assert [m["content"] for m in messages[1:]] == [m.content for m in history]
+
+
+def test_build_respects_token_budget():
+    """В контекст попадают только новые сообщения, укладывающиеся в бюджет"""
+    builder = ChatContextBuilder(context_tokens=200, reserve_tokens=50, block_size=1)
+    history = make_history(40)
+
+    messages = builder.build(None, history)
+
+    assert sum(estimate_tokens(m["content"]) for m in messages) <= 150
+    assert messages[-1]["content"] == history[-1].content
+    # Окно начинается с сообщения пользователя
+    assert messages[0]["role"] == "user"
+
+
+def test_prefix_stable_between_turns():
+    """Начало окна сдвигается блоками, а не на каждом ходе"""
+    builder = ChatContextBuilder(context_tokens=300, reserve_tokens=0, block_size=8)
+    budget = builder.history_budget(None)
+
+    starts = [builder.window_start(make_history(count), budget) for count in range(20, 40)]
+
+    # Старт меняется заметно реже, чем число ходов
+    assert len(set(starts)) < len(starts) // 2
+    assert starts == sorted(starts)
@@ -0,0 +1,54 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+from app.database.db import engine_options, make_engine, _run_migrations
+from app.models.models import Chat
+
+
+def test_engine_options_postgres_pool_and_statement_cache():
+    """Тест параметров пула и кэша выражений для asyncpg"""
+    options = engine_options("postgresql+asyncpg://user:secret@db:5432/llm_chat")
+    assert options["pool_size"] == 10
+    assert options["max_overflow"] == 20
+    assert options["pool_pre_ping"] is True
+    assert options["connect_args"] == {"prepared_statement_cache_size": 500, "statement_cache_size": 500}
+
+
+def test_engine_options_sqlite_without_pool_settings():
+    """Тест: для SQLite параметры пула PostgreSQL не передаются"""
+    options = engine_options("sqlite+aiosqlite:///./sqlite_app.db")
+    assert options == {"echo": False, "future": True}
+
+
+@pytest.mark.asyncio
+async def test_sqlite_engine_pragmas(tmp_path):
+    """Тест PRAGMA нового соединения SQLite: WAL, synchronous, busy_timeout, mmap"""
+    engine = make_engine(f"sqlite+aiosqlite:///{tmp_path / 'pragmas.db'}")
+    try:
+        async with engine.connect() as conn:
+            assert (await conn.execute(text("PRAGMA journal_mode"))).scalar() == "wal"
+            # NORMAL = 1
+            assert (await conn.execute(text("PRAGMA synchronous"))).scalar() == 1
+            assert (await conn.execute(text("PRAGMA busy_timeout"))).scalar() == 5000
+            assert (await conn.execute(text("PRAGMA mmap_size"))).scalar() == 256 * 1024 * 1024
+    finally:
+        await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_sqlite_wal_reader_during_write(tmp_path):
+    """Тест: в режиме WAL чтение не ждет открытую транзакцию записи"""
+    engine = make_engine(f"sqlite+aiosqlite:///{tmp_path / 'wal.db'}")
+    session_factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    try:
+        async with engine.begin() as conn:
+            await conn.run_sync(_run_migrations)
+
+        async with session_factory() as writer, session_factory() as reader:
+            await Chat.create(writer, "Незафиксированный чат")
+            # Писатель держит транзакцию, читатель видит последнее зафиксированное состояние
+            assert await Chat.get_all(reader) == []
+            await writer.commit()
+    finally:
+        await engine.dispose()
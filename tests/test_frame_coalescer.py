@@ -0,0 +1,93 @@
+import asyncio
+import pytest
+from app.services.frame_coalescer import FlushPolicy, FrameCoalescer
+
+
+class Collector:
+    def __init__(self):
+        self.frames = []
+    
+    async def __call__(self, text):
+        self.frames.append(text)
+
+
+@pytest.mark.asyncio
+async def test_flush_by_size_and_close():
+    """Буфер уходит кадром при достижении порога, остаток - при закрытии"""
+    sent = Collector()
+    coalescer = FrameCoalescer(sent, FlushPolicy(interval_ms=1000, max_bytes=4))
+    for token in ["ab", "cd", "e"]:
+        await coalescer.push(token)
+    assert sent.frames == ["abcd"]
+    
+    await coalescer.close()
+    assert sent.frames == ["abcd", "e"]
+    assert coalescer.chunks_received == 3
+
+
+@pytest.mark.asyncio
+async def test_flush_by_interval_without_new_tokens():
+    """Таймер отправляет буфер, даже если новые токены не приходят"""
+    sent = Collector()
+    coalescer = FrameCoalescer(sent, FlushPolicy(interval_ms=10, max_bytes=1024))
+    await coalescer.push("медленно")
+    assert sent.frames == []
+    
+    await asyncio.sleep(0.05)
+    assert sent.frames == ["медленно"]
+    await coalescer.close()
+    assert sent.frames == ["медленно"]
+
+
+@pytest.mark.asyncio
+async def test_slow_client_does_not_block_reader():
+    """Медленный клиент не задерживает чтение: отставшие токены склеиваются в кадр"""
+    frames = []
+    
+    async def slow_send(text):
+        await asyncio.sleep(0.05)
+        frames.append(text)
+    
+    coalescer = FrameCoalescer(slow_send, FlushPolicy(interval_ms=0, max_bytes=0))
+    started = asyncio.get_running_loop().time()
+    for i in range(20):
+        await coalescer.push(str(i % 10))
+    # Все токены приняты раньше, чем клиент получил хотя бы пару кадров
+    assert asyncio.get_running_loop().time() - started < 0.05
+    
+    await coalescer.close()
+    assert "".join(frames) == "01234567890123456789"
+    assert len(frames) < 20
+
+
+@pytest.mark.asyncio
+async def test_push_waits_when_send_buffer_is_full():
+    """При заполненном буфере отправки push ждет, пока клиент примет данные"""
+    sent = Collector()
+    release = asyncio.Event()
+    
+    async def blocked_send(text):
+        await release.wait()
+        await sent(text)
+    
+    coalescer = FrameCoalescer(blocked_send, FlushPolicy(interval_ms=0, max_bytes=0), max_buffer_bytes=4)
+    await coalescer.push("ab")
+    # Первый кадр завис в отправке, следующие токены копятся до предела
+    await coalescer.push("cd")
+    await coalescer.push("ef")
+    blocked = asyncio.create_task(coalescer.push("gh"))
+    await asyncio.sleep(0.01)
+    assert not blocked.done()
+    
+    release.set()
+    await asyncio.wait_for(blocked, 1)
+    await coalescer.close()
+    assert "".join(sent.frames) == "abcdefgh"
+
+
+def test_policy_from_handshake():
+    """Политика выбирается пресетом или явными параметрами рукопожатия"""
+    assert FlushPolicy.from_handshake({"flush": "token"}).immediate
+    assert FlushPolicy.from_handshake({"flush": "throughput"}) == FlushPolicy(200, 8192)
+    assert FlushPolicy.from_handshake({"flush_ms": "20", "flush_bytes": "256"}) == FlushPolicy(20, 256)
+    assert FlushPolicy.from_handshake({"flush_ms": "x"}) == FlushPolicy()
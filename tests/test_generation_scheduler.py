@@ -0,0 +1,106 @@
+import asyncio
+import pytest
+from app.services.generation_scheduler import GenerationScheduler, QueueFullError, parse_limits
+
+
+async def run_turn(scheduler, key, order, release, positions=None):
+    async def on_position(position):
+        if positions is not None:
+            positions.setdefault(key, []).append(position)
+    
+    async with scheduler.slot("model", key, on_position=on_position):
+        order.append(key)
+        await release.wait()
+
+
+@pytest.mark.asyncio
+async def test_limit_fifo_and_positions():
+    """Не больше limit генераций одновременно, остальные ждут в порядке FIFO"""
+    scheduler = GenerationScheduler(concurrency=1, limits={}, queue_size=2, policy="fifo")
+    releases = {key: asyncio.Event() for key in ("a", "b", "c")}
+    order, positions = [], {}
+    
+    tasks = [asyncio.create_task(run_turn(scheduler, key, order, releases[key], positions)) for key in releases]
+    await asyncio.sleep(0.01)
+    assert order == ["a"]
+    assert positions == {"b": [1], "c": [2]}
+    
+    # Очередь заполнена - новый запрос отклоняется сразу
+    with pytest.raises(QueueFullError):
+        async with scheduler.slot("model", "d"):
+            pass
+    assert scheduler.stats()["rejected_total"] == 1
+    
+    # Первый запрос завершился - очередь сдвигается
+    releases["a"].set()
+    await asyncio.sleep(0.01)
+    assert order == ["a", "b"]
+    assert positions["c"] == [2, 1]
+    
+    releases["b"].set()
+    releases["c"].set()
+    await asyncio.gather(*tasks)
+    assert order == ["a", "b", "c"]
+    assert scheduler.stats()["models"]["model"] == {"limit": 1, "active": 0, "waiting": 0}
+
+
+@pytest.mark.asyncio
+async def test_round_robin_between_chats():
+    """В режиме round_robin чаты получают слот по очереди"""
+    scheduler = GenerationScheduler(concurrency=1, limits={}, queue_size=10, policy="round_robin")
+    gate = asyncio.Event()
+    order = []
+    
+    first = asyncio.create_task(run_turn(scheduler, "x", order, gate))
+    await asyncio.sleep(0)
+    # Чат x поставил три запроса подряд, чат y - один
+    tasks = [asyncio.create_task(run_turn(scheduler, key, order, gate)) for key in ("x", "x", "x", "y")]
+    await asyncio.sleep(0.01)
+    gate.set()
+    await asyncio.gather(first, *tasks)
+    assert order == ["x", "x", "y", "x", "x"]
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_leaves_queue():
+    """Отмененный запрос покидает очередь и не занимает слот"""
+    scheduler = GenerationScheduler(concurrency=1, limits={}, queue_size=5)
+    release = asyncio.Event()
+    order = []
+    
+    holder = asyncio.create_task(run_turn(scheduler, "a", order, release))
+    waiter = asyncio.create_task(run_turn(scheduler, "b", order, release))
+    await asyncio.sleep(0.01)
+    waiter.cancel()
+    await asyncio.sleep(0.01)
+    assert scheduler.stats()["models"]["model"]["waiting"] == 0
+    
+    release.set()
+    await holder
+    assert order == ["a"]
+    assert scheduler.stats()["models"]["model"]["active"] == 0
+
+
+def test_parse_limits():
+    """Лимиты моделей задаются строкой из окружения"""
+    assert parse_limits("llama3:8b=4, mistral=1,bad=x") == {"llama3:8b": 4, "mistral": 1}
+
+
+@pytest.mark.asyncio
+async def test_reservation_admits_before_waiting():
+    """Бронь сразу занимает слот или место в очереди; отмененная бронь их освобождает"""
+    scheduler = GenerationScheduler(concurrency=1, limits={}, queue_size=1)
+    first = scheduler.reserve("model")
+    queued = scheduler.reserve("model")
+    assert scheduler.stats()["models"]["model"] == {"limit": 1, "active": 1, "waiting": 1}
+    with pytest.raises(QueueFullError):
+        scheduler.reserve("model")
+    
+    # Первый запрос не дошел до генерации - слот переходит к очереди
+    first.cancel()
+    first.cancel()
+    assert scheduler.stats()["models"]["model"] == {"limit": 1, "active": 1, "waiting": 0}
+    async with scheduler.slot("model", reservation=queued):
+        pass
+    queued.cancel()
+    assert scheduler.stats()["models"]["model"] == {"limit": 1, "active": 0, "waiting": 0}
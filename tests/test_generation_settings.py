@@ -0,0 +1,37 @@
+import dataclasses
+from types import SimpleNamespace
+
+import pytest
+from app.services.generation_settings import GenerationSettings
+
+
+def test_from_model_settings_fills_defaults_and_builds_options():
+    """Пустые поля получают значения по умолчанию, все параметры попадают в options"""
+    row = SimpleNamespace(
+        id=1, model_id=2, temperature=0.2, top_p=None, top_k=20, max_tokens=512,
+        context_tokens=8192, repeat_penalty=None, keep_alive="10m", system_prompt="Промпт"
+    )
+
+    settings = GenerationSettings.from_model_settings(row)
+
+    assert settings.top_p == 0.9
+    assert settings.to_options() == {
+        "temperature": 0.2,
+        "top_p": 0.9,
+        "top_k": 20,
+        "num_predict": 512,
+        "num_ctx": 8192,
+        "repeat_penalty": 1.1,
+    }
+    assert settings.keep_alive == "10m"
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        settings.temperature = 1.0
+
+
+def test_invalid_values_rejected():
+    """Значения вне допустимых диапазонов отклоняются при создании"""
+    settings = GenerationSettings(model_id=1)
+    with pytest.raises(ValueError):
+        dataclasses.replace(settings, temperature=5)
+    with pytest.raises(ValueError):
+        dataclasses.replace(settings, top_k=0)
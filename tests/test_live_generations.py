@@ -0,0 +1,74 @@
+import asyncio
+import pytest
+from app.services.live_generations import GenerationRegistry, LiveGeneration
+
+
+async def _collect(live: LiveGeneration, offset: int = 0):
+    return [part async for part in live.follow(offset)]
+
+
+@pytest.mark.asyncio
+async def test_follow_replays_from_offset_then_streams_live():
+    """Подписчик получает пропущенный текст с позиции offset, затем новые фрагменты"""
+    live = LiveGeneration(chat_id=1, model="m")
+    live.append("Привет, ")
+    live.append("мир")
+
+    follower = asyncio.create_task(_collect(live, offset=6))
+    await asyncio.sleep(0)
+    live.append("!")
+    live.finish()
+
+    assert await follower == [", ", "мир", "!"]
+    assert await _collect(live) == ["Привет, ", "мир", "!"]
+    # Позиция за концом ответа - только финал
+    assert await _collect(live, offset=100) == []
+
+
+@pytest.mark.asyncio
+async def test_registry_runs_generation_without_subscribers():
+    """Генерация идет до конца без подписчиков и доступна по id до истечения TTL"""
+    registry = GenerationRegistry(ttl=60)
+    release = asyncio.Event()
+
+    async def run(live):
+        live.append("раз ")
+        await release.wait()
+        live.append("два")
+
+    live = registry.start(LiveGeneration(chat_id=1, model="m"), run)
+    await asyncio.sleep(0)
+    assert registry.stats() == {"running": 1, "finished": 0}
+
+    release.set()
+    await live.wait()
+    assert live.done and not live.truncated
+    assert registry.get(live.id).text == "раз два"
+
+    registry.ttl = 0
+    assert registry.get(live.id) is None
+
+
+@pytest.mark.asyncio
+async def test_cancel_marks_truncated_and_error_reaches_followers():
+    """Отмена помечает ответ прерванным, ошибка генерации доходит до подписчика"""
+    registry = GenerationRegistry()
+
+    async def stalled(live):
+        live.append("начало")
+        await asyncio.sleep(3600)
+
+    live = registry.start(LiveGeneration(chat_id=1, model="m"), stalled)
+    await asyncio.sleep(0)
+    live.cancel()
+    await live.wait()
+    assert live.truncated and live.text == "начало"
+
+    async def failing(live):
+        live.append("частично")
+        raise RuntimeError("сбой")
+
+    failed = registry.start(LiveGeneration(chat_id=1, model="m"), failing)
+    await failed.wait()
+    with pytest.raises(RuntimeError):
+        await _collect(failed)
@@ -0,0 +1,37 @@
+import json
+import logging
+from queue import SimpleQueue
+from app.logging_config import JsonFormatter, _LazyQueueHandler, parse_levels
+
+
+def test_queue_record_formatted_as_json():
+    """Запись уходит в очередь без форматирования и сериализуется в JSON с полями extra"""
+    queue = SimpleQueue()
+    logger = logging.getLogger("tests.logging_config")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    handler = _LazyQueueHandler(queue)
+    logger.addHandler(handler)
+    try:
+        logger.debug("Отфильтровано %s", "уровнем")
+        logger.info("Чат %s: %d токенов", 7, 42, extra={"chat_id": 7})
+    finally:
+        logger.removeHandler(handler)
+    
+    record = queue.get_nowait()
+    assert queue.empty()
+    assert record.args is None
+    
+    data = json.loads(JsonFormatter().format(record))
+    assert data["message"] == "Чат 7: 42 токенов"
+    assert data["level"] == "INFO"
+    assert data["logger"] == "tests.logging_config"
+    assert data["chat_id"] == 7
+
+
+def test_parse_levels():
+    """Уровни модулей задаются строкой из окружения"""
+    assert parse_levels("app.routes=DEBUG, sqlalchemy.engine=info,,bad") == {
+        "app.routes": "DEBUG",
+        "sqlalchemy.engine": "INFO",
+    }
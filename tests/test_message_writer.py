@@ -0,0 +1,161 @@
+import asyncio
+import datetime
+import contextlib
+import pytest
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from app.database.db import Base
+from app.models.models import Chat, Message, Worker
+from app.services.message_writer import MessageWriter, WorkerHeartbeat
+
+
+@pytest.fixture
+async def session_factory(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'writer.db'}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    yield sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    await engine.dispose()
+
+
+async def _create_chat(session_factory) -> int:
+    async with session_factory() as db:
+        chat = await Chat.create(db, "Запись по частям")
+        await db.commit()
+        return chat.id
+
+
+async def _messages(session_factory, chat_id):
+    async with session_factory() as db:
+        return [(m.role, m.content, m.status, m.truncated) for m in await Message.get_by_chat_id(db, chat_id)]
+
+
+@pytest.mark.asyncio
+async def test_writer_flushes_partial_answer(session_factory):
+    """Тест: частичный ответ виден в БД со статусом streaming, в конце - complete"""
+    chat_id = await _create_chat(session_factory)
+    writer = MessageWriter(session_factory, chat_id, flush_tokens=2, flush_interval_ms=60000)
+
+    await writer.start(Message.new(chat_id, "user", "Вопрос"))
+    assert await _messages(session_factory, chat_id) == [
+        ("user", "Вопрос", "complete", False), ("assistant", "", "streaming", False)
+    ]
+
+    await writer.push("раз ")
+    await writer.push("два ")
+    await writer.drain()
+    await writer.push("три")
+    # Записаны первые два фрагмента, третий ждет следующей записи
+    assert writer.flushes == 1
+    assert (await _messages(session_factory, chat_id))[1] == ("assistant", "раз два ", "streaming", False)
+
+    message = await writer.finish()
+    assert message.content == "раз два три"
+    assert (await _messages(session_factory, chat_id))[1] == ("assistant", "раз два три", "complete", False)
+
+
+@pytest.mark.asyncio
+async def test_writer_flushes_by_interval(session_factory):
+    """Тест: при нулевом интервале каждый фрагмент записывается сразу"""
+    chat_id = await _create_chat(session_factory)
+    writer = MessageWriter(session_factory, chat_id, flush_tokens=100, flush_interval_ms=0)
+
+    await writer.start()
+    await writer.push("a")
+    await writer.drain()
+    await writer.push("b")
+    await writer.drain()
+    assert writer.flushes == 2
+    assert await _messages(session_factory, chat_id) == [("assistant", "ab", "streaming", False)]
+
+
+@pytest.mark.asyncio
+async def test_writer_truncated_answer(session_factory):
+    """Тест: прерванный ответ помечается truncated, пустой прерванный ответ удаляется"""
+    chat_id = await _create_chat(session_factory)
+
+    empty = MessageWriter(session_factory, chat_id)
+    await empty.start(Message.new(chat_id, "user", "Вопрос"))
+    assert await empty.finish(truncated=True) is None
+    assert await _messages(session_factory, chat_id) == [("user", "Вопрос", "complete", False)]
+
+    partial = MessageWriter(session_factory, chat_id)
+    await partial.start()
+    await partial.push("начало")
+    await partial.finish(truncated=True)
+    assert (await _messages(session_factory, chat_id))[-1] == ("assistant", "начало", "complete", True)
+
+
+class GatedSessionFactory:
+    """Фабрика сессий, задерживающая открытие сессии, пока закрыт gate"""
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.gate = asyncio.Event()
+        self.gate.set()
+
+    @contextlib.asynccontextmanager
+    async def __call__(self):
+        await self.gate.wait()
+        async with self.factory() as session:
+            yield session
+
+
+@pytest.mark.asyncio
+async def test_push_does_not_wait_for_database(session_factory):
+    """Тест: чтение ответа не ждет медленную промежуточную запись, одновременно идет одна запись"""
+    chat_id = await _create_chat(session_factory)
+    gated = GatedSessionFactory(session_factory)
+    writer = MessageWriter(gated, chat_id, flush_tokens=1, flush_interval_ms=60000)
+    await writer.start()
+
+    gated.gate.clear()
+    for chunk in ["раз ", "два ", "три"]:
+        await asyncio.wait_for(writer.push(chunk), timeout=1)
+    await asyncio.sleep(0)
+    # Первая запись ждет БД, остальные фрагменты ее не запускают
+    assert writer.flushes == 0
+
+    gated.gate.set()
+    message = await writer.finish()
+    assert writer.flushes == 1
+    assert message.content == "раз два три"
+    assert (await _messages(session_factory, chat_id))[0] == ("assistant", "раз два три", "complete", False)
+
+
+@pytest.mark.asyncio
+async def test_worker_heartbeat_closes_only_orphaned_answers(session_factory):
+    """Тест: при запуске завершаются ответы упавшего процесса, ответы живого воркера не трогаются"""
+    chat_id = await _create_chat(session_factory)
+    crashed = WorkerHeartbeat(session_factory, worker_id="crashed", timeout=60)
+    alive = WorkerHeartbeat(session_factory, worker_id="alive", timeout=60)
+    await crashed.beat()
+    await alive.beat()
+    for heartbeat, text in ((crashed, "обрыв"), (alive, "идет")):
+        writer = MessageWriter(session_factory, chat_id, flush_tokens=1, worker_id=heartbeat.worker_id)
+        await writer.start()
+        await writer.push(text)
+        await writer.drain()
+
+    # Оба процесса отмечались недавно - перезапуск третьего ничего не закрывает
+    restarted = WorkerHeartbeat(session_factory, worker_id="restarted", interval=60, timeout=60)
+    assert await restarted.start() == 0
+    await restarted.stop()
+
+    # Упавший процесс перестал отмечаться
+    async with session_factory() as db:
+        await db.execute(update(Worker).where(Worker.id == "crashed").values(
+            heartbeat_at=datetime.datetime.utcnow() - datetime.timedelta(minutes=5)
+        ))
+        await db.commit()
+    restarted = WorkerHeartbeat(session_factory, worker_id="restarted", interval=60, timeout=60)
+    assert await restarted.start() == 1
+    await restarted.stop()
+
+    assert await _messages(session_factory, chat_id) == [
+        ("assistant", "обрыв", "complete", True), ("assistant", "идет", "streaming", False)
+    ]
+    async with session_factory() as db:
+        workers = (await db.execute(select(Worker.id))).scalars().all()
+    assert sorted(workers) == ["alive"]
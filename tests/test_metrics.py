@@ -0,0 +1,90 @@
+import copy
+import time
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.services.metrics import (
+    Histogram, MetricsRegistry, Counter, observe_generation, registry, instrument_engine, DB_QUERY_DURATION,
+    _RequestStats, _request_stats
+)
+
+
+def test_histogram_renders_cumulative_buckets():
+    """Тест выдачи гистограммы в текстовом формате Prometheus"""
+    metrics = MetricsRegistry()
+    histogram = metrics.register(Histogram("latency_seconds", "Задержка", ("route",), buckets=(0.1, 1)))
+    counter = metrics.register(Counter("calls_total", "Вызовы", ("route",)))
+    for value in (0.05, 0.5, 0.5, 5):
+        histogram.observe(value, "/a")
+    counter.inc('/b"')
+
+    lines = metrics.render().splitlines()
+    assert "# TYPE latency_seconds histogram" in lines
+    assert 'latency_seconds_bucket{route="/a",le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{route="/a",le="1"} 3' in lines
+    assert 'latency_seconds_bucket{route="/a",le="+Inf"} 4' in lines
+    assert 'latency_seconds_sum{route="/a"} 6.05' in lines
+    assert 'latency_seconds_count{route="/a"} 4' in lines
+    assert 'calls_total{route="/b\\""} 1' in lines
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint(test_client: TestClient, db_session: AsyncSession):
+    """Тест /metrics: задержка по шаблону маршрута, SQL на запрос, скорость генерации"""
+    test_client.get("/models/list")
+    # eval_duration в наносекундах: 50 токенов за 2 секунды
+    observe_generation("metrics-model", "chat_stream", 0.0, {"eval_count": 50, "eval_duration": 2_000_000_000})
+
+    response = test_client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    text = response.text
+    assert 'http_request_duration_seconds_count{method="GET",route="/models/list",status="200"}' in text
+    queries = [line for line in text.splitlines() if line.startswith('db_queries_per_request_sum{route="/models/list"}')]
+    assert float(queries[0].split()[-1]) >= 1
+    assert 'ollama_tokens_per_second_bucket{model="metrics-model",le="25.0"}' not in text
+    assert 'ollama_tokens_per_second_bucket{model="metrics-model",le="30"} 1' in text
+    assert 'ollama_generated_tokens_total{model="metrics-model"} 50' in text
+    assert "websocket_connections_active 0" in text
+    assert "generation_rejected_total" in text
+
+
+def test_failed_query_does_not_skew_timings():
+    """Тест: упавший SQL-запрос не попадает в замеры, следующий успешный замеряется от своего начала"""
+    engine = create_engine("sqlite://")
+    instrument_engine(engine)
+
+    def observed():
+        return [(sum(counts), total) for counts, total in DB_QUERY_DURATION._values.values()][0]
+
+    stats = _RequestStats()
+    token = _request_stats.set(stats)
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+            count, total = observed()
+            info = copy.deepcopy(dict(conn.info))
+            for _ in range(3):
+                with pytest.raises(OperationalError):
+                    conn.execute(text("SELECT * FROM missing_table"))
+            # Упавшие запросы не учтены ни в гистограмме, ни в счетчике запроса
+            # и не оставили состояния в соединении из пула
+            assert observed() == (count, total)
+            assert dict(conn.info) == info
+            assert stats.queries == 1
+
+            # Время от упавших запросов не должно попасть в длительность следующего
+            time.sleep(0.05)
+            started = time.perf_counter()
+            conn.execute(text("SELECT 1"))
+            elapsed = time.perf_counter() - started
+    finally:
+        _request_stats.reset(token)
+        engine.dispose()
+
+    new_count, new_total = observed()
+    assert new_count == count + 1
+    assert 0 <= new_total - total <= elapsed
+    assert stats.queries == 2
@@ -0,0 +1,42 @@
+import pytest
+from sqlalchemy import inspect, text
+from sqlalchemy.ext.asyncio import create_async_engine
+from app.database.db import _run_migrations
+
+
+@pytest.mark.asyncio
+async def test_migrations_create_indexes_and_keep_data(tmp_path):
+    """Тест миграций: индексы истории создаются, данные переживают перезапуск"""
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'migrations.db'}")
+    try:
+        async with engine.begin() as conn:
+            await conn.run_sync(_run_migrations)
+            await conn.execute(text("INSERT INTO chats (title) VALUES ('Сохраненный чат')"))
+            
+            indexes = await conn.run_sync(lambda c: inspect(c).get_indexes("messages"))
+            assert {"name": "ix_messages_chat_id_created_at", "column_names": ["chat_id", "created_at"]} in [
+                {"name": i["name"], "column_names": i["column_names"]} for i in indexes
+            ]
+            chat_indexes = await conn.run_sync(lambda c: inspect(c).get_indexes("chats"))
+            assert "ix_chats_created_at" in [i["name"] for i in chat_indexes]
+            
+            # Параметры генерации хранятся в числовых колонках
+            columns = await conn.run_sync(lambda c: inspect(c).get_columns("model_settings"))
+            types = {c["name"]: c["type"].python_type for c in columns}
+            assert types["temperature"] is float
+            assert types["top_k"] is int
+            assert "repeat_penalty" in types and "keep_alive" in types
+            
+            # Флаг прерванного ответа у сообщений
+            message_columns = await conn.run_sync(lambda c: inspect(c).get_columns("messages"))
+            assert "truncated" in [c["name"] for c in message_columns]
+            # Статус сообщения, существующие строки считаются завершенными
+            assert "status" in [c["name"] for c in message_columns]
+        
+        # Повторный запуск не пересоздает таблицы
+        async with engine.begin() as conn:
+            await conn.run_sync(_run_migrations)
+            result = await conn.execute(text("SELECT title FROM chats"))
+            assert result.scalars().all() == ["Сохраненный чат"]
+    finally:
+        await engine.dispose()
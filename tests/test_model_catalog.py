@@ -0,0 +1,47 @@
+import asyncio
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from app.database.db import Base
+from app.models.models import ChatModel
+from app.services.model_catalog import ModelCatalogRefresher
+
+
+class SlowOllama:
+    """Заглушка Ollama с медленным /api/tags и счетчиком вызовов"""
+    
+    def __init__(self):
+        self.calls = 0
+    
+    async def list_models(self):
+        self.calls += 1
+        await asyncio.sleep(0.05)
+        return [{"name": "alpha", "details": {"parameter_size": "7B"}}]
+
+
+@pytest.mark.asyncio
+async def test_refresh_is_single_flight_and_debounced(tmp_path):
+    """Одновременные обновления и триггеры склеиваются в одну синхронизацию"""
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'catalog.db'}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    ollama = SlowOllama()
+    refresher = ModelCatalogRefresher(ollama, session_factory, interval=0, debounce=0.01)
+    try:
+        results = await asyncio.gather(*(refresher.refresh() for _ in range(5)))
+        assert ollama.calls == 1
+        assert results[0] == {"added": 1, "updated": 0, "removed": 0}
+        assert all(r is results[0] for r in results)
+        
+        for _ in range(5):
+            refresher.trigger()
+        await asyncio.sleep(0.2)
+        assert ollama.calls == 2
+        assert refresher.status()["syncs_total"] == 2
+        
+        async with session_factory() as db:
+            assert [m.name for m in await ChatModel.get_all(db)] == ["alpha"]
+    finally:
+        await refresher.stop()
+        await engine.dispose()
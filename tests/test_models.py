@@ -1,6 +1,9 @@
 import json
 import pytest
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from app.database.db import Base
 from app.models.models import Chat, Message, ChatModel, ModelSettings, PromptTemplate
 
 @pytest.mark.asyncio
@@ -97,9 +100,9 @@ async def test_model_settings(db_session: AsyncSession):
     # Создаем настройки для модели
     settings = ModelSettings(
         model_id=model.id,
-        temperature="0.7",
-        top_p="0.9",
-        top_k="40",
+        temperature=0.7,
+        top_p=0.9,
+        top_k=40,
         system_prompt="Тестовый системный промпт"
     )
     db_session.add(settings)
@@ -108,17 +111,17 @@ async def test_model_settings(db_session: AsyncSession):
     # Получаем настройки по ID модели
     settings_from_db = await ModelSettings.get_by_model_id(db_session, model.id)
     assert settings_from_db is not None
-    assert settings_from_db.temperature == "0.7"
-    assert settings_from_db.top_p == "0.9"
-    assert settings_from_db.top_k == "40"
+    assert settings_from_db.temperature == 0.7
+    assert settings_from_db.top_p == 0.9
+    assert settings_from_db.top_k == 40
     assert settings_from_db.system_prompt == "Тестовый системный промпт"
     
     # Обновляем настройки
-    settings.temperature = "0.8"
+    settings.temperature = 0.8
     await db_session.commit()
     
     settings_from_db = await ModelSettings.get_by_model_id(db_session, model.id)
-    assert settings_from_db.temperature == "0.8"
+    assert settings_from_db.temperature == 0.8
 
 @pytest.mark.asyncio
 async def test_prompt_template_model(db_session: AsyncSession):
@@ -152,4 +155,69 @@ async def test_prompt_template_model(db_session: AsyncSession):
     
     # Проверяем, что шаблон удален
     template_from_db = await PromptTemplate.get_by_id(db_session, template.id)
-    assert template_from_db is None 
\ No newline at end of file
+    assert template_from_db is None 
+@pytest.mark.asyncio
+async def test_message_pagination(db_session: AsyncSession):
+    """Тест keyset-пагинации сообщений чата"""
+    chat = Chat(title="Тестовый чат для пагинации")
+    db_session.add(chat)
+    await db_session.commit()
+    
+    created = []
+    for i in range(7):
+        created.append(await Message.create(db_session, chat_id=chat.id, role="user", content=f"Сообщение {i}"))
+    ids = [m.id for m in created]
+    
+    # Последние N сообщений в хронологическом порядке
+    recent = await Message.get_recent(db_session, chat.id, limit=3)
+    assert [m.id for m in recent] == ids[-3:]
+    
+    # Страница перед курсором
+    page = await Message.get_page(db_session, chat.id, before=ids[4], limit=3)
+    assert [m.id for m in page] == ids[1:4]
+    
+    # Страница после курсора
+    page = await Message.get_page(db_session, chat.id, after=ids[1], limit=2)
+    assert [m.id for m in page] == ids[2:4]
+    
+    assert await Message.count_by_chat_id(db_session, chat.id) == 7
+    
+    await Chat.delete(db_session, chat.id)
+
+@pytest.mark.asyncio
+async def test_model_sync(tmp_path):
+    """Тест пакетной синхронизации каталога моделей с Ollama"""
+    # Отдельная база, чтобы удаление моделей не затронуло другие тесты
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'sync.db'}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    try:
+        async with session_factory() as db:
+            api_models = [
+                {"name": "alpha", "details": {"parameter_size": "7B"}},
+                {"name": "beta", "details": {"parameter_size": "3B"}},
+                {"name": "gamma"},
+            ]
+            stats = await ChatModel.sync(db, api_models, system_prompt="Промпт")
+            assert stats == {"added": 3, "updated": 0, "removed": 0}
+            
+            beta = await ChatModel.get_by_name(db, "beta")
+            db.add(Chat(title="Чат с beta", model_id=beta.id))
+            await db.commit()
+            
+            # alpha сменила размер, beta и gamma пропали, beta используется в чате
+            stats = await ChatModel.sync(db, [{"name": "alpha", "details": {"parameter_size": "8B"}}], system_prompt="Промпт")
+            assert stats == {"added": 0, "updated": 1, "removed": 1}
+            
+            db.expire_all()
+            models = {m.name: m for m in await ChatModel.get_all(db)}
+            assert set(models) == {"alpha", "beta"}
+            assert models["alpha"].description == "Модель alpha (8B)"
+            
+            settings = await db.execute(select(ModelSettings))
+            settings = settings.scalars().all()
+            assert sorted(s.model_id for s in settings) == sorted(m.id for m in models.values())
+            assert all(s.system_prompt == "Промпт" and s.temperature == 0.7 for s in settings)
+    finally:
+        await engine.dispose()
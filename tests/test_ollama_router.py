@@ -0,0 +1,35 @@
+import pytest
+from app.services.ollama_router import OllamaRouter, parse_backends
+
+
+def test_parse_backends():
+    """Тест разбора списка адресов Ollama"""
+    assert parse_backends("http://a:11434/api/, http://b:11434/api") == ["http://a:11434/api", "http://b:11434/api"]
+    assert parse_backends("http://a:11434/api") == ["http://a:11434/api"]
+    with pytest.raises(ValueError):
+        OllamaRouter(parse_backends(""))
+
+
+def test_pick_least_loaded_backend_with_model():
+    """Тест выбора наименее загруженного доступного бэкенда, на котором есть модель"""
+    router = OllamaRouter(["http://a", "http://b", "http://c"])
+    a, b, c = router.backends
+    router.mark_healthy(a, [{"name": "llama3:latest"}])
+    router.mark_healthy(b, [{"name": "llama3:latest"}, {"name": "mistral:latest"}])
+    router.mark_healthy(c, [{"name": "mistral:latest"}])
+
+    with router.lease(a):
+        # Имя без тега совпадает с :latest
+        assert router.pick("llama3") is b
+        with router.lease(b), router.lease(b):
+            assert router.pick("llama3") is a
+    # При равной нагрузке - тот, что обслужил меньше запросов
+    assert router.pick("mistral") is c
+
+    # Недоступный бэкенд пропускается, пока есть другие
+    router.mark_failed(c, ConnectionError("refused"))
+    assert router.pick("mistral") is b
+    assert router.pick("mistral", exclude=[b]) is c
+
+    # Модели нет ни на одном сервере: берем любой доступный
+    assert router.pick("unknown") in (a, c)
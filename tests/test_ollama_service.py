@@ -0,0 +1,133 @@
+import json
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from app.services.ollama_service import OllamaService, StreamError
+
+
+async def _tags(request):
+    return web.json_response({"models": [{"name": "test-model"}]})
+
+
+async def start_ollama_server():
+    """Поднимает локальный заглушечный сервер Ollama API."""
+    app = web.Application()
+    app.router.add_get("/api/tags", _tags)
+    server = TestServer(app)
+    await server.start_server()
+    return server
+
+
+@pytest.mark.asyncio
+async def test_shared_session_reused():
+    """Тест повторного использования общей сессии и пула соединений"""
+    ollama_server = await start_ollama_server()
+    service = OllamaService(base_url=str(ollama_server.make_url("/api")))
+    try:
+        for _ in range(3):
+            models = await service.list_models()
+            assert models == [{"name": "test-model"}]
+
+        stats = service.pool_stats()
+        assert stats["sessions_created"] == 1
+        assert stats["requests_total"] == 3
+        assert stats["active"] == 0
+        # Соединение осталось в пуле keep-alive
+        assert stats["idle"] == 1
+    finally:
+        await service.close()
+        await ollama_server.close()
+
+    stats = service.pool_stats()
+    assert stats["idle"] == 0
+
+
+async def start_chat_server(name: str, models):
+    """Заглушка Ollama с /api/tags и потоковым /api/chat, отвечающая своим именем."""
+    async def tags(request):
+        return web.json_response({"models": [{"name": model} for model in models]})
+
+    async def chat(request):
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await response.prepare(request)
+        await response.write(json.dumps({"message": {"content": name}, "done": False}).encode() + b"\n")
+        await response.write(json.dumps({"done": True}).encode() + b"\n")
+        return response
+
+    app = web.Application()
+    app.router.add_get("/api/tags", tags)
+    app.router.add_post("/api/chat", chat)
+    server = TestServer(app)
+    await server.start_server()
+    return server
+
+
+@pytest.mark.asyncio
+async def test_routes_generation_to_backend_with_model():
+    """Тест выбора бэкенда по модели и объединения списков моделей"""
+    first = await start_chat_server("first", ["alpha", "shared"])
+    second = await start_chat_server("second", ["beta", "shared"])
+    service = OllamaService(base_url=f"{first.make_url('/api')},{second.make_url('/api')}")
+    try:
+        models = await service.list_models()
+        assert [m["name"] for m in models] == ["alpha", "shared", "beta"]
+
+        chunks = [chunk async for chunk in service.chat_stream("beta", [{"role": "user", "content": "?"}])]
+        assert chunks == ["second"]
+        chunks = [chunk async for chunk in service.chat_stream("alpha", [{"role": "user", "content": "?"}])]
+        assert chunks == ["first"]
+    finally:
+        await service.close()
+        await first.close()
+        await second.close()
+
+
+@pytest.mark.asyncio
+async def test_retries_on_connection_error_before_first_token(monkeypatch):
+    """Тест повтора генерации на другом бэкенде, если первый не принимает соединения"""
+    monkeypatch.setattr("app.services.ollama_service.OLLAMA_RETRY_BACKOFF", 0)
+    alive = await start_chat_server("alive", ["alpha"])
+    # Порт свободен: соединение будет отклонено
+    dead = await start_chat_server("dead", ["alpha"])
+    dead_url = str(dead.make_url("/api"))
+    await dead.close()
+
+    service = OllamaService(base_url=f"{dead_url},{alive.make_url('/api')}")
+    try:
+        chunks = [chunk async for chunk in service.chat_stream("alpha", [{"role": "user", "content": "?"}])]
+        assert chunks == ["alive"]
+
+        dead_backend, alive_backend = service.router.backends
+        assert not dead_backend.healthy
+        assert dead_backend.failures == 1
+        assert alive_backend.healthy
+        assert service.router.pick("alpha") is alive_backend
+    finally:
+        await service.close()
+        await alive.close()
+
+
+@pytest.mark.asyncio
+async def test_stream_cut_after_first_token_ends_with_error_marker():
+    """Тест: обрыв потока после первого токена отмечается фрагментом StreamError"""
+    async def chat(request):
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await response.prepare(request)
+        await response.write(json.dumps({"message": {"content": "начало"}, "done": False}).encode() + b"\n")
+        # Итоговой строки с done нет: сервер закрывает соединение посреди ответа
+        request.transport.close()
+        return response
+
+    app = web.Application()
+    app.router.add_post("/api/chat", chat)
+    server = TestServer(app)
+    await server.start_server()
+    service = OllamaService(base_url=str(server.make_url("/api")))
+    try:
+        chunks = [chunk async for chunk in service.chat_stream("alpha", [{"role": "user", "content": "?"}])]
+        assert chunks[0] == "начало"
+        assert isinstance(chunks[-1], StreamError)
+        assert not any(isinstance(chunk, StreamError) for chunk in chunks[:-1])
+    finally:
+        await service.close()
+        await server.close()
@@ -0,0 +1,110 @@
+import asyncio
+import pytest
+from app.services.response_cache import ResponseCache
+from app.services.ollama_service import StreamError
+
+
+def _generation(temperature=0.0, content="Привет"):
+    return {
+        "model": "alpha",
+        "messages": [{"role": "system", "content": "Помощник"}, {"role": "user", "content": content}],
+        "options": {"temperature": temperature, "top_k": 40},
+        "keep_alive": "5m",
+    }
+
+
+class CountingSource:
+    """Заглушка генерации с подсчетом вызовов"""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.calls = 0
+
+    async def stream(self, **generation):
+        self.calls += 1
+        for chunk in self.chunks:
+            yield chunk
+
+    async def text(self, cache, generation):
+        return "".join([chunk async for chunk in cache.stream(generation, self.stream)])
+
+
+def test_key_and_default_mode():
+    """Ключ зависит от модели, параметров и контекста; по умолчанию кэшируется только temperature 0"""
+    cache = ResponseCache(mode="auto")
+    assert cache.key_for(_generation()) == cache.key_for({**_generation(), "keep_alive": "1h"})
+    assert cache.key_for(_generation()) != cache.key_for(_generation(content="Пока"))
+    assert cache.key_for(_generation(temperature=0.7)) is None
+    assert cache.key_for(_generation(temperature=0.7), use_cache=True) is not None
+    assert cache.key_for(_generation(), use_cache=False) is None
+    assert ResponseCache(mode="off").key_for(_generation(), use_cache=True) is None
+
+
+@pytest.mark.asyncio
+async def test_stream_replays_cached_answer():
+    """Повторный запрос отдается из кэша тем же текстом, прерванная генерация не кэшируется"""
+    cache = ResponseCache(mode="auto", maxsize=8, ttl=60)
+    source = CountingSource(["Добрый ", "день, ", "чем помочь?"])
+
+    # Генерацию прервали после первого токена
+    stream = cache.stream(_generation(), source.stream)
+    assert await stream.__anext__() == "Добрый "
+    await stream.aclose()
+
+    first = [chunk async for chunk in cache.stream(_generation(), source.stream)]
+    second = [chunk async for chunk in cache.stream(_generation(), source.stream)]
+    assert source.calls == 2
+    assert "".join(second) == "".join(first) == "Добрый день, чем помочь?"
+    assert len(second) > 1
+
+    # Ошибки генерации не кэшируются
+    failing = CountingSource([StreamError("Ошибка: 500")])
+    for _ in range(2):
+        await failing.text(cache, _generation(content="Сломай"))
+    assert failing.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_stream_failed_midway_not_cached():
+    """Тест: ответ, оборвавшийся ошибкой после части текста, не кэшируется"""
+    cache = ResponseCache(mode="auto", maxsize=8, ttl=60)
+    failing = CountingSource(["Добрый ", "день", StreamError("Ошибка: соединение разорвано")])
+
+    chunks = [chunk async for chunk in cache.stream(_generation(), failing.stream)]
+    assert chunks == ["Добрый ", "день", "Ошибка: соединение разорвано"]
+    assert isinstance(chunks[-1], StreamError)
+    assert await cache.get(cache.key_for(_generation())) is None
+
+    # Поток без итоговой строки: пустой маркер доходит до потребителя
+    truncated = CountingSource(["Добрый ", StreamError("")])
+    chunks = [chunk async for chunk in cache.stream(_generation(), truncated.stream)]
+    assert chunks == ["Добрый ", ""] and isinstance(chunks[-1], StreamError)
+    assert await cache.get(cache.key_for(_generation())) is None
+    assert cache.stats()["stores"] == 0
+
+
+@pytest.mark.asyncio
+async def test_persistent_tier_survives_restart(tmp_path):
+    """Ответ из SQLite-уровня доступен новому экземпляру кэша"""
+    path = str(tmp_path / "responses.db")
+    source = CountingSource(["42"])
+
+    cache = ResponseCache(mode="auto", db_path=path)
+    assert await source.text(cache, _generation()) == "42"
+    await cache.close()
+
+    restarted = ResponseCache(mode="auto", db_path=path)
+    try:
+        assert await source.text(restarted, _generation()) == "42"
+        assert source.calls == 1
+        assert restarted.stats()["db_hits"] == 1
+    finally:
+        await restarted.close()
+
+    # Просроченные записи не отдаются
+    expired = ResponseCache(mode="auto", db_path=path, ttl=0)
+    try:
+        await asyncio.sleep(0.01)
+        assert await expired.get(cache.make_key(_generation())) is None
+    finally:
+        await expired.close()
@@ -1,7 +1,47 @@
+import json
+import asyncio
+import threading
+import contextlib
+import anyio
 import pytest
 from fastapi.testclient import TestClient
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.models.models import ChatModel, ModelSettings, PromptTemplate
+from sqlalchemy.orm import Session
+from starlette.websockets import WebSocketDisconnect
+from app.database.db import get_session_factory
+from app.services.live_generations import live_generations
+from app.models.models import Chat, Message, ChatModel, ModelSettings, PromptTemplate
+from app.services.ollama_service import StreamError, get_ollama_service
+from app.services.generation_scheduler import GenerationScheduler
+from app.services.response_cache import ResponseCache
+from main import app
+
+
+@pytest.fixture
+async def chat(request, db_session: AsyncSession) -> Chat:
+    """Чат со своей моделью; база общая на сессию, поэтому модель названа по тесту."""
+    model = ChatModel(name=f"model-{request.node.name}", display_name=request.node.name)
+    chat = Chat(title=request.node.name, model=model)
+    db_session.add(chat)
+    await db_session.commit()
+    return chat
+
+
+@pytest.fixture
+def override_ollama():
+    """Подменяет OllamaService приложения; после теста возвращает прежнюю зависимость."""
+    previous = app.dependency_overrides.get(get_ollama_service)
+    
+    def override(service):
+        app.dependency_overrides[get_ollama_service] = lambda: service
+        return service
+    
+    yield override
+    if previous is None:
+        app.dependency_overrides.pop(get_ollama_service, None)
+    else:
+        app.dependency_overrides[get_ollama_service] = previous
 
 # Тесты для маршрутов чатов
 @pytest.mark.asyncio
@@ -168,4 +208,461 @@ async def test_save_model_settings(test_client: TestClient, db_session: AsyncSes
     assert settings is not None
     assert settings.temperature == 0.8
     assert settings.max_tokens == 2048
-    assert settings.system_prompt == "Новый системный промпт для тестов" 
\ No newline at end of file
+    assert settings.system_prompt == "Новый системный промпт для тестов" 
+
+@pytest.mark.asyncio
+async def test_edit_chat_page_does_not_create_settings(test_client: TestClient, db_session: AsyncSession, chat: Chat):
+    """Тест: страница редактирования показывает настройки по умолчанию, не создавая строку"""
+    response = test_client.get(f"/chat/chats/{chat.id}/edit")
+    assert response.status_code == 200
+    assert 'name="max_tokens" min="64" max="4096" value="1024"' in response.text
+    assert await ModelSettings.get_by_model_id(db_session, chat.model_id) is None
+
+
+class FakeOllamaService:
+    """Заглушка OllamaService, отдающая заранее заданные токены"""
+    
+    def __init__(self, chunks):
+        self.chunks = chunks
+    
+    async def chat_stream(self, **kwargs):
+        self.last_call = kwargs
+        for chunk in self.chunks:
+            yield chunk
+
+@pytest.mark.asyncio
+async def test_add_message_stream(test_client: TestClient, db_session: AsyncSession, chat: Chat, override_ollama):
+    """Тест потоковой отправки сообщения (NDJSON)"""
+    fake_service = FakeOllamaService(["При", "вет"])
+    override_ollama(fake_service)
+    response = test_client.post(
+        f"/chat/chats/{chat.id}/messages/stream",
+        json={"content": "Привет"}
+    )
+    
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    
+    frames = [json.loads(line) for line in response.text.splitlines() if line]
+    assert frames[0]["type"] == "user_message"
+    assert [f["chunk"] for f in frames if "chunk" in f] == ["При", "вет"]
+    assert frames[-1]["done"] is True
+    assert frames[-1]["full_response"] == "Привет"
+    
+    # В модель ушел структурированный контекст для /api/chat
+    assert fake_service.last_call["messages"][-1] == {"role": "user", "content": "Привет"}
+    # Все параметры сэмплирования передаются в options
+    assert set(fake_service.last_call["options"]) == {
+        "temperature", "top_p", "top_k", "num_predict", "num_ctx", "repeat_penalty"
+    }
+    assert fake_service.last_call["keep_alive"] == "5m"
+    
+    # Ответ ассистента сохранен в БД
+    messages = await Message.get_by_chat_id(db_session, chat.id)
+    assert [m.role for m in messages] == ["user", "assistant"]
+    assert messages[-1].content == "Привет"
+
+@pytest.mark.asyncio
+async def test_websocket_coalesces_chunks(test_client: TestClient, db_session: AsyncSession, chat: Chat, override_ollama):
+    """Тест склейки токенов в кадры WebSocket по политике из рукопожатия"""
+    fake_service = FakeOllamaService(["a" * 3] * 10)
+    override_ollama(fake_service)
+    with test_client.websocket_connect(f"/chat/ws/{chat.id}?flush_ms=1000&flush_bytes=12") as ws:
+        ws.send_json({"message": "Привет", "model": chat.model.name})
+        assert ws.receive_json()["type"] == "generation"
+        frames = []
+        while True:
+            frame = ws.receive_json()
+            frames.append(frame)
+            if frame["done"]:
+                break
+    
+    # 30 байт при пороге 12 байт: два полных кадра и остаток при завершении
+    assert [f["chunk"] for f in frames[:-1]] == ["a" * 12, "a" * 12, "a" * 6]
+    assert frames[-1]["full_response"] == "a" * 30
+
+@pytest.mark.asyncio
+async def test_add_message_queue_full(test_client: TestClient, db_session: AsyncSession, chat: Chat, monkeypatch):
+    """Тест отказа с 429, когда очередь генерации модели заполнена"""
+    # Единственный слот модели занят, ждать в очереди нельзя
+    scheduler = GenerationScheduler(concurrency=1, limits={}, queue_size=0)
+    scheduler._queue(chat.model.name).active = 1
+    monkeypatch.setattr("app.routes.chat_routes.generation_scheduler", scheduler)
+    
+    response = test_client.post(f"/chat/chats/{chat.id}/messages", json={"content": "Привет"})
+    assert response.status_code == 429
+    
+    response = test_client.post(f"/chat/chats/{chat.id}/messages/stream", json={"content": "Привет"})
+    assert response.status_code == 429
+    
+    # Очередь заполнилась между предварительной проверкой и записью сообщения
+    monkeypatch.setattr(scheduler, "is_full", lambda model: False)
+    response = test_client.post(f"/chat/chats/{chat.id}/messages/stream", json={"content": "Привет"})
+    assert response.status_code == 429
+    assert scheduler.stats()["rejected_total"] == 1
+    
+    # Сообщение пользователя не сохраняется при отказе
+    assert await Message.get_by_chat_id(db_session, chat.id) == []
+
+@pytest.mark.asyncio
+async def test_add_message_prepares_turn_before_slot(test_client: TestClient, db_session: AsyncSession, chat: Chat, override_ollama, monkeypatch):
+    """Тест: история читается, а ход записывается в БД до занятия слота генерации"""
+    session_factory = app.dependency_overrides[get_session_factory]()
+    rows_at_slot = []
+    
+    class RecordingScheduler(GenerationScheduler):
+        @contextlib.asynccontextmanager
+        async def slot(self, *args, **kwargs):
+            async with session_factory() as db:
+                messages = await Message.get_by_chat_id(db, chat.id)
+                rows_at_slot.append([(m.role, m.status) for m in messages])
+            async with super().slot(*args, **kwargs):
+                yield
+    
+    scheduler = RecordingScheduler(concurrency=1, limits={}, queue_size=1)
+    monkeypatch.setattr("app.routes.chat_routes.generation_scheduler", scheduler)
+    from app.routes import chat_routes
+    prepare = chat_routes._prepare_generation
+    active_during_prepare = []
+    
+    async def recording_prepare(*args, **kwargs):
+        active_during_prepare.append(scheduler.stats()["models"].get(chat.model.name, {}).get("active", 0))
+        return await prepare(*args, **kwargs)
+    
+    monkeypatch.setattr("app.routes.chat_routes._prepare_generation", recording_prepare)
+    override_ollama(FakeOllamaService(["Ответ"]))
+    response = test_client.post(f"/chat/chats/{chat.id}/messages", json={"content": "Вопрос"})
+    
+    assert response.status_code == 200
+    assert active_during_prepare == [0]
+    assert rows_at_slot == [[("user", "complete"), ("assistant", "streaming")]]
+    assert scheduler.stats()["models"][chat.model.name]["active"] == 0
+
+class StalledOllamaService:
+    """Заглушка OllamaService: отдает токены и зависает, пока генерацию не отменят"""
+    
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.cancelled = False
+    
+    async def chat_stream(self, **kwargs):
+        for chunk in self.chunks:
+            yield chunk
+        try:
+            await asyncio.sleep(3600)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+
+@pytest.mark.asyncio
+async def test_websocket_stop_saves_truncated_answer(test_client: TestClient, db_session: AsyncSession, chat: Chat, override_ollama):
+    """Тест остановки генерации кадром stop: запрос к модели отменяется, частичный ответ сохраняется"""
+    fake_service = StalledOllamaService(["Длинный ", "ответ"])
+    override_ollama(fake_service)
+    with test_client.websocket_connect(f"/chat/ws/{chat.id}?flush=token") as ws:
+        ws.send_json({"message": "Расскажи историю", "model": chat.model.name})
+        assert ws.receive_json()["type"] == "generation"
+        assert ws.receive_json()["chunk"] == "Длинный "
+        assert ws.receive_json()["chunk"] == "ответ"
+        ws.send_json({"type": "stop"})
+        frame = ws.receive_json()
+    
+    assert frame["done"] is True
+    assert frame["truncated"] is True
+    assert frame["full_response"] == "Длинный ответ"
+    assert fake_service.cancelled
+    
+    messages = await Message.get_by_chat_id(db_session, chat.id)
+    assert [(m.role, m.truncated) for m in messages] == [("user", False), ("assistant", True)]
+    assert messages[-1].content == "Длинный ответ"
+
+@pytest.mark.asyncio
+async def test_generation_error_not_saved_as_answer(test_client: TestClient, db_session: AsyncSession, chat: Chat, override_ollama):
+    """Тест: ошибка Ollama после части ответа приходит отдельно и не попадает в сохраненный текст"""
+    override_ollama(FakeOllamaService(["Hi", StreamError("Ошибка: boom")]))
+    streamed = test_client.post(f"/chat/chats/{chat.id}/messages/stream", json={"content": "Поток"})
+    rest = test_client.post(f"/chat/chats/{chat.id}/messages", json={"content": "Целиком"})
+    with test_client.websocket_connect(f"/chat/ws/{chat.id}?flush=token") as ws:
+        ws.send_json({"message": "Сокет", "model": chat.model.name})
+        while True:
+            frame = ws.receive_json()
+            if frame.get("done"):
+                break
+    
+    frames = [json.loads(line) for line in streamed.text.splitlines() if line]
+    assert [f["chunk"] for f in frames if "chunk" in f] == ["Hi"]
+    assert frames[-1] == {"error": "Ошибка: boom", "done": True}
+    assert rest.status_code == 502
+    assert rest.json()["detail"] == "Ошибка: boom"
+    assert frame["error"] == "Ошибка: boom"
+    assert frame["full_response"] == "Hi"
+    assert frame["truncated"] is True
+    
+    messages = await Message.get_by_chat_id(db_session, chat.id)
+    answers = [m for m in messages if m.role == "assistant"]
+    assert [(m.content, m.truncated, m.status) for m in answers] == [("Hi", True, "complete")] * 3
+
+@pytest.mark.asyncio
+async def test_add_message_stream_from_response_cache(test_client: TestClient, db_session: AsyncSession, chat: Chat, override_ollama, monkeypatch):
+    """Тест отдачи повторного ответа из кэша в тех же кадрах потока"""
+    monkeypatch.setattr("app.routes.chat_routes.response_cache", ResponseCache(mode="auto"))
+    first_service = FakeOllamaService(["Один ", "ответ"])
+    cached_service = FakeOllamaService(["Другой ответ"])
+    
+    def send(service):
+        override_ollama(service)
+        response = test_client.post(
+            f"/chat/chats/{chat.id}/messages/stream",
+            json={"content": "Вопрос", "cache": True}
+        )
+        return [json.loads(line) for line in response.text.splitlines() if line]
+    
+    send(first_service)
+    # Удаляем ответ, чтобы контекст второго запроса совпал с первым
+    messages = await Message.get_by_chat_id(db_session, chat.id)
+    for message in messages:
+        await db_session.delete(message)
+    await db_session.commit()
+    
+    frames = send(cached_service)
+    assert not hasattr(cached_service, "last_call")
+    assert [f["chunk"] for f in frames if "chunk" in f] == ["Один ", "ответ"]
+    assert frames[-1]["full_response"] == "Один ответ"
+
+@pytest.mark.asyncio
+async def test_add_message_commits_once(test_client: TestClient, db_session: AsyncSession, chat: Chat, override_ollama):
+    """Тест: ход чата сохраняется транзакцией начала и транзакцией завершения ответа"""
+    commits = []
+    
+    def on_commit(session):
+        commits.append(session)
+    
+    override_ollama(FakeOllamaService(["Ответ"]))
+    event.listen(Session, "after_commit", on_commit)
+    try:
+        response = test_client.post(f"/chat/chats/{chat.id}/messages", json={"content": "Вопрос"})
+    finally:
+        event.remove(Session, "after_commit", on_commit)
+    
+    assert response.status_code == 200
+    # Вопрос и пустая строка ответа, затем итоговый текст; короткий ответ без промежуточных записей
+    assert len(commits) == 2
+    body = response.json()
+    assert body["user_message"]["id"] < body["assistant_message"]["id"]
+    # Значение по умолчанию со стороны БД получено без отдельного SELECT
+    assert body["assistant_message"]["truncated"] is False
+    assert body["assistant_message"]["status"] == "complete"
+    
+    messages = await Message.get_by_chat_id(db_session, chat.id)
+    assert [(m.role, m.content) for m in messages] == [("user", "Вопрос"), ("assistant", "Ответ")]
+
+class CountingSessionFactory:
+    """Фабрика сессий, считающая открытые и открывавшиеся сессии"""
+    
+    def __init__(self, factory):
+        self.factory = factory
+        self.open = 0
+        self.opened = 0
+    
+    @contextlib.asynccontextmanager
+    async def __call__(self):
+        self.open += 1
+        self.opened += 1
+        try:
+            async with self.factory() as session:
+                yield session
+        finally:
+            self.open -= 1
+
+@pytest.mark.asyncio
+async def test_websocket_releases_session_between_turns(test_client: TestClient, db_session: AsyncSession, chat: Chat, override_ollama):
+    """Тест: WebSocket открывает короткие сессии на чтение хода и записи ответа, не держа их между ходами"""
+    # Тестовая фабрика сессий из conftest
+    override = app.dependency_overrides[get_session_factory]
+    sessions = CountingSessionFactory(override())
+    app.dependency_overrides[get_session_factory] = lambda: sessions
+    override_ollama(FakeOllamaService(["Ответ"]))
+    try:
+        with test_client.websocket_connect(f"/chat/ws/{chat.id}?flush=token") as ws:
+            ws.send_json({"message": "Вопрос", "model": chat.model.name})
+            while not ws.receive_json().get("done"):
+                pass
+            # Проверка чата, чтение хода, начало и завершение ответа; между ходами сессия не держится
+            assert sessions.open == 0
+            assert sessions.opened == 4
+    finally:
+        app.dependency_overrides[get_session_factory] = override
+    
+    messages = await Message.get_by_chat_id(db_session, chat.id)
+    assert [(m.role, m.content) for m in messages] == [("user", "Вопрос"), ("assistant", "Ответ")]
+
+@pytest.mark.asyncio
+async def test_websocket_heartbeat_and_idle_timeout(test_client: TestClient, db_session: AsyncSession, monkeypatch):
+    """Тест ping молчащему клиенту и закрытия сокета по простою"""
+    chat = Chat(title="Простаивающий чат")
+    db_session.add(chat)
+    await db_session.commit()
+    monkeypatch.setattr("app.routes.chat_routes.WS_PING_INTERVAL", 0.05)
+    monkeypatch.setattr("app.routes.chat_routes.WS_IDLE_TIMEOUT", 0.3)
+    
+    with test_client.websocket_connect(f"/chat/ws/{chat.id}") as ws:
+        ws.send_json({"type": "ping"})
+        assert ws.receive_json() == {"type": "pong"}
+        assert ws.receive_json() == {"type": "ping"}
+        with pytest.raises(WebSocketDisconnect) as exc_info:
+            while True:
+                assert ws.receive_json() == {"type": "ping"}
+        assert exc_info.value.code == 1000
+
+@pytest.mark.asyncio
+async def test_websocket_connection_limit(test_client: TestClient, db_session: AsyncSession, monkeypatch):
+    """Тест предела открытых WebSocket-соединений на процесс"""
+    chat = Chat(title="Много вкладок")
+    db_session.add(chat)
+    await db_session.commit()
+    monkeypatch.setattr("app.routes.chat_routes.WS_MAX_CONNECTIONS", 1)
+    
+    with test_client.websocket_connect(f"/chat/ws/{chat.id}") as first:
+        with test_client.websocket_connect(f"/chat/ws/{chat.id}") as second:
+            assert second.receive_json()["code"] == 503
+            with pytest.raises(WebSocketDisconnect) as exc_info:
+                second.receive_json()
+            assert exc_info.value.code == 1013
+        # Первое соединение продолжает работать
+        first.send_json({"type": "ping"})
+        assert first.receive_json() == {"type": "pong"}
+
+class GatedOllamaService:
+    """Заглушка OllamaService: первый токен сразу, второй - после открытия gate"""
+    
+    def __init__(self):
+        self.gate = threading.Event()
+    
+    async def chat_stream(self, **kwargs):
+        yield "Первая "
+        while not self.gate.is_set():
+            await asyncio.sleep(0.01)
+        yield "вторая"
+
+@pytest.mark.asyncio
+async def test_websocket_resume_after_disconnect(test_client: TestClient, db_session: AsyncSession, chat: Chat, override_ollama):
+    """Тест: генерация переживает отключение клиента, переподключение получает недостающий текст"""
+    fake_service = GatedOllamaService()
+    override_ollama(fake_service)
+    # Общий event loop для соединений, чтобы генерация пережила первое из них
+    with anyio.from_thread.start_blocking_portal() as portal:
+        test_client.portal = portal
+        with test_client.websocket_connect(f"/chat/ws/{chat.id}?flush=token") as ws:
+            ws.send_json({"message": "Вопрос", "model": chat.model.name})
+            generation_id = ws.receive_json()["id"]
+            received = ws.receive_json()["chunk"]
+        
+        with test_client.websocket_connect(f"/chat/ws/{chat.id}?flush=token") as ws:
+            ws.send_json({"type": "resume", "generation_id": "unknown", "offset": 0})
+            assert ws.receive_json()["code"] == 404
+            
+            ws.send_json({"type": "resume", "generation_id": generation_id, "offset": len(received)})
+            fake_service.gate.set()
+            frames = []
+            while True:
+                frame = ws.receive_json()
+                frames.append(frame)
+                if frame.get("done"):
+                    break
+        test_client.portal = None
+    
+    assert received == "Первая "
+    assert "".join(f["chunk"] for f in frames[:-1]) == "вторая"
+    assert frames[-1]["full_response"] == "Первая вторая"
+    assert frames[-1]["generation_id"] == generation_id
+    
+    messages = await Message.get_by_chat_id(db_session, chat.id)
+    assert [(m.role, m.content, m.truncated) for m in messages] == [
+        ("user", "Вопрос", False), ("assistant", "Первая вторая", False)
+    ]
+
+@pytest.mark.asyncio
+async def test_websocket_generation_saved_without_client(test_client: TestClient, db_session: AsyncSession, chat: Chat, override_ollama):
+    """Тест: ответ дописывается и сохраняется, даже если клиент не вернулся"""
+    fake_service = GatedOllamaService()
+    override_ollama(fake_service)
+    with anyio.from_thread.start_blocking_portal() as portal:
+        test_client.portal = portal
+        with test_client.websocket_connect(f"/chat/ws/{chat.id}?flush=token") as ws:
+            ws.send_json({"message": "Вопрос", "model": chat.model.name})
+            generation_id = ws.receive_json()["id"]
+            ws.receive_json()
+        
+        fake_service.gate.set()
+        live = live_generations.get(generation_id)
+        portal.call(live.wait)
+        test_client.portal = None
+    
+    assert live.text == "Первая вторая" and not live.truncated
+    messages = await Message.get_by_chat_id(db_session, chat.id)
+    assert [(m.role, m.content) for m in messages] == [("user", "Вопрос"), ("assistant", "Первая вторая")]
+
+@pytest.mark.asyncio
+async def test_websocket_receives_generation_from_other_tab(test_client: TestClient, db_session: AsyncSession, chat: Chat, override_ollama):
+    """Тест: второй сокет того же чата получает ответ, запрошенный первым, через события чата"""
+    override_ollama(FakeOllamaService(["При", "вет"]))
+    with anyio.from_thread.start_blocking_portal() as portal:
+        test_client.portal = portal
+        with test_client.websocket_connect(f"/chat/ws/{chat.id}") as watcher:
+            # Ответ на ping означает, что сокет уже подписан на чат
+            watcher.send_json({"type": "ping"})
+            assert watcher.receive_json() == {"type": "pong"}
+            
+            with test_client.websocket_connect(f"/chat/ws/{chat.id}?flush=token") as ws:
+                ws.send_json({"message": "Вопрос", "model": chat.model.name})
+                frames = []
+                while True:
+                    frame = ws.receive_json()
+                    frames.append(frame)
+                    if frame.get("done"):
+                        break
+            
+            events = []
+            while not events or events[-1]["type"] != "done":
+                frame = watcher.receive_json()
+                assert frame["type"] == "chat_event"
+                events.append(frame["event"])
+        test_client.portal = None
+    
+    # Сокет, запросивший ответ, не получает свою генерацию повторно
+    assert all(frame.get("type") != "chat_event" for frame in frames)
+    generation_id = frames[0]["id"]
+    assert [e["type"] for e in events] == ["user_message", "generation", "chunk", "chunk", "done"]
+    assert all(e["generation_id"] == generation_id for e in events)
+    assert [(e["offset"], e["chunk"]) for e in events[2:4]] == [(0, "При"), (3, "вет")]
+    assert events[-1]["truncated"] is False
+    
+    messages = await Message.get_by_chat_id(db_session, chat.id)
+    # Вопрос виден другим вкладкам вместе с ответом
+    assert (events[0]["message_id"], events[0]["content"]) == (messages[-2].id, "Вопрос")
+    assert messages[-1].id == events[-1]["message_id"]
+    assert messages[-1].content == "Привет"
+
+@pytest.mark.asyncio
+async def test_websocket_receives_http_turn(test_client: TestClient, db_session: AsyncSession, chat: Chat, override_ollama):
+    """Тест: открытая вкладка получает вопрос и ответ хода, отправленного по HTTP"""
+    override_ollama(FakeOllamaService(["Да", "!"]))
+    with anyio.from_thread.start_blocking_portal() as portal:
+        test_client.portal = portal
+        with test_client.websocket_connect(f"/chat/ws/{chat.id}") as watcher:
+            watcher.send_json({"type": "ping"})
+            assert watcher.receive_json() == {"type": "pong"}
+            
+            response = test_client.post(f"/chat/chats/{chat.id}/messages/stream", json={"content": "Можно?"})
+            assert response.status_code == 200
+            
+            events = []
+            while not events or events[-1]["type"] != "done":
+                events.append(watcher.receive_json()["event"])
+        test_client.portal = None
+    
+    frames = [json.loads(line) for line in response.text.splitlines() if line]
+    assert [e["type"] for e in events] == ["user_message", "generation", "chunk", "chunk", "done"]
+    assert (events[0]["message_id"], events[0]["content"]) == (frames[0]["message"]["id"], "Можно?")
+    assert "".join(e["chunk"] for e in events if e["type"] == "chunk") == "Да!"
+    assert events[-1]["message_id"] == frames[-1]["message"]["id"]
@@ -0,0 +1,52 @@
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+from app.services.startup import StartupWarmup
+
+
+@pytest.mark.asyncio
+async def test_background_warmup_does_not_block():
+    """В фоновом режиме launch возвращается сразу, готовность - после прогрева"""
+    release = asyncio.Event()
+    
+    async def warm_up():
+        await release.wait()
+    
+    warmup = StartupWarmup(mode="background")
+    await warmup.launch(warm_up())
+    assert not warmup.ready
+    
+    release.set()
+    await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    assert warmup.ready
+    assert warmup.status()["error"] is None
+
+
+@pytest.mark.asyncio
+async def test_failed_warmup_still_ready():
+    """Ошибка прогрева не оставляет экземпляр навсегда неготовым"""
+    async def warm_up():
+        raise RuntimeError("Ollama недоступна")
+    
+    warmup = StartupWarmup(mode="blocking")
+    await warmup.launch(warm_up())
+    assert warmup.ready
+    assert warmup.status()["error"] == "Ollama недоступна"
+
+
+def test_readiness_endpoint(test_client: TestClient, monkeypatch):
+    """Эндпоинт готовности отвечает 503 до окончания прогрева и 200 после"""
+    warmup = StartupWarmup(mode="background")
+    monkeypatch.setattr("app.routes.health_routes.startup_warmup", warmup)
+    
+    assert test_client.get("/health/live").status_code == 200
+    
+    response = test_client.get("/health/ready")
+    assert response.status_code == 503
+    assert response.json()["status"] == "starting"
+    
+    warmup.finished_at = warmup.started_at = 1.0
+    response = test_client.get("/health/ready")
+    assert response.status_code == 200
+    assert response.json()["status"] == "ready"